@@ -0,0 +1,193 @@
+# benchmarks/bench_database.py
+"""
+on_message 1回あたりのDBオーバーヘッドを計測するベンチマーク。
+
+旧実装 (呼び出しごとに sqlite3.connect し、イベントループ上で同期実行) と
+現在の database.py の非同期API を、同時ユーザー数 N で比較する。
+
+使い方:
+    python benchmarks/bench_database.py --users 1000
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import database as db  # noqa: E402
+import rate_limiter  # noqa: E402
+
+
+# --- 旧実装 (connect-per-call) ---
+
+_legacy_lock = threading.Lock()
+
+
+def _create_legacy_tables():
+    with db.db_lock:
+        db._get_conn().execute("""
+        CREATE TABLE IF NOT EXISTS user_rate_limits (
+            discord_id TEXT PRIMARY KEY,
+            last_used DATETIME NOT NULL
+        )
+        """)
+
+
+def _legacy_get_user_state(discord_id):
+    with _legacy_lock:
+        conn = sqlite3.connect(db.DB_FILE)
+        row = conn.execute("SELECT state FROM user_states WHERE discord_id = ?", (discord_id,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+
+def _legacy_check_rate_limit(discord_id, seconds=60):
+    with _legacy_lock:
+        conn = sqlite3.connect(db.DB_FILE)
+        row = conn.execute("SELECT last_used FROM user_rate_limits WHERE discord_id = ?", (discord_id,)).fetchone()
+        conn.close()
+        if not row:
+            return True
+        return datetime.now() - datetime.fromisoformat(row[0]) >= timedelta(seconds=seconds)
+
+
+def _legacy_clear_user_state(discord_id):
+    with _legacy_lock:
+        conn = sqlite3.connect(db.DB_FILE)
+        conn.execute("DELETE FROM user_states WHERE discord_id = ?", (discord_id,))
+        conn.commit()
+        conn.close()
+
+
+def _legacy_get_calendar_id(discord_id):
+    with _legacy_lock:
+        conn = sqlite3.connect(db.DB_FILE)
+        row = conn.execute("SELECT calendar_id FROM user_calendars WHERE discord_id = ?", (discord_id,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+
+def _legacy_update_last_used(discord_id):
+    with _legacy_lock:
+        conn = sqlite3.connect(db.DB_FILE)
+        conn.execute("""
+        INSERT INTO user_rate_limits (discord_id, last_used) VALUES (?, ?)
+        ON CONFLICT(discord_id) DO UPDATE SET last_used=excluded.last_used
+        """, (discord_id, datetime.now().isoformat()))
+        conn.commit()
+        conn.close()
+
+
+async def _legacy_on_message(discord_id):
+    """旧 on_message のDBアクセス列 (すべてイベントループ上で同期実行)"""
+    if _legacy_get_user_state(discord_id) != "waiting_for_details":
+        return
+    if not _legacy_check_rate_limit(discord_id):
+        return
+    _legacy_clear_user_state(discord_id)
+    _legacy_get_calendar_id(discord_id)
+    await asyncio.sleep(0)  # Gemini / Calendar 呼び出しの代わり
+    _legacy_update_last_used(discord_id)
+
+
+# 全体枠でベンチマークが頭打ちにならないよう、ユーザー枠のみ既定値にする
+_limiter = rate_limiter.RateLimiter("bench", per_user="3/180", global_="1000000/60")
+
+
+async def _async_on_message(discord_id):
+    """現在の on_message のDBアクセス列"""
+    if await db.aget_user_state(discord_id) != "waiting_for_details":
+        return
+    if not _limiter.acquire(discord_id)[0]:
+        return
+    await db.aclear_user_state(discord_id)
+    await db.aget_calendar_id(discord_id)
+    await asyncio.sleep(0)
+
+
+# --- 計測 ---
+
+def _seed(users: int, journal_mode: str = "WAL"):
+    """全ユーザーを待機状態・カレンダー登録済みにする"""
+    db.close_db()
+    if os.path.exists(db.DB_FILE):
+        os.remove(db.DB_FILE)
+    db.init_db()
+    with db.db_lock:
+        conn = db._get_conn()
+        ids = [str(i) for i in range(users)]
+        conn.executemany("INSERT INTO user_calendars VALUES (?, ?)", [(i, f"{i}@example.com") for i in ids])
+        now = int(time.time())
+        conn.executemany("INSERT INTO user_states (discord_id, state, updated_at) VALUES (?, 'waiting_for_details', ?)", [(i, now) for i in ids])
+        conn.commit()
+        conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    return ids
+
+
+async def _loop_lag_monitor(stop: asyncio.Event, lags: list[float]):
+    """イベントループの遅延 (他のDMや heartbeat が待たされる時間) を計測する"""
+    interval = 0.005
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def _run(handler, ids):
+    latencies: list[float] = []
+    lags: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_loop_lag_monitor(stop, lags))
+    await asyncio.sleep(0.02)
+
+    async def one(discord_id):
+        start = time.perf_counter()
+        await handler(discord_id)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in ids))
+    total = time.perf_counter() - start
+    stop.set()
+    await monitor
+    return total, latencies, lags
+
+
+def _report(label, total, latencies, lags, users):
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"{label:<8} users={users} total={total * 1000:8.1f}ms "
+          f"per_msg={total / users * 1000:6.3f}ms p50={p50:8.1f}ms p99={p99:8.1f}ms "
+          f"loop_lag_max={max(lags, default=0) * 1000:8.1f}ms loop_lag_mean={statistics.fmean(lags or [0]) * 1000:6.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.sqlite3")
+
+        # 旧実装は WAL 未設定 (rollback journal) だった
+        ids = _seed(args.users, journal_mode="DELETE")
+        _create_legacy_tables()
+        db.close_db()
+        _report("before", *asyncio.run(_run(_legacy_on_message, ids)), args.users)
+
+        ids = _seed(args.users)
+        db.warm_cache()  # on_ready と同じくキャッシュを温めておく
+        _report("after", *asyncio.run(_run(_async_on_message, ids)), args.users)
+        db.close_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+# benchmarks/bench_e2e.py
+"""
+on_message とスラッシュコマンドを擬似的なDMで動かすエンドツーエンドのベンチマーク。
+on_message はジョブを保存するだけなので、ワーカーがそのジョブを処理し終えるまでを
+1メッセージの所要時間 (e2e) とし、on_message 自体の時間 (enqueue) も別に計測する。
+
+Discord・Gemini・Google Calendar はすべてローカルの代替実装に差し替え、
+遅延とエラー率を指定して同時ユーザー数ごとのスループットと各段階の p50/p99、
+ピークメモリ、最初の予定の登録結果が返るまでの時間 (first_event) を計測する。
+ネットワーク接続は不要 (discord.py などのライブラリは必要)。
+
+使い方:
+    python benchmarks/bench_e2e.py --users 1,10,100,1000
+    python benchmarks/bench_e2e.py --users 100 --gemini-latency 1.5 --calendar-error-rate 0.1
+    python benchmarks/bench_e2e.py --users 10 --events 10 --streaming
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("GOOGLE_SERVICE_ACCOUNT_FILE", "/nonexistent/service_account.json")
+
+import discord  # noqa: E402
+import httplib2  # noqa: E402
+from google.api_core import exceptions as api_exceptions  # noqa: E402
+from googleapiclient.errors import HttpError  # noqa: E402
+
+import database as db  # noqa: E402
+import gemini_handler  # noqa: E402
+import google_calendar as gcal  # noqa: E402
+import main as bot_main  # noqa: E402
+import rate_limiter  # noqa: E402
+from job_queue import RetryLater  # noqa: E402
+
+# 段階名 -> 所要時間(秒)のリスト
+timings: dict[str, list[float]] = defaultdict(list)
+# on_message 1回あたりのDiscord API呼び出し (送信・編集) 回数
+discord_calls: list[int] = []
+# discord_id -> ジョブの処理が終わったら完了する Future
+_job_done: dict[str, asyncio.Future] = {}
+
+
+def _timed(stage: str, func):
+    """コルーチン関数を包んで所要時間を timings に記録する"""
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            timings[stage].append(time.perf_counter() - start)
+    return wrapper
+
+
+# --- Gemini の代替 ---
+
+class FakeGeminiModel:
+    """generate_content_async だけを持つ Gemini モデルの代替"""
+
+    def __init__(self, latency: float, error_rate: float, events_per_message: int):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.events_per_message = events_per_message
+        self.calls = 0
+
+    def _events(self) -> list[dict]:
+        return [
+            {
+                "summary": f"ベンチマーク予定{i}",
+                "location": None,
+                "description": None,
+                "start_date": "2030-01-01",
+                "start_time": f"{9 + i % 10:02d}:00:00",
+                "end_date": "2030-01-01",
+                "end_time": f"{10 + i % 10:02d}:00:00",
+            }
+            for i in range(self.events_per_message)
+        ]
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        self.calls += 1
+        if stream:
+            return self._stream(self.latency * random.uniform(0.5, 1.5))
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.error_rate:
+            raise api_exceptions.ServiceUnavailable("fake")
+
+        # マイクロバッチのプロンプトにはIDごとの結果を返す
+        if "## ID:" in prompt:
+            count = prompt.count("## ID:")
+            return SimpleNamespace(text=json.dumps([{"id": str(i), "events": self._events()} for i in range(count)], ensure_ascii=False))
+        return SimpleNamespace(text=json.dumps(self._events(), ensure_ascii=False))
+
+    async def _stream(self, latency: float):
+        """予定1件ずつ、生成にかかる時間を按分して断片を返す"""
+        if random.random() < self.error_rate:
+            await asyncio.sleep(latency)
+            raise api_exceptions.ServiceUnavailable("fake")
+        events = self._events()
+        pieces = ["["] + [json.dumps(e, ensure_ascii=False) + "," for e in events[:-1]] + [json.dumps(events[-1], ensure_ascii=False) + "]"]
+        for piece in pieces:
+            await asyncio.sleep(latency / len(pieces))
+            yield SimpleNamespace(text=piece)
+
+
+# --- Google Calendar の代替 ---
+
+class _FakeRequest:
+    def __init__(self, service: "FakeCalendarService", body: dict):
+        self.service = service
+        self.body = body
+
+    def execute(self):
+        time.sleep(self.service.latency)
+        return self.service.result(self.body)
+
+
+class _FakeBatch:
+    def __init__(self, service: "FakeCalendarService", callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request: _FakeRequest, request_id: str):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        time.sleep(self.service.latency)
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, self.service.result(request.body), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+
+class FakeCalendarService:
+    """events().insert / get / list と new_batch_http_request だけを持つ Calendar サービスの代替"""
+
+    def __init__(self, latency: float, error_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._events: dict[str, dict] = {}
+        # 変更の履歴。同期トークンはこの長さ (それ以降が差分になる)
+        self._changes: list[dict] = []
+
+    def result(self, body: dict) -> dict:
+        if random.random() < self.error_rate:
+            raise HttpError(httplib2.Response({"status": 429}), b"Rate Limit Exceeded (fake)")
+        event_id = body.get("id") or f"fake{len(self._events)}"
+        if event_id in self._events:
+            raise HttpError(httplib2.Response({"status": 409}), b"The requested identifier already exists. (fake)")
+        event = self._events[event_id] = {**body, "id": event_id, "htmlLink": f"https://calendar.example/{event_id}"}
+        self._changes.append(event)
+        return event
+
+    def _get(self, calendarId, eventId, **kwargs):
+        return SimpleNamespace(execute=lambda: self._events[eventId])
+
+    def _list(self, calendarId, syncToken=None, **kwargs):
+        def execute():
+            time.sleep(self.latency)
+            changes = self._changes[int(syncToken or 0):]
+            items = [e for e in changes if e["organizer"] == calendarId] if syncToken else [
+                e for e in self._events.values() if e["organizer"] == calendarId
+            ]
+            return {"items": items, "nextSyncToken": str(len(self._changes))}
+        return SimpleNamespace(execute=execute)
+
+    def events(self):
+        return SimpleNamespace(
+            insert=lambda calendarId, body, **kwargs: _FakeRequest(self, {**body, "organizer": calendarId}),
+            get=self._get,
+            list=self._list,
+        )
+
+    def new_batch_http_request(self, callback):
+        return _FakeBatch(self, callback)
+
+
+# --- Discord の代替 ---
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"user{user_id}"
+
+
+class FakeDMChannel(discord.DMChannel):
+    """on_message の isinstance(channel, discord.DMChannel) を通すための代替"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.sent = 0
+        self.first_event_at: float | None = None
+
+    def typing(self):
+        return _NullTyping()
+
+    def get_partial_message(self, message_id: int):
+        return FakeMessage(None, self, "", message_id)
+
+    async def send(self, content=None, **kwargs):
+        start = time.perf_counter()
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+        timings["reply"].append(time.perf_counter() - start)
+        embeds = kwargs.get("embeds") or [e for e in [kwargs.get("embed")] if e is not None]
+        if self.first_event_at is None and any("✅" in (e.description or "") for e in embeds):
+            self.first_event_at = time.perf_counter()
+        return FakeMessage(None, self, content or "")
+
+
+class _NullTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeMessage:
+    _next_id = 1
+
+    def __init__(self, author: FakeUser | None, channel: FakeDMChannel, content: str, message_id: int | None = None):
+        if message_id is None:
+            message_id, FakeMessage._next_id = FakeMessage._next_id, FakeMessage._next_id + 1
+        self.id = message_id
+        self.author = author
+        self.channel = channel
+        self.content = content
+        self.attachments = []
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def edit(self, **kwargs):
+        return await self.channel.send(**kwargs)
+
+
+class _FakeResponse:
+    def __init__(self, channel: FakeDMChannel):
+        self.channel = channel
+
+    async def send_message(self, content=None, **kwargs):
+        await self.channel.send(content, **kwargs)
+
+    async def defer(self, **kwargs):
+        pass
+
+
+class FakeInteraction:
+    def __init__(self, user: FakeUser, channel: FakeDMChannel):
+        self.user = user
+        self.channel = channel
+        self.response = _FakeResponse(channel)
+        self.followup = channel
+
+
+# --- 計測 ---
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+def _track_jobs(handler):
+    """ジョブのハンドラーを包み、処理し終えたら (後で再試行する場合を除く) _job_done に知らせる"""
+    async def wrapper(job: dict):
+        deferred = False
+        try:
+            await handler(job)
+        except RetryLater:
+            deferred = True
+            raise
+        finally:
+            future = None if deferred else _job_done.pop(job["discord_id"], None)
+            if future is not None and not future.done():
+                future.set_result(None)
+    return wrapper
+
+
+async def _simulate_user(user_id: int, args) -> float:
+    """/register → /calendar → 予定のDM の流れを1ユーザー分実行し、処理し終えるまでの時間を返す"""
+    user = FakeUser(user_id)
+    channel = FakeDMChannel(args.discord_latency)
+    interaction = FakeInteraction(user, channel)
+
+    await bot_main.register_command.callback(interaction, f"user{user_id}@example.com")
+    await bot_main.calendar_command.callback(interaction)
+
+    # 複数行にしてローカル簡易パーサーではなく Gemini 側の経路を通す
+    message = FakeMessage(user, channel, f"ユーザー{user_id}の予定\n来年1月1日 9時から会議と打ち合わせ")
+    done = _job_done[str(user_id)] = asyncio.get_running_loop().create_future()
+    start = time.perf_counter()
+    sent_before = channel.sent
+    await bot_main.on_message(message)
+    timings["enqueue"].append(time.perf_counter() - start)
+    await done
+    elapsed = time.perf_counter() - start
+    timings["e2e"].append(elapsed)
+    discord_calls.append(channel.sent - sent_before)
+    if channel.first_event_at is not None:
+        timings["first_event"].append(channel.first_event_at - start)
+    return elapsed
+
+
+async def _run_level(users: int, args) -> dict:
+    timings.clear()
+    discord_calls.clear()
+    db.close_db()
+    db.init_db()
+    bot_main.timeout_scheduler.start([])
+    bot_main.job_pool.start()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(_simulate_user(users * 100000 + i, args) for i in range(users)))
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "users": users,
+        "wall": wall,
+        "peak": peak,
+        "calls": sum(discord_calls) / len(discord_calls),
+        "timings": {k: list(v) for k, v in timings.items()},
+    }
+
+
+def _install_fakes(args):
+    gemini_handler.model = FakeGeminiModel(args.gemini_latency, args.gemini_error_rate, args.events)
+    service = FakeCalendarService(args.calendar_latency, args.calendar_error_rate)
+    gcal.get_calendar_service = lambda: service
+
+    # ベンチマークでは全体の回数制限で頭打ちにならないようにする
+    rate_limiter.gemini_limiter = rate_limiter.RateLimiter("gemini", "1000000/1", "1000000/1")
+    rate_limiter.calendar_limiter = rate_limiter.RateLimiter("calendar", "1000000/1", "1000000/1")
+
+    # 段階ごとの計測
+    db.aget_user_state = _timed("state_lookup", db.aget_user_state)
+    gemini_handler.parse_event_details = _timed("parse", gemini_handler.parse_event_details)
+    gcal.acreate_calendar_events_batch = _timed("insert", gcal.acreate_calendar_events_batch)
+    gcal.acreate_calendar_event = _timed("insert", gcal.acreate_calendar_event)
+    gemini_handler.GEMINI_STREAMING = args.streaming
+    bot_main.job_pool.handler = _track_jobs(bot_main.job_pool.handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="1,10,100,1000", help="同時ユーザー数 (カンマ区切り)")
+    parser.add_argument("--events", type=int, default=3, help="1メッセージあたりの予定数")
+    parser.add_argument("--gemini-latency", type=float, default=0.8)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--calendar-latency", type=float, default=0.2)
+    parser.add_argument("--calendar-error-rate", type=float, default=0.0)
+    parser.add_argument("--discord-latency", type=float, default=0.05)
+    parser.add_argument("--streaming", action="store_true", help="Geminiのストリーミング応答で1件ずつ登録する")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    _install_fakes(args)
+
+    async def run_all():
+        results = []
+        for users in (int(u) for u in args.users.split(",")):
+            results.append(await _run_level(users, args))
+        return results
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.sqlite3")
+        results = asyncio.run(run_all())
+        db.close_db()
+
+    stages = ["e2e", "enqueue", "first_event", "state_lookup", "parse", "insert", "reply"]
+    print(f"{'users':>6} {'msgs/s':>8} {'peak MB':>8} {'calls/msg':>9}  " + "  ".join(f"{s + ' p50/p99 ms':>26}" for s in stages))
+    for result in results:
+        t = result["timings"]
+        cols = "  ".join(f"{_percentile(t.get(s, []), 0.5):>12.1f}/{_percentile(t.get(s, []), 0.99):<13.1f}" for s in stages)
+        print(f"{result['users']:>6} {result['users'] / result['wall']:>8.1f} {result['peak'] / 1e6:>8.1f} {result['calls']:>9.1f}  {cols}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/bench_local_parser.py
+"""
+ローカル簡易パーサー (local_parser.py) のカバー率と Gemini 出力との一致率を計測する。
+
+コーパス (local_parser_corpus.jsonl) の reference は Gemini と同じ出力形式の正解データ。
+--live を付けると reference の代わりにその場で Gemini に問い合わせた結果と比較する
+(GEMINI_API_KEY が必要)。
+
+使い方:
+    python benchmarks/bench_local_parser.py
+    python benchmarks/bench_local_parser.py --live --verbose
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import local_parser  # noqa: E402
+
+CORPUS_FILE = os.path.join(os.path.dirname(__file__), "local_parser_corpus.jsonl")
+
+
+def _effective_range(event: dict) -> tuple[str, str]:
+    """create_calendar_event と同じ補完 (終了未指定なら1時間後・翌日) をした開始・終了"""
+    start_date = event.get("start_date")
+    start_time = event.get("start_time")
+    end_date = event.get("end_date") or start_date
+    end_time = event.get("end_time")
+
+    if start_time:
+        start = datetime.fromisoformat(f"{start_date}T{start_time}")
+        end = datetime.fromisoformat(f"{end_date}T{end_time}") if end_time else start + timedelta(hours=1)
+        return start.isoformat(), end.isoformat()
+
+    end = date.fromisoformat(end_date)
+    if end_date == start_date:
+        end += timedelta(days=1)
+    return start_date, end.isoformat()
+
+
+def _compare(local: list[dict], reference: list[dict]) -> tuple[bool, bool]:
+    """(日時が一致したか, 予定名も一致したか)"""
+    if len(local) != len(reference):
+        return False, False
+    time_match = all(_effective_range(a) == _effective_range(b) for a, b in zip(local, reference))
+    summary_match = all(a["summary"] == b["summary"] for a, b in zip(local, reference))
+    return time_match, time_match and summary_match
+
+
+async def _gemini_reference(text: str, today: str) -> list[dict] | None:
+    import gemini_handler
+    events, _ = await gemini_handler._parse_with_gemini(text, today)
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", action="store_true", help="reference の代わりに Gemini の出力と比較する")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    with open(CORPUS_FILE, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    accepted = time_agree = full_agree = 0
+    elapsed = 0.0
+    for case in corpus:
+        today = date.fromisoformat(case["today"])
+        start = time.perf_counter()
+        events, confidence = local_parser.parse(case["text"], today)
+        elapsed += time.perf_counter() - start
+
+        reference = case["reference"]
+        if args.live:
+            reference = asyncio.run(_gemini_reference(case["text"], case["today"])) or []
+
+        taken = events is not None and confidence >= local_parser.LOCAL_PARSER_MIN_CONFIDENCE
+        status = "gemini"
+        if taken:
+            accepted += 1
+            time_ok, full_ok = _compare(events, reference)
+            time_agree += time_ok
+            full_agree += full_ok
+            status = "match" if full_ok else ("time-only" if time_ok else "MISMATCH")
+
+        if args.verbose:
+            print(f"[{status:<9}] conf={confidence:.1f} {case['text']!r}")
+            if taken and status != "match":
+                print(f"    local:     {events}")
+                print(f"    reference: {reference}")
+
+    total = len(corpus)
+    print(f"corpus={total} coverage={accepted}/{total} ({accepted / total:.0%}) "
+          f"time_agreement={time_agree}/{accepted} full_agreement={full_agree}/{accepted} "
+          f"mean_parse={elapsed / total * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# benchmarks/bench_prompt.py
+"""
+Gemini に送る1リクエストあたりの入力サイズと応答時間を、旧プロンプト
+(指示と出力例を毎回ユーザー入力に含め、応答からコードブロックを正規表現で取り出す) と
+現在の方式 (システム指示 + response_schema) で比較する。
+
+既定ではオフラインで送信内容の文字数・バイト数を比較する。システム指示とスキーマも
+リクエストごとに送られるため、現在の方式の値にはそれらを含めている。
+--live を付けると実際に Gemini に問い合わせ、usage_metadata のトークン数と応答時間を比較する
+(GEMINI_API_KEY が必要)。
+
+使い方:
+    python benchmarks/bench_prompt.py
+    python benchmarks/bench_prompt.py --live --limit 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+import google.generativeai as genai  # noqa: E402
+
+import gemini_handler  # noqa: E402
+
+CORPUS_FILE = os.path.join(os.path.dirname(__file__), "local_parser_corpus.jsonl")
+
+
+# --- 旧実装 ---
+
+def _legacy_prompt(text: str, today: str) -> str:
+    return f"""
+    あなたはユーザーのチャット発言からスケジュールを抽出する有能な秘書です。
+
+    # 入力テキスト
+    {text}
+
+    # 今日の日付
+    {today}
+
+    # 指示
+    - ユーザーの発言を解析し、JSONフォーマットで出力してください。
+    - 複数の予定が含まれる場合は、JSONの配列にしてください。
+    - 日付や時間が明示されていない場合は、文脈から推測するか、nullにしてください。
+    - 予定の内容 (summary) は必須です。
+    - JSON以外の余計な説明は一切不要です。
+
+    # 出力形式 (単一の予定)
+    ```json
+    {{
+      "summary": "イベント名",
+      "location": "場所 (任意)",
+      "description": "詳細 (任意)",
+      "start_date": "YYYY-MM-DD",
+      "start_time": "HH:MM:SS",
+      "end_date": "YYYY-MM-DD",
+      "end_time": "HH:MM:SS"
+    }}
+    ```
+
+    # 出力形式 (複数の予定)
+    ```json
+    [
+      {{
+        "summary": "イベント名1",
+        "start_date": "YYYY-MM-DD",
+        "start_time": "HH:MM:SS",
+        "end_date": "YYYY-MM-DD",
+        "end_time": "HH:MM:SS"
+      }},
+      {{
+        "summary": "イベント名2",
+        "start_date": "YYYY-MM-DD",
+        "start_time": "HH:MM:SS",
+        "end_date": "YYYY-MM-DD",
+        "end_time": "HH:MM:SS"
+      }}
+    ]
+    ```
+    """
+
+
+def _legacy_decode(response_text: str):
+    match = re.search(r"```(?:json)?\s*([\s\S]+?)\s*```", response_text)
+    return json.loads(match.group(1).strip() if match else response_text.strip())
+
+
+def _legacy_model():
+    config = {k: v for k, v in gemini_handler.generation_config.items() if k != "response_schema"}
+    return genai.GenerativeModel(
+        model_name=gemini_handler.MODEL_NAME,
+        generation_config=config,
+        safety_settings=gemini_handler.safety_settings,
+    )
+
+
+# --- 計測 ---
+
+def _request_text(case: dict, legacy: bool) -> str:
+    """1リクエストで送る指示・スキーマ・入力を合わせたテキスト"""
+    if legacy:
+        return _legacy_prompt(case["text"], case["today"])
+    schema = json.dumps(gemini_handler.EVENTS_SCHEMA, ensure_ascii=False)
+    return gemini_handler.SYSTEM_INSTRUCTION + schema + gemini_handler._create_prompt(case["text"], case["today"])
+
+
+def _report_offline(corpus: list[dict]):
+    print(f"{'':>8} {'chars/req':>10} {'bytes/req':>10}")
+    results = {}
+    for label, legacy in (("before", True), ("after", False)):
+        texts = [_request_text(case, legacy) for case in corpus]
+        chars = statistics.mean(len(t) for t in texts)
+        size = statistics.mean(len(t.encode("utf-8")) for t in texts)
+        results[label] = size
+        print(f"{label:>8} {chars:>10.0f} {size:>10.0f}")
+    print(f"reduction: {1 - results['after'] / results['before']:.0%} (bytes)")
+
+
+async def _report_live(corpus: list[dict]):
+    legacy_model = _legacy_model()
+    stats = {"before": [], "after": []}
+    for case in corpus:
+        for label in ("before", "after"):
+            if label == "before":
+                model, prompt, decode = legacy_model, _legacy_prompt(case["text"], case["today"]), _legacy_decode
+            else:
+                model, prompt, decode = gemini_handler.model, gemini_handler._create_prompt(case["text"], case["today"]), json.loads
+            start = time.perf_counter()
+            response = await model.generate_content_async(prompt)
+            elapsed = time.perf_counter() - start
+            try:
+                decode(response.text)
+                ok = True
+            except Exception:
+                ok = False
+            usage = response.usage_metadata
+            stats[label].append((usage.prompt_token_count, usage.candidates_token_count, elapsed, ok))
+
+    print(f"{'':>8} {'in tok':>8} {'out tok':>8} {'p50 ms':>8} {'p99 ms':>8} {'decoded':>8}")
+    for label, rows in stats.items():
+        latencies = sorted(r[2] for r in rows)
+        print(f"{label:>8} {statistics.mean(r[0] for r in rows):>8.0f} {statistics.mean(r[1] for r in rows):>8.0f} "
+              f"{latencies[len(latencies) // 2] * 1000:>8.0f} {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:>8.0f} "
+              f"{sum(r[3] for r in rows):>4}/{len(rows)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", action="store_true", help="実際に Gemini に問い合わせてトークン数と応答時間を比較する")
+    parser.add_argument("--limit", type=int, default=0, help="使用するコーパスの件数 (0 で全件)")
+    args = parser.parse_args()
+
+    with open(CORPUS_FILE, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    if args.limit:
+        corpus = corpus[:args.limit]
+
+    if args.live:
+        asyncio.run(_report_live(corpus))
+    else:
+        _report_offline(corpus)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# cache.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+# キャッシュに存在しないことを表す番兵 (None もキャッシュできるようにするため)
+MISSING = object()
+
+
+class LRUCache:
+    """TTL付きのLRUキャッシュ (スレッドセーフ)"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """値を取得する。存在しない・期限切れの場合は default を返す"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = item
+            if expires_at and expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """値を保存する。上限を超えた場合は最も古いものを追い出す"""
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        """値を削除する"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """すべての値を削除する"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """ヒット数・ミス数などの統計を返す"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -1,62 +1,317 @@
 # database.py
 import sqlite3
+import logging
 import os
 import threading
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+import metrics
+from cache import LRUCache, MISSING
 
 DB_FILE = "/data/tokens.sqlite3"
 db_lock = threading.Lock()
 
+# 読み込みキャッシュの設定 (書き込みはすべてこのモジュール経由なのでライトスルーで整合させる)
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "10000"))
+DB_CACHE_TTL = float(os.getenv("DB_CACHE_TTL", "3600"))
+
+# 保持期間 (日)。定期メンテナンスでこれより古い行を削除する
+FAILED_JOB_RETENTION_DAYS = float(os.getenv("FAILED_JOB_RETENTION_DAYS", "7"))
+LEDGER_RETENTION_DAYS = float(os.getenv("LEDGER_RETENTION_DAYS", "180"))
+MIRROR_RETENTION_DAYS = float(os.getenv("MIRROR_RETENTION_DAYS", "30"))
+# 空きページがこの割合を超えたら VACUUM でファイルを詰め直す (incremental_vacuum が使えないDBの場合)
+VACUUM_FREE_RATIO = float(os.getenv("VACUUM_FREE_RATIO", "0.25"))
+
+_state_cache = LRUCache(maxsize=DB_CACHE_SIZE, ttl=DB_CACHE_TTL)
+_calendar_cache = LRUCache(maxsize=DB_CACHE_SIZE, ttl=DB_CACHE_TTL)
+_settings_cache = LRUCache(maxsize=256, ttl=DB_CACHE_TTL)
+_debug_cache = LRUCache(maxsize=DB_CACHE_SIZE, ttl=DB_CACHE_TTL)
+
+# 対話状態が変わったときの通知先 (タイムアウト管理などが登録する)
+_state_listeners = []
+
+# プロセス内で使い回す常駐コネクション (db_lock で保護する)
+_conn: sqlite3.Connection | None = None
+_conn_path: str | None = None
+
+# DB操作専用のスレッド。イベントループ上でSQLiteを直接叩かないようにする
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+
+def _get_conn() -> sqlite3.Connection:
+    """常駐コネクションを取得する (db_lock を保持した状態で呼ぶこと)"""
+    global _conn, _conn_path
+    if _conn is not None and _conn_path == DB_FILE:
+        return _conn
+    if _conn is not None:
+        _conn.close()
+
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, cached_statements=256)
+    # 新しいDBでは削除で空いたページを少しずつファイルから返せるようにする (既存のDBは VACUUM 後に有効)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WALモード: 読み込みが書き込みを待たなくなる
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    _conn, _conn_path = conn, DB_FILE
+    return conn
+
+
+def close_db():
+    """常駐コネクションを閉じる"""
+    global _conn, _conn_path
+    with db_lock:
+        if _conn is not None:
+            _conn.close()
+        _conn, _conn_path = None, None
+    for cache in (_state_cache, _calendar_cache, _settings_cache, _debug_cache):
+        cache.clear()
+
+
+@metrics.timed_db
 def init_db():
-    """データベースの初期化を行う"""
+    """データベースの初期化を行う (未適用のマイグレーションを順に適用する)"""
     os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
 
     with db_lock:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        conn = _get_conn()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > len(_MIGRATIONS):
+            logging.warning(f"Database schema version {version} is newer than this code ({len(_MIGRATIONS)})")
 
-        # ユーザーごとのカレンダーIDを保存するテーブル
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_calendars (
-            discord_id TEXT PRIMARY KEY,
-            calendar_id TEXT NOT NULL
-        )
-        """)
+        for target, migration in enumerate(_MIGRATIONS[version:], start=version + 1):
+            # 手順とバージョンの更新を1つのトランザクションで行い、途中で止まっても前のバージョンに戻るようにする
+            cursor = conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {target:d}")
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+            logging.info(f"Migrated database to version {target} ({migration.__name__})")
 
-        # Botの対話状態を管理するテーブル
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_states (
-            discord_id TEXT PRIMARY KEY,
-            state TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
+        print("Database initialized.")
 
-        # レート制限用テーブル
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_rate_limits (
-            discord_id TEXT PRIMARY KEY,
-            last_used DATETIME NOT NULL
-        )
-        """)
+# --- マイグレーション ---
+# 適用済みのバージョンは PRAGMA user_version に記録する。
+# 適用済みの手順は書き換えず、スキーマの変更は新しい手順として _MIGRATIONS の末尾に追加すること。
 
-        # Bot設定用テーブル（Webhook URLなど）
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS bot_settings (
-            key TEXT PRIMARY KEY,
-            value TEXT NOT NULL
-        )
-        """)
+def _migrate_base_schema(cursor: sqlite3.Cursor):
+    """バージョン管理を始める前のスキーマ (既存のDBではすでにあるテーブルはそのまま)"""
+    # ユーザーごとのカレンダーIDを保存するテーブル
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_calendars (
+        discord_id TEXT PRIMARY KEY,
+        calendar_id TEXT NOT NULL
+    )
+    """)
 
-        conn.commit()
-        conn.close()
-        print("Database initialized.")
+    # Botの対話状態を管理するテーブル
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_states (
+        discord_id TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # レート制限のバケット状態 (定期的にスナップショットを保存する)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+        limiter TEXT NOT NULL,
+        bucket_key TEXT NOT NULL,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (limiter, bucket_key)
+    )
+    """)
+
+    # Bot設定用テーブル（Webhook URLなど）
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS bot_settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    """)
+
+    # ユーザーごとの表示設定 (show_debug: 解析結果のJSONを表示するか)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_preferences (
+        discord_id TEXT PRIMARY KEY,
+        show_debug INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+    # Geminiの解析結果キャッシュ (created_at はUNIX秒)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS parse_cache (
+        cache_key TEXT PRIMARY KEY,
+        events TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_parse_cache_created_at ON parse_cache (created_at)")
+
+    # 処理待ち・処理中のメッセージ (status: queued / running / failed、時刻はUNIX秒)
+    # events は解析済みの予定 (JSON)。保存済みなら再開時に登録からやり直す
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        discord_id TEXT NOT NULL,
+        message_id TEXT NOT NULL,
+        calendar_id TEXT NOT NULL,
+        content TEXT NOT NULL,
+        events TEXT,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        defers INTEGER NOT NULL DEFAULT 0,
+        run_after REAL NOT NULL,
+        lease_until REAL,
+        error TEXT,
+        created_at REAL NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_discord_id ON jobs (discord_id, status)")
+
+    # Botが登録した予定の台帳 (event_id は予定の内容から決めたID)。同じ予定の再登録を防ぐ
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS event_ledger (
+        calendar_id TEXT NOT NULL,
+        event_id TEXT NOT NULL,
+        html_link TEXT,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (calendar_id, event_id)
+    ) WITHOUT ROWID
+    """)
+
+    # カレンダーの予定のローカルコピー (開始・終了はUNIX秒)。/upcoming と重複チェックに使う
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS calendar_mirror (
+        calendar_id TEXT NOT NULL,
+        event_id TEXT NOT NULL,
+        summary TEXT,
+        location TEXT,
+        html_link TEXT,
+        start_at INTEGER NOT NULL,
+        end_at INTEGER NOT NULL,
+        all_day INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (calendar_id, event_id)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_calendar_mirror_start ON calendar_mirror (calendar_id, start_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_calendar_mirror_end ON calendar_mirror (calendar_id, end_at)")
+
+    # カレンダーごとの差分同期の状態 (sync_token: Calendar API の nextSyncToken)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS calendar_sync_state (
+        calendar_id TEXT PRIMARY KEY,
+        sync_token TEXT,
+        synced_at REAL
+    )
+    """)
+
+
+def _rebuild_table(cursor: sqlite3.Cursor, table: str, create_sql: str, select_sql: str):
+    """create_sql の定義でテーブルを作り直し、select_sql の結果を移す (列の型を変える場合に使う)"""
+    cursor.execute(create_sql.replace(f"CREATE TABLE {table} ", f"CREATE TABLE {table}_new ", 1))
+    cursor.execute(f"INSERT INTO {table}_new {select_sql}")
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+def _migrate_epoch_timestamps(cursor: sqlite3.Cursor):
+    """
+    user_states の時刻を文字列からUNIX秒の整数 (updated_at) に変え、期限切れの検索用の索引を付ける。
+    キーが文字列だけの小さなテーブルは WITHOUT ROWID にしてファイルを小さくする。
+    レート制限をメモリ上で持つようになって使われなくなった user_rate_limits は削除する。
+    """
+    _rebuild_table(cursor, "user_states", """
+    CREATE TABLE user_states (
+        discord_id TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        updated_at INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """, """
+    SELECT discord_id, state, COALESCE(CAST(strftime('%s', timestamp) AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER))
+    FROM user_states
+    """)
+    cursor.execute("CREATE INDEX idx_user_states_updated_at ON user_states (updated_at)")
+
+    _rebuild_table(cursor, "user_calendars", """
+    CREATE TABLE user_calendars (
+        discord_id TEXT PRIMARY KEY,
+        calendar_id TEXT NOT NULL
+    ) WITHOUT ROWID
+    """, "SELECT discord_id, calendar_id FROM user_calendars")
+
+    cursor.execute("DROP TABLE IF EXISTS user_rate_limits")
+
+
+def _migrate_retention_indexes(cursor: sqlite3.Cursor):
+    """保持期間を過ぎた行を探すための索引"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_event_ledger_created_at ON event_ledger (created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_calendar_mirror_end_at ON calendar_mirror (end_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created_at ON jobs (status, created_at)")
+
+
+def _migrate_job_attachments(cursor: sqlite3.Cursor):
+    """
+    添付ファイルを取り込むジョブ用の列。
+    progress はファイル先頭から処理し終えた予定の件数で、再開時はその続きから登録する。
+    """
+    cursor.execute("ALTER TABLE jobs ADD COLUMN attachment_url TEXT")
+    cursor.execute("ALTER TABLE jobs ADD COLUMN attachment_name TEXT")
+    cursor.execute("ALTER TABLE jobs ADD COLUMN progress INTEGER NOT NULL DEFAULT 0")
+
+
+_MIGRATIONS = [
+    _migrate_base_schema,
+    _migrate_epoch_timestamps,
+    _migrate_retention_indexes,
+    _migrate_job_attachments,
+]
+
+
+# --- キャッシュ管理 ---
+
+@metrics.timed_db
+def warm_cache():
+    """起動時に状態・カレンダーID・設定をキャッシュへ読み込む"""
+    with db_lock:
+        conn = _get_conn()
+        cursor = conn.cursor()
+        for table, columns, cache in (
+            ("user_states", "discord_id, state", _state_cache),
+            ("user_calendars", "discord_id, calendar_id", _calendar_cache),
+            ("bot_settings", "key, value", _settings_cache),
+        ):
+            cursor.execute(f"SELECT {columns} FROM {table} LIMIT ?", (cache.maxsize,))
+            for key, value in cursor.fetchall():
+                cache.set(key, value)
+
+
+def cache_stats() -> dict[str, dict]:
+    """各キャッシュのヒット数・ミス数を返す"""
+    return {
+        "user_states": _state_cache.stats(),
+        "user_calendars": _calendar_cache.stats(),
+        "bot_settings": _settings_cache.stats(),
+        "user_preferences": _debug_cache.stats(),
+    }
 
 # --- カレンダーID管理 ---
 
+@metrics.timed_db
 def save_calendar_id(discord_id: str, calendar_id: str):
     """ユーザーのカレンダーIDを保存または更新する"""
     with db_lock:
-        conn = sqlite3.connect(DB_FILE)
+        conn = _get_conn()
         cursor = conn.cursor()
         cursor.execute("""
         INSERT INTO user_calendars (discord_id, calendar_id)
@@ -64,106 +319,146 @@ def save_calendar_id(discord_id: str, calendar_id: str):
         ON CONFLICT(discord_id) DO UPDATE SET calendar_id=excluded.calendar_id
         """, (discord_id, calendar_id))
         conn.commit()
-        conn.close()
+        _calendar_cache.set(discord_id, calendar_id)
 
-def get_calendar_id(discord_id: str) -> str | None:
-    """ユーザーのカレンダーIDを取得する"""
+@metrics.timed_db
+def _load_calendar_id(discord_id: str) -> str | None:
     with db_lock:
-        conn = sqlite3.connect(DB_FILE)
+        conn = _get_conn()
         cursor = conn.cursor()
         cursor.execute("SELECT calendar_id FROM user_calendars WHERE discord_id = ?", (discord_id,))
         result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else None
+        value = result[0] if result else None
+        _calendar_cache.set(discord_id, value)
+        return value
 
+def get_calendar_id(discord_id: str) -> str | None:
+    """ユーザーのカレンダーIDを取得する"""
+    value = _calendar_cache.get(discord_id)
+    return _load_calendar_id(discord_id) if value is MISSING else value
+
+@metrics.timed_db
 def delete_calendar_id(discord_id: str) -> bool:
     """ユーザーのカレンダーIDを削除する。削除した場合Trueを返す。"""
     with db_lock:
-        conn = sqlite3.connect(DB_FILE)
+        conn = _get_conn()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM user_calendars WHERE discord_id = ?", (discord_id,))
         deleted = cursor.rowcount > 0
         conn.commit()
-        conn.close()
+        _calendar_cache.set(discord_id, None)
         return deleted
 
 # --- 対話状態管理 ---
 
+def add_state_listener(callback):
+    """状態が変わるたびに callback(discord_id, state) を呼ぶ。削除時の state は None"""
+    _state_listeners.append(callback)
+
+def _notify_state_change(discord_id: str, state: str | None):
+    for callback in _state_listeners:
+        try:
+            callback(discord_id, state)
+        except Exception:
+            logging.exception(f"State listener failed for {discord_id}")
+
+@metrics.timed_db
 def set_user_state(discord_id: str, state: str):
     """ユーザーの状態を設定する"""
     with db_lock:
-        conn = sqlite3.connect(DB_FILE)
+        conn = _get_conn()
         cursor = conn.cursor()
         cursor.execute("""
-        INSERT INTO user_states (discord_id, state)
-        VALUES (?, ?)
-        ON CONFLICT(discord_id) DO UPDATE SET state=excluded.state, timestamp=CURRENT_TIMESTAMP
-        """, (discord_id, state))
+        INSERT INTO user_states (discord_id, state, updated_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(discord_id) DO UPDATE SET state=excluded.state, updated_at=excluded.updated_at
+        """, (discord_id, state, int(time.time())))
         conn.commit()
-        conn.close()
+        _state_cache.set(discord_id, state)
+    _notify_state_change(discord_id, state)
 
-def get_user_state(discord_id: str) -> str | None:
-    """ユーザーの状態を取得する"""
+@metrics.timed_db
+def _load_user_state(discord_id: str) -> str | None:
     with db_lock:
-        conn = sqlite3.connect(DB_FILE)
+        conn = _get_conn()
         cursor = conn.cursor()
         cursor.execute("SELECT state FROM user_states WHERE discord_id = ?", (discord_id,))
         result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else None
+        value = result[0] if result else None
+        _state_cache.set(discord_id, value)
+        return value
+
+def get_user_state(discord_id: str) -> str | None:
+    """ユーザーの状態を取得する"""
+    value = _state_cache.get(discord_id)
+    return _load_user_state(discord_id) if value is MISSING else value
 
+@metrics.timed_db
 def clear_user_state(discord_id: str):
     """ユーザーの状態を削除する"""
     with db_lock:
-        conn = sqlite3.connect(DB_FILE)
+        conn = _get_conn()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM user_states WHERE discord_id = ?", (discord_id,))
         conn.commit()
-        conn.close()
+        _state_cache.set(discord_id, None)
+    _notify_state_change(discord_id, None)
 
-# --- レート制限管理 ---
-
-def check_rate_limit(discord_id: str, seconds: int = 60) -> bool:
-    """最後の使用からseconds秒以上経過していればTrueを返す"""
+@metrics.timed_db
+def clear_expired_user_state(discord_id: str, started_before: float) -> bool:
+    """
+    状態が started_before (UNIX秒) 以前に設定されたままなら削除する。削除した場合Trueを返す。
+    期限切れの処理と同時に新しい状態が設定された場合は、新しい状態を残す。
+    """
     with db_lock:
-        conn = sqlite3.connect(DB_FILE)
+        conn = _get_conn()
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT last_used FROM user_rate_limits WHERE discord_id = ?",
-            (discord_id,)
+            "DELETE FROM user_states WHERE discord_id = ? AND updated_at <= ?", (discord_id, started_before)
         )
-        result = cursor.fetchone()
-        conn.close()
+        deleted = cursor.rowcount > 0
+        conn.commit()
+        if not deleted:
+            return False
+        _state_cache.set(discord_id, None)
+    _notify_state_change(discord_id, None)
+    return True
 
-        if not result:
-            return True
+# --- レート制限管理 ---
 
-        from datetime import datetime, timedelta
-        last_used = datetime.fromisoformat(result[0])
-        return datetime.now() - last_used >= timedelta(seconds=seconds)
+@metrics.timed_db
+def save_rate_limit_snapshot(limiter: str, rows: list[tuple[str, float, float]]):
+    """レート制限のバケット状態 (キー, トークン数, 更新時刻) を丸ごと置き換えて保存する"""
+    with db_lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute("DELETE FROM rate_limit_buckets WHERE limiter = ?", (limiter,))
+            conn.executemany(
+                "INSERT INTO rate_limit_buckets (limiter, bucket_key, tokens, updated_at) VALUES (?, ?, ?, ?)",
+                [(limiter, key, tokens, updated_at) for key, tokens, updated_at in rows]
+            )
 
 
-def update_last_used(discord_id: str):
-    """最終使用時刻を更新する"""
-    from datetime import datetime
+@metrics.timed_db
+def load_rate_limit_snapshot(limiter: str) -> list[tuple[str, float, float]]:
+    """保存済みのバケット状態を取得する"""
     with db_lock:
-        conn = sqlite3.connect(DB_FILE)
+        conn = _get_conn()
         cursor = conn.cursor()
-        cursor.execute("""
-        INSERT INTO user_rate_limits (discord_id, last_used)
-        VALUES (?, ?)
-        ON CONFLICT(discord_id) DO UPDATE SET last_used=excluded.last_used
-        """, (discord_id, datetime.now().isoformat()))
-        conn.commit()
-        conn.close()
+        cursor.execute(
+            "SELECT bucket_key, tokens, updated_at FROM rate_limit_buckets WHERE limiter = ?",
+            (limiter,)
+        )
+        return cursor.fetchall()
 
 
 # --- Bot設定管理 ---
 
+@metrics.timed_db
 def save_setting(key: str, value: str):
     """Bot設定を保存する"""
     with db_lock:
-        conn = sqlite3.connect(DB_FILE)
+        conn = _get_conn()
         cursor = conn.cursor()
         cursor.execute("""
         INSERT INTO bot_settings (key, value)
@@ -171,43 +466,581 @@ def save_setting(key: str, value: str):
         ON CONFLICT(key) DO UPDATE SET value=excluded.value
         """, (key, value))
         conn.commit()
-        conn.close()
+        _settings_cache.set(key, value)
 
 
-def get_setting(key: str) -> str | None:
-    """Bot設定を取得する"""
+@metrics.timed_db
+def _load_setting(key: str) -> str | None:
     with db_lock:
-        conn = sqlite3.connect(DB_FILE)
+        conn = _get_conn()
         cursor = conn.cursor()
         cursor.execute("SELECT value FROM bot_settings WHERE key = ?", (key,))
         result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else None
+        value = result[0] if result else None
+        _settings_cache.set(key, value)
+        return value
+
+
+def get_setting(key: str) -> str | None:
+    """Bot設定を取得する"""
+    value = _settings_cache.get(key)
+    return _load_setting(key) if value is MISSING else value
 
 
+@metrics.timed_db
 def delete_setting(key: str) -> bool:
     """Bot設定を削除する。削除した場合Trueを返す。"""
     with db_lock:
-        conn = sqlite3.connect(DB_FILE)
+        conn = _get_conn()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM bot_settings WHERE key = ?", (key,))
         deleted = cursor.rowcount > 0
         conn.commit()
-        conn.close()
+        _settings_cache.set(key, None)
+        return deleted
+
+
+# --- ユーザー設定管理 ---
+
+@metrics.timed_db
+def set_show_debug(discord_id: str, enabled: bool):
+    """解析結果のJSONを表示するかを保存する"""
+    with db_lock:
+        conn = _get_conn()
+        cursor = conn.cursor()
+        cursor.execute("""
+        INSERT INTO user_preferences (discord_id, show_debug)
+        VALUES (?, ?)
+        ON CONFLICT(discord_id) DO UPDATE SET show_debug=excluded.show_debug
+        """, (discord_id, int(enabled)))
+        conn.commit()
+        _debug_cache.set(discord_id, enabled)
+
+
+@metrics.timed_db
+def _load_show_debug(discord_id: str) -> bool:
+    with db_lock:
+        conn = _get_conn()
+        cursor = conn.cursor()
+        cursor.execute("SELECT show_debug FROM user_preferences WHERE discord_id = ?", (discord_id,))
+        result = cursor.fetchone()
+        enabled = bool(result[0]) if result else False
+        _debug_cache.set(discord_id, enabled)
+        return enabled
+
+
+def get_show_debug(discord_id: str) -> bool:
+    """解析結果のJSONを表示するかを取得する (既定は表示しない)"""
+    enabled = _debug_cache.get(discord_id)
+    return _load_show_debug(discord_id) if enabled is MISSING else enabled
+
+
+# --- 解析結果キャッシュ ---
+
+@metrics.timed_db
+def get_parse_cache(cache_key: str, max_age: float) -> str | None:
+    """max_age秒以内に保存された解析結果(JSON文字列)を取得する"""
+    with db_lock:
+        conn = _get_conn()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT events FROM parse_cache WHERE cache_key = ? AND created_at >= ?",
+            (cache_key, time.time() - max_age)
+        )
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+
+@metrics.timed_db
+def save_parse_cache(cache_key: str, events_json: str):
+    """解析結果(JSON文字列)を保存する"""
+    with db_lock:
+        conn = _get_conn()
+        cursor = conn.cursor()
+        cursor.execute("""
+        INSERT INTO parse_cache (cache_key, events, created_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(cache_key) DO UPDATE SET events=excluded.events, created_at=excluded.created_at
+        """, (cache_key, events_json, time.time()))
+        conn.commit()
+
+
+@metrics.timed_db
+def prune_parse_cache(max_age: float, max_rows: int) -> int:
+    """期限切れの解析結果と、新しい順でmax_rows件を超えた分を削除する。削除件数を返す。"""
+    with db_lock:
+        conn = _get_conn()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM parse_cache WHERE created_at < ?", (time.time() - max_age,))
+        deleted = cursor.rowcount
+        cursor.execute("""
+        DELETE FROM parse_cache WHERE cache_key IN (
+            SELECT cache_key FROM parse_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+        )
+        """, (max_rows,))
+        deleted += cursor.rowcount
+        conn.commit()
         return deleted
 
 
+# --- ジョブキュー ---
+
+class QueueFullError(Exception):
+    """処理待ちのジョブが上限に達しているため、ジョブを保存しなかった"""
+
+    def __init__(self, max_queue: int):
+        super().__init__(f"job queue is full ({max_queue})")
+        self.max_queue = max_queue
+
+
+def _job_position(cursor: sqlite3.Cursor, discord_id: str, now: float) -> int:
+    """ユーザーごとに1件ずつ順番に処理した場合に、このユーザーの最後のジョブが何番目になるか"""
+    cursor.execute(
+        "SELECT discord_id, COUNT(*) FROM jobs WHERE status = 'queued' AND run_after <= ? GROUP BY discord_id",
+        (now,)
+    )
+    counts = dict(cursor.fetchall())
+    depth = counts.get(discord_id, 0)
+    return sum(min(count, depth) for other, count in counts.items() if other != discord_id) + depth
+
+
+@metrics.timed_db
+def enqueue_job(discord_id: str, message_id: str, calendar_id: str, content: str, max_queue: int,
+                attachment_url: str | None = None, attachment_name: str | None = None) -> tuple[int, int] | None:
+    """
+    ユーザーの待機状態を削除し、同じトランザクションでメッセージをジョブとして保存する。
+    attachment_url を渡した場合は、本文ではなく添付ファイルの予定を取り込むジョブになる。
+    (ジョブID, 順番) を返す。処理待ちが max_queue 件以上ある場合は何もせず QueueFullError を送出する。
+    待機状態でなくなっていた場合 (同時に届いた別のメッセージが先に保存された場合など) は何もせず None を返す。
+    """
+    now = time.time()
+    with db_lock:
+        conn = _get_conn()
+        cursor = conn.cursor()
+        with conn:
+            cursor.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'")
+            if cursor.fetchone()[0] >= max_queue:
+                raise QueueFullError(max_queue)
+            cursor.execute(
+                "DELETE FROM user_states WHERE discord_id = ? AND state = 'waiting_for_details'", (discord_id,)
+            )
+            if cursor.rowcount == 0:
+                conn.rollback()
+                # キャッシュが古い状態を返していたので、次回はDBから読み直す
+                _state_cache.delete(discord_id)
+                return None
+            cursor.execute("""
+            INSERT INTO jobs (discord_id, message_id, calendar_id, content, attachment_url, attachment_name, status, run_after, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?)
+            """, (discord_id, message_id, calendar_id, content, attachment_url, attachment_name, now, now))
+            job_id = cursor.lastrowid
+            position = _job_position(cursor, discord_id, now)
+        _state_cache.set(discord_id, None)
+    _notify_state_change(discord_id, None)
+    return job_id, position
+
+
+@metrics.timed_db
+def claim_job(lease_seconds: float) -> tuple[dict | None, int, float | None]:
+    """
+    次に処理するジョブを1件取り出し、lease_seconds 秒の間は他のワーカーが取らないようにする。
+    処理中のジョブが少ないユーザーから順に、ユーザーごとに古い順で選ぶ。
+    期限切れのリース (処理中に停止したジョブ) も取り出し対象にする。
+    (ジョブ, 残りの処理待ち件数, 次にジョブが取り出せるようになるUNIX秒) を返す。
+    """
+    now = time.time()
+    with db_lock:
+        conn = _get_conn()
+        cursor = conn.cursor()
+        with conn:
+            cursor.execute("""
+            SELECT ready.id FROM (
+                SELECT id, discord_id, ROW_NUMBER() OVER (PARTITION BY discord_id ORDER BY id) AS turn
+                FROM jobs
+                WHERE (status = 'queued' AND run_after <= :now) OR (status = 'running' AND lease_until < :now)
+            ) AS ready
+            ORDER BY ready.turn + (
+                SELECT COUNT(*) FROM jobs AS running
+                WHERE running.discord_id = ready.discord_id AND running.status = 'running' AND running.lease_until >= :now
+            ), ready.id
+            LIMIT 1
+            """, {"now": now})
+            row = cursor.fetchone()
+
+            job = None
+            if row:
+                cursor.execute("""
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?
+                WHERE id = ?
+                """, (now + lease_seconds, row[0]))
+                cursor.execute("SELECT * FROM jobs WHERE id = ?", (row[0],))
+                job = dict(zip([c[0] for c in cursor.description], cursor.fetchone()))
+
+            cursor.execute("""
+            SELECT SUM(status = 'queued'), MIN(CASE status WHEN 'queued' THEN run_after ELSE lease_until END)
+            FROM jobs WHERE status IN ('queued', 'running')
+            """)
+            pending, next_at = cursor.fetchone()
+        return job, pending or 0, next_at
+
+
+@metrics.timed_db
+def extend_job_lease(job_id: int, lease_seconds: float):
+    """処理中のジョブのリースを延長する"""
+    with db_lock:
+        conn = _get_conn()
+        conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'",
+            (time.time() + lease_seconds, job_id)
+        )
+        conn.commit()
+
+
+@metrics.timed_db
+def save_job_events(job_id: int, events_json: str):
+    """解析済みの予定(JSON文字列)をジョブに保存する"""
+    with db_lock:
+        conn = _get_conn()
+        conn.execute("UPDATE jobs SET events = ? WHERE id = ?", (events_json, job_id))
+        conn.commit()
+
+
+@metrics.timed_db
+def save_job_progress(job_id: int, progress: int):
+    """添付ファイルの先頭から処理し終えた予定の件数を保存する"""
+    with db_lock:
+        conn = _get_conn()
+        conn.execute("UPDATE jobs SET progress = ? WHERE id = ?", (progress, job_id))
+        conn.commit()
+
+
+@metrics.timed_db
+def defer_job(job_id: int, delay: float, count: bool = True):
+    """ジョブを delay 秒後に処理待ちへ戻す。count=True なら後回しにした回数 (defers) を数える"""
+    with db_lock:
+        conn = _get_conn()
+        conn.execute("""
+        UPDATE jobs SET status = 'queued', attempts = 0, defers = defers + ?, run_after = ?, lease_until = NULL
+        WHERE id = ?
+        """, (int(count), time.time() + delay, job_id))
+        conn.commit()
+
+
+@metrics.timed_db
+def finish_job(job_id: int):
+    """完了したジョブを削除する"""
+    with db_lock:
+        conn = _get_conn()
+        conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        conn.commit()
+
+
+@metrics.timed_db
+def fail_job(job_id: int, error: str):
+    """ジョブを失敗として残す (再開の対象にはしない)"""
+    with db_lock:
+        conn = _get_conn()
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', lease_until = NULL, error = ? WHERE id = ?",
+            (error, job_id)
+        )
+        conn.commit()
+
+
+@metrics.timed_db
+def reset_job_leases() -> int:
+    """
+    起動時に、前回のプロセスが処理中のまま停止したジョブをすぐ取り出せるようにする。
+    再開するジョブの件数を返す。
+    """
+    with db_lock:
+        conn = _get_conn()
+        cursor = conn.cursor()
+        cursor.execute("UPDATE jobs SET lease_until = 0 WHERE status = 'running'")
+        conn.commit()
+        return cursor.rowcount
+
+
+# --- 登録済みの予定の台帳 ---
+
+@metrics.timed_db
+def get_ledger_entries(calendar_id: str, event_ids: list[str]) -> dict[str, str | None]:
+    """登録済みの予定の {event_id: リンク} を取得する"""
+    if not event_ids:
+        return {}
+    with db_lock:
+        conn = _get_conn()
+        cursor = conn.cursor()
+        entries = {}
+        # SQLiteのパラメータ数の上限を超えないように分けて問い合わせる
+        for offset in range(0, len(event_ids), 500):
+            chunk = event_ids[offset:offset + 500]
+            cursor.execute(
+                f"SELECT event_id, html_link FROM event_ledger WHERE calendar_id = ? AND event_id IN ({','.join('?' * len(chunk))})",
+                (calendar_id, *chunk)
+            )
+            entries.update(cursor.fetchall())
+        return entries
+
+
+@metrics.timed_db
+def record_ledger_entries(calendar_id: str, entries: list[tuple[str, str | None]]):
+    """登録した予定の (event_id, リンク) を台帳に記録する"""
+    if not entries:
+        return
+    # 整数の秒にしておくと REAL 列でも整数として小さく保存される
+    now = int(time.time())
+    with db_lock:
+        conn = _get_conn()
+        with conn:
+            conn.executemany("""
+            INSERT INTO event_ledger (calendar_id, event_id, html_link, created_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(calendar_id, event_id) DO UPDATE SET html_link=excluded.html_link
+            """, [(calendar_id, event_id, html_link, now) for event_id, html_link in entries])
+
+
+# --- カレンダーのローカルコピー ---
+
+@metrics.timed_db
+def get_mirror_sync_state(calendar_id: str) -> tuple[str | None, float | None]:
+    """(同期トークン, 最後に同期したUNIX秒) を取得する。未同期なら (None, None)"""
+    with db_lock:
+        conn = _get_conn()
+        cursor = conn.cursor()
+        cursor.execute("SELECT sync_token, synced_at FROM calendar_sync_state WHERE calendar_id = ?", (calendar_id,))
+        result = cursor.fetchone()
+        return (result[0], result[1]) if result else (None, None)
+
+
+@metrics.timed_db
+def apply_mirror_changes(calendar_id: str, rows: list[tuple], deleted_ids: list[str], reset: bool = False):
+    """
+    同期で取得した変更を反映する。
+    rows は (event_id, summary, location, html_link, start_at, end_at, all_day) のリスト。
+    reset=True なら先にこのカレンダーの予定をすべて消す (全件の同期をやり直す場合)。
+    削除された予定は台帳からも消し、同じ内容をもう一度登録できるようにする。
+    """
+    with db_lock:
+        conn = _get_conn()
+        with conn:
+            if reset:
+                conn.execute("DELETE FROM calendar_mirror WHERE calendar_id = ?", (calendar_id,))
+            conn.executemany("""
+            INSERT INTO calendar_mirror (calendar_id, event_id, summary, location, html_link, start_at, end_at, all_day)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(calendar_id, event_id) DO UPDATE SET
+                summary=excluded.summary, location=excluded.location, html_link=excluded.html_link,
+                start_at=excluded.start_at, end_at=excluded.end_at, all_day=excluded.all_day
+            """, [(calendar_id, *row) for row in rows])
+            for table in ("calendar_mirror", "event_ledger"):
+                conn.executemany(
+                    f"DELETE FROM {table} WHERE calendar_id = ? AND event_id = ?",
+                    [(calendar_id, event_id) for event_id in deleted_ids]
+                )
+
+
+@metrics.timed_db
+def save_mirror_sync_token(calendar_id: str, sync_token: str | None):
+    """同期トークンと同期した時刻を保存する。None なら次回は全件を同期し直す"""
+    with db_lock:
+        conn = _get_conn()
+        conn.execute("""
+        INSERT INTO calendar_sync_state (calendar_id, sync_token, synced_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(calendar_id) DO UPDATE SET sync_token=excluded.sync_token, synced_at=excluded.synced_at
+        """, (calendar_id, sync_token, time.time() if sync_token else None))
+        conn.commit()
+
+
+@metrics.timed_db
+def get_mirror_events(calendar_id: str, start_at: int, end_at: int, limit: int = 100,
+                      timed_only: bool = False, exclude_id: str | None = None) -> list[tuple]:
+    """
+    [start_at, end_at) と重なる予定を開始順に取得する。
+    timed_only=True なら終日の予定を、exclude_id を渡せばそのIDの予定を除いてから limit 件に絞る。
+    戻り値は (event_id, summary, location, html_link, start_at, end_at, all_day) のリスト。
+    """
+    with db_lock:
+        conn = _get_conn()
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT event_id, summary, location, html_link, start_at, end_at, all_day
+        FROM calendar_mirror
+        WHERE calendar_id = ? AND start_at < ? AND end_at > ?
+          AND (? = 0 OR all_day = 0) AND event_id IS NOT ?
+        ORDER BY start_at, end_at
+        LIMIT ?
+        """, (calendar_id, end_at, start_at, int(timed_only), exclude_id, limit))
+        return cursor.fetchall()
+
+
 # --- タイムアウト管理 ---
 
+@metrics.timed_db
+def get_state_timestamps() -> list[tuple[str, int]]:
+    """状態を持つ全ユーザーの (discord_id, 状態設定時刻のUNIX秒) を取得する"""
+    with db_lock:
+        conn = _get_conn()
+        cursor = conn.cursor()
+        cursor.execute("SELECT discord_id, updated_at FROM user_states")
+        return cursor.fetchall()
+
+@metrics.timed_db
 def get_stale_users(minutes: int) -> list[str]:
     """指定した分数が経過した古い状態のユーザーIDリストを取得する"""
     with db_lock:
-        conn = sqlite3.connect(DB_FILE)
+        conn = _get_conn()
         cursor = conn.cursor()
-        cursor.execute(f"""
-        SELECT discord_id FROM user_states
-        WHERE timestamp < datetime('now', '-{minutes} minutes')
-        """)
+        cursor.execute(
+            "SELECT discord_id FROM user_states WHERE updated_at < ?",
+            (int(time.time()) - minutes * 60,)
+        )
         results = cursor.fetchall()
-        conn.close()
         return [r[0] for r in results]
+
+
+# --- メンテナンス ---
+
+# 保持期間を過ぎた行を削除する文 (1回あたり最大 ? 件)
+_PRUNE_QUERIES = {
+    # 失敗したまま残したジョブ (調査用)
+    "jobs": """
+    DELETE FROM jobs WHERE id IN (
+        SELECT id FROM jobs WHERE status = 'failed' AND created_at < ? LIMIT ?
+    )
+    """,
+    # 台帳は再登録を速く見つけるためのもの。消えても決まったIDで Calendar 側の重複 (409) として検出できる
+    "event_ledger": """
+    DELETE FROM event_ledger WHERE (calendar_id, event_id) IN (
+        SELECT calendar_id, event_id FROM event_ledger WHERE created_at < ? LIMIT ?
+    )
+    """,
+    # 終わった予定のローカルコピー (/upcoming と重なりの確認は今後の予定しか見ない)
+    "calendar_mirror": """
+    DELETE FROM calendar_mirror WHERE (calendar_id, event_id) IN (
+        SELECT calendar_id, event_id FROM calendar_mirror WHERE end_at < ? LIMIT ?
+    )
+    """,
+}
+
+
+def retention_cutoffs(now: float | None = None) -> dict[str, float]:
+    """テーブルごとの、これより古い行を削除するUNIX秒"""
+    now = time.time() if now is None else now
+    return {
+        "jobs": now - FAILED_JOB_RETENTION_DAYS * 86400,
+        "event_ledger": now - LEDGER_RETENTION_DAYS * 86400,
+        "calendar_mirror": now - MIRROR_RETENTION_DAYS * 86400,
+    }
+
+
+@metrics.timed_db
+def prune_rows(table: str, cutoff: float, limit: int) -> int:
+    """
+    table (_PRUNE_QUERIES のキー) の cutoff より古い行を最大 limit 件削除し、削除件数を返す。
+    一度に消す件数を抑え、呼び出しの合間に他のDB操作が進むようにする。
+    """
+    with db_lock:
+        conn = _get_conn()
+        with conn:
+            cursor = conn.execute(_PRUNE_QUERIES[table], (cutoff, limit))
+            return cursor.rowcount
+
+
+@metrics.timed_db
+def optimize_db() -> dict[str, int]:
+    """
+    クエリプランナーの統計を更新し、空きページをファイルから返してWALを切り詰める。
+    auto_vacuum が INCREMENTAL でない既存のDBは、空きページが多ければ VACUUM で変換する。
+    実行後の {page_count, freelist_count, page_size} を返す。
+    """
+    with db_lock:
+        conn = _get_conn()
+        conn.execute("PRAGMA analysis_limit=1000")
+        has_stats = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+        conn.execute("PRAGMA optimize" if has_stats else "ANALYZE")
+        conn.commit()
+
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            # 1ページずつ結果が返るので、読み切るまで実行する
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+        elif freelist_count > page_count * VACUUM_FREE_RATIO:
+            logging.info(f"Vacuuming database ({freelist_count}/{page_count} pages free)")
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+        return {
+            "page_count": conn.execute("PRAGMA page_count").fetchone()[0],
+            "freelist_count": conn.execute("PRAGMA freelist_count").fetchone()[0],
+            "page_size": conn.execute("PRAGMA page_size").fetchone()[0],
+        }
+
+
+# --- 非同期API ---
+# 既存の同期関数をDB専用スレッドで実行する薄いラッパー。
+# イベントループ上からはこちらを await して使う。
+
+async def run_in_db_thread(func, *args):
+    """同期関数をDB専用スレッドで実行する"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args))
+
+
+def _to_async(func):
+    @wraps(func)
+    async def wrapper(*args):
+        return await run_in_db_thread(func, *args)
+    return wrapper
+
+
+def _to_async_cached(cache: LRUCache, loader):
+    """キャッシュヒット時はDBスレッドを経由せずに返す非同期ゲッターを作る"""
+    async def wrapper(key: str):
+        value = cache.get(key)
+        if value is MISSING:
+            value = await run_in_db_thread(loader, key)
+        return value
+    return wrapper
+
+
+ainit_db = _to_async(init_db)
+awarm_cache = _to_async(warm_cache)
+asave_calendar_id = _to_async(save_calendar_id)
+aget_calendar_id = _to_async_cached(_calendar_cache, _load_calendar_id)
+adelete_calendar_id = _to_async(delete_calendar_id)
+aset_user_state = _to_async(set_user_state)
+aget_user_state = _to_async_cached(_state_cache, _load_user_state)
+aclear_user_state = _to_async(clear_user_state)
+aclear_expired_user_state = _to_async(clear_expired_user_state)
+asave_rate_limit_snapshot = _to_async(save_rate_limit_snapshot)
+aload_rate_limit_snapshot = _to_async(load_rate_limit_snapshot)
+asave_setting = _to_async(save_setting)
+aget_setting = _to_async_cached(_settings_cache, _load_setting)
+adelete_setting = _to_async(delete_setting)
+aset_show_debug = _to_async(set_show_debug)
+aget_show_debug = _to_async_cached(_debug_cache, _load_show_debug)
+aget_stale_users = _to_async(get_stale_users)
+aget_state_timestamps = _to_async(get_state_timestamps)
+aget_parse_cache = _to_async(get_parse_cache)
+asave_parse_cache = _to_async(save_parse_cache)
+aprune_parse_cache = _to_async(prune_parse_cache)
+aenqueue_job = _to_async(enqueue_job)
+aclaim_job = _to_async(claim_job)
+aextend_job_lease = _to_async(extend_job_lease)
+asave_job_events = _to_async(save_job_events)
+asave_job_progress = _to_async(save_job_progress)
+adefer_job = _to_async(defer_job)
+afinish_job = _to_async(finish_job)
+afail_job = _to_async(fail_job)
+areset_job_leases = _to_async(reset_job_leases)
+aget_ledger_entries = _to_async(get_ledger_entries)
+arecord_ledger_entries = _to_async(record_ledger_entries)
+aget_mirror_sync_state = _to_async(get_mirror_sync_state)
+aapply_mirror_changes = _to_async(apply_mirror_changes)
+aget_mirror_events = _to_async(get_mirror_events)
+aprune_rows = _to_async(prune_rows)
+aoptimize_db = _to_async(optimize_db)
@@ -0,0 +1,361 @@
+# event_import.py
+import codecs
+import csv
+import io
+import os
+import re
+import tempfile
+import unicodedata
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from typing import IO, Iterator
+from zoneinfo import ZoneInfo
+
+import aiohttp
+
+# .ics / CSV ファイルから予定を読み込む。Gemini は使わず、1件ずつ読み進めるので
+# ファイル全体や全件の予定をメモリに載せずに何万件でも扱える。
+# 読み込んだ予定は parse_event_details と同じ形式の辞書 (summary, start_date, start_time, ...) にする。
+
+IMPORT_DOWNLOAD_TIMEOUT = float(os.getenv("IMPORT_DOWNLOAD_TIMEOUT", "120"))
+
+SUPPORTED_EXTENSIONS = (".ics", ".ical", ".ifb", ".csv")
+
+# 1件あたりの項目の最大文字数 (Calendar API の上限に収め、異常に長い行でメモリを使わないようにする)
+SUMMARY_LIMIT = 1024
+DESCRIPTION_LIMIT = 8192
+
+# 文字コードの判定に使う先頭のバイト数
+_SNIFF_BYTES = 64 * 1024
+
+# 読み込み結果: (ファイル上の行番号, 予定 or None, メッセージ or None)
+# メッセージは予定が None ならエラー内容、そうでなければ登録はできる予定への注意書き
+ImportRecord = tuple[int, dict | None, str | None]
+
+
+class ImportFileError(Exception):
+    """ファイル全体を読み込めない (大きすぎる・取得できないなど)"""
+
+
+def is_supported(filename: str) -> bool:
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+# --- ファイルの取得 ---
+
+async def download(url: str, max_bytes: int) -> IO[bytes]:
+    """添付ファイルを一時ファイルへ少しずつ保存し、先頭に戻したファイルを返す"""
+    file = tempfile.TemporaryFile()
+    try:
+        timeout = aiohttp.ClientTimeout(total=IMPORT_DOWNLOAD_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(url) as resp:
+                if resp.status != 200:
+                    raise ImportFileError(f"ファイルを取得できませんでした (HTTP {resp.status})")
+                size = 0
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ImportFileError(f"ファイルが大きすぎます (上限 {max_bytes // (1024 * 1024)}MB)")
+                    file.write(chunk)
+    except ImportFileError:
+        file.close()
+        raise
+    except (aiohttp.ClientError, TimeoutError) as e:
+        file.close()
+        raise ImportFileError(f"ファイルを取得できませんでした: {e}") from e
+    file.seek(0)
+    return file
+
+
+def open_text(file: IO[bytes]) -> IO[str]:
+    """
+    文字コードを判定してテキストとして開く。
+    UTF-8 (BOM付きを含む) として読めなければ、Excel が保存するCSVの Shift_JIS (cp932) とみなす。
+    """
+    head = file.read(_SNIFF_BYTES)
+    file.seek(0)
+    try:
+        # 途中で切れたマルチバイト文字はエラーにしない
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        encoding = "cp932"
+    # newline="" : CSVの引用符内の改行をそのまま読む
+    return io.TextIOWrapper(file, encoding=encoding, errors="replace", newline="")
+
+
+def iter_file_events(filename: str, text: IO[str], tz: tzinfo) -> Iterator[ImportRecord]:
+    """拡張子に応じて .ics または CSV として読み込む。時刻は tz の時刻に直す"""
+    if filename.lower().endswith(".csv"):
+        return iter_csv_events(text, tz)
+    return iter_ics_events(text, tz)
+
+
+def _clean(value: str | None, limit: int) -> str | None:
+    if value is None:
+        return None
+    value = value.strip()
+    return value[:limit] or None
+
+
+# --- iCalendar (.ics) ---
+
+_ICS_ESCAPES = re.compile(r"\\([\\;,nN])")
+_ICS_DURATION = re.compile(
+    r"^(?P<sign>[+-])?P(?:(?P<w>\d+)W)?(?:(?P<d>\d+)D)?(?:T(?:(?P<h>\d+)H)?(?:(?P<m>\d+)M)?(?:(?P<s>\d+)S)?)?$"
+)
+
+
+def _unfold(lines: IO[str]) -> Iterator[tuple[int, str]]:
+    """折り返された行 (次の行が空白で始まる) をつなげ、(開始行番号, 1行) を返す"""
+    current, start = None, 0
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, number
+    if current is not None:
+        yield start, current
+
+
+def _split_content_line(line: str) -> tuple[str, dict[str, str], str]:
+    """「名前;パラメータ=値:値」を (名前, {パラメータ: 値}, 値) に分ける。引用符内の : ; は区切りにしない"""
+    quoted = False
+    parts, begin = [], 0
+    for i, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char in ";:":
+            parts.append(line[begin:i])
+            begin = i + 1
+            if char == ":":
+                break
+    else:
+        return line.upper(), {}, ""
+
+    params = {}
+    for param in parts[1:]:
+        key, _, value = param.partition("=")
+        params[key.upper()] = value.strip('"')
+    return parts[0].upper(), params, line[begin:]
+
+
+def _unescape(value: str) -> str:
+    return _ICS_ESCAPES.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def _ics_timezone(tzid: str | None, default: tzinfo) -> tzinfo:
+    if not tzid:
+        return default
+    try:
+        return ZoneInfo(tzid)
+    except (ValueError, KeyError, OSError):
+        # Outlook の "Tokyo Standard Time" など IANA 名でないものは既定のタイムゾーンとみなす
+        return default
+
+
+def _parse_ics_time(value: str, params: dict[str, str], tz: tzinfo) -> date | datetime:
+    """DTSTART / DTEND の値を date (終日) または tz の datetime に変換する"""
+    value = value.strip()
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return datetime.strptime(value, "%Y%m%d").date()
+    if value.endswith("Z"):
+        dt = datetime.strptime(value[:-1], "%Y%m%dT%H%M%S").replace(tzinfo=timezone.utc)
+    else:
+        dt = datetime.strptime(value[:15], "%Y%m%dT%H%M%S").replace(tzinfo=_ics_timezone(params.get("TZID"), tz))
+    return dt.astimezone(tz)
+
+
+def _parse_ics_duration(value: str) -> timedelta:
+    match = _ICS_DURATION.match(value.strip())
+    if not match:
+        raise ValueError(f"DURATION の形式が不正です: {value}")
+    parts = {k: int(v or 0) for k, v in match.groupdict().items() if k != "sign"}
+    delta = timedelta(weeks=parts["w"], days=parts["d"], hours=parts["h"], minutes=parts["m"], seconds=parts["s"])
+    return -delta if match.group("sign") == "-" else delta
+
+
+def _ics_event(props: dict[str, tuple[dict[str, str], str]], tz: tzinfo) -> dict | None:
+    """VEVENT のプロパティから予定を作る。取り消された予定は None"""
+    if props.get("STATUS", ({}, ""))[1].strip().upper() == "CANCELLED":
+        return None
+    if "DTSTART" not in props:
+        raise ValueError("DTSTART がありません")
+
+    start = _parse_ics_time(props["DTSTART"][1], props["DTSTART"][0], tz)
+    if "DTEND" in props:
+        end = _parse_ics_time(props["DTEND"][1], props["DTEND"][0], tz)
+    elif "DURATION" in props:
+        end = start + _parse_ics_duration(props["DURATION"][1])
+    else:
+        # RFC 5545: 終了がなければ終日は1日、時刻指定は開始と同時刻
+        end = start + timedelta(days=1) if not isinstance(start, datetime) else start
+
+    def text(name: str, limit: int) -> str | None:
+        return _clean(_unescape(props[name][1]), limit) if name in props else None
+
+    event = {
+        "summary": text("SUMMARY", SUMMARY_LIMIT),
+        "location": text("LOCATION", SUMMARY_LIMIT),
+        "description": text("DESCRIPTION", DESCRIPTION_LIMIT),
+    }
+    if isinstance(start, datetime):
+        if not isinstance(end, datetime):
+            end = datetime.combine(end, start.timetz())
+        end = max(end, start)
+        event.update(
+            start_date=start.strftime("%Y-%m-%d"), start_time=start.strftime("%H:%M:%S"),
+            end_date=end.strftime("%Y-%m-%d"), end_time=end.strftime("%H:%M:%S"),
+        )
+    else:
+        # 終日の DTEND は翌日 (含まない日) で、Calendar API の end.date と同じ
+        end = end.date() if isinstance(end, datetime) else end
+        event.update(
+            start_date=start.isoformat(), start_time=None,
+            end_date=max(end, start + timedelta(days=1)).isoformat(), end_time=None,
+        )
+    return event
+
+
+def iter_ics_events(lines: IO[str], tz: tzinfo) -> Iterator[ImportRecord]:
+    """
+    .ics を1行ずつ読み、VEVENT ごとに (行番号, 予定, メッセージ) を返す。
+    繰り返し予定 (RRULE) は最初の1回だけを登録し、エラー欄に注意書きを入れる。
+    """
+    props: dict[str, tuple[dict[str, str], str]] | None = None
+    nested = 0
+    start_line = 0
+
+    for number, line in _unfold(lines):
+        name, params, value = _split_content_line(line)
+        if name == "BEGIN":
+            if props is not None:
+                # VALARM など予定の中の要素は読み飛ばす
+                nested += 1
+            elif value.strip().upper() == "VEVENT":
+                props, nested, start_line = {}, 0, number
+            continue
+        if name == "END" and props is not None:
+            if nested:
+                nested -= 1
+                continue
+            try:
+                event = _ics_event(props, tz)
+            except ValueError as e:
+                yield start_line, None, str(e)
+            else:
+                if event is not None:
+                    yield start_line, event, ("繰り返し予定は最初の1回だけ登録しました" if "RRULE" in props else None)
+            props = None
+            continue
+        if props is not None and not nested and name not in props:
+            props[name] = (params, value)
+
+
+# --- CSV ---
+
+# 列名 (小文字・空白除去後) -> 予定の項目。Googleカレンダー / Outlook のCSV形式と日本語の列名に対応する
+_CSV_COLUMNS = {
+    "summary": "summary", "subject": "summary", "title": "summary", "件名": "summary", "タイトル": "summary", "予定": "summary",
+    "location": "location", "場所": "location",
+    "description": "description", "説明": "description", "詳細": "description", "メモ": "description",
+    "start": "start", "開始": "start", "開始日時": "start",
+    "end": "end", "終了": "end", "終了日時": "end",
+    "startdate": "start_date", "start_date": "start_date", "開始日": "start_date",
+    "starttime": "start_time", "start_time": "start_time", "開始時刻": "start_time", "開始時間": "start_time",
+    "enddate": "end_date", "end_date": "end_date", "終了日": "end_date",
+    "endtime": "end_time", "end_time": "end_time", "終了時刻": "end_time", "終了時間": "end_time",
+    "alldayevent": "all_day", "allday": "all_day", "all_day": "all_day", "終日": "all_day",
+}
+
+_CSV_DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%Y年%m月%d日", "%Y%m%d")
+_CSV_TIME_FORMATS = ("%H:%M", "%H:%M:%S", "%I:%M %p", "%I:%M:%S %p", "%H時%M分", "%H時")
+_TRUE_VALUES = {"true", "yes", "y", "1", "○", "はい"}
+
+
+def _parse_csv_date(value: str) -> date:
+    for fmt in _CSV_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"日付の形式が不正です: {value}")
+
+
+def _parse_csv_time(value: str) -> str:
+    for fmt in _CSV_TIME_FORMATS:
+        try:
+            return datetime.strptime(value.upper(), fmt).strftime("%H:%M:%S")
+        except ValueError:
+            continue
+    raise ValueError(f"時刻の形式が不正です: {value}")
+
+
+def _split_datetime(value: str) -> tuple[str, str | None]:
+    """「2025-03-01 10:00」「2025-03-01T10:00」を日付と時刻に分ける"""
+    date_part, _, time_part = value.replace("T", " ", 1).partition(" ")
+    return date_part, time_part.strip() or None
+
+
+def _csv_event(row: dict[str, str]) -> dict:
+    for key in ("start", "end"):
+        if row.get(key) and not row.get(f"{key}_date"):
+            row[f"{key}_date"], time_part = _split_datetime(row[key])
+            if not row.get(f"{key}_time"):
+                row[f"{key}_time"] = time_part or ""
+
+    if not row.get("start_date"):
+        raise ValueError("開始日がありません")
+    start_date = _parse_csv_date(row["start_date"])
+    end_date = _parse_csv_date(row["end_date"]) if row.get("end_date") else start_date
+    all_day = (row.get("all_day") or "").lower() in _TRUE_VALUES or not row.get("start_time")
+
+    event = {
+        "summary": _clean(row.get("summary"), SUMMARY_LIMIT),
+        "location": _clean(row.get("location"), SUMMARY_LIMIT),
+        "description": _clean(row.get("description"), DESCRIPTION_LIMIT),
+        "start_date": start_date.isoformat(),
+    }
+    if all_day:
+        # CSVの終了日は最終日 (含む) として扱い、Calendar API の形式 (翌日) に直す
+        end_date = max(end_date, start_date) + timedelta(days=1)
+        event.update(start_time=None, end_date=end_date.isoformat(), end_time=None)
+    else:
+        end_time = _parse_csv_time(row["end_time"]) if row.get("end_time") else None
+        event.update(
+            start_time=_parse_csv_time(row["start_time"]),
+            end_date=end_date.isoformat() if end_time else None,
+            end_time=end_time,
+        )
+    return event
+
+
+def iter_csv_events(lines: IO[str], tz: tzinfo) -> Iterator[ImportRecord]:
+    """
+    1行目を列名としてCSVを1行ずつ読み、(行番号, 予定, メッセージ) を返す。
+    日時は書かれたまま tz の時刻とみなす。空行は読み飛ばす。
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [_CSV_COLUMNS.get(unicodedata.normalize("NFKC", name).strip().lower().replace(" ", "")) for name in header]
+    if "start" not in columns and "start_date" not in columns:
+        yield 1, None, "開始日の列が見つかりません (Start Date / 開始日 など)"
+        return
+
+    line = reader.line_num + 1
+    for values in reader:
+        row = {
+            column: unicodedata.normalize("NFKC", value).strip() if column != "description" else value
+            for column, value in zip(columns, values) if column
+        }
+        if any(row.values()):
+            try:
+                yield line, _csv_event(row), None
+            except ValueError as e:
+                yield line, None, str(e)
+        line = reader.line_num + 1
@@ -1,16 +1,64 @@
 # gemini_handler.py
 import os
-import google.generativeai as genai
 import json
-import re
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import unicodedata
+from contextlib import aclosing
 from datetime import datetime
+from typing import AsyncIterator
+
+import database as db
+import local_parser
+import metrics
+import resilience
+from cache import LRUCache
+from json_stream import JsonArrayStream
+
+# Gemini APIへの同時リクエスト数の上限 (バーストでクォータを使い切らないようにする)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "10"))
+_gemini_slots = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+# 再試行を含めた1回の解析にかける時間の上限 (秒)
+GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "60"))
+
+
+async def _generate(prompt: str, **kwargs):
+    """同時リクエスト数の枠を取ってGeminiを呼び出す。一時的なエラーは再試行する"""
+    async def call():
+        async with _gemini_slots:
+            return await _get_model().generate_content_async(prompt, **kwargs)
+    return await resilience.call_async(resilience.gemini_breaker, call, GEMINI_DEADLINE)
 
 # Gemini APIキーの設定
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY is not set in the environment variables.")
 
-genai.configure(api_key=GEMINI_API_KEY)
+# 出力するイベントのスキーマ (google_calendar.py に渡す辞書と同じ形)
+_NULLABLE_STRING = {"type": "string", "nullable": True}
+EVENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string", "description": "イベント名"},
+        "location": {**_NULLABLE_STRING, "description": "場所"},
+        "description": {**_NULLABLE_STRING, "description": "詳細"},
+        "start_date": {**_NULLABLE_STRING, "description": "YYYY-MM-DD"},
+        "start_time": {**_NULLABLE_STRING, "description": "HH:MM:SS"},
+        "end_date": {**_NULLABLE_STRING, "description": "YYYY-MM-DD"},
+        "end_time": {**_NULLABLE_STRING, "description": "HH:MM:SS"},
+    },
+    "required": ["summary"],
+}
+EVENTS_SCHEMA = {"type": "array", "items": EVENT_SCHEMA}
+
+# 毎回変わらない指示はシステム指示としてモデルに持たせ、リクエストには入力と日付だけを送る
+SYSTEM_INSTRUCTION = """あなたはユーザーのチャット発言からスケジュールを抽出する有能な秘書です。
+- 発言に含まれる予定をすべて抽出し、予定の配列として出力してください。
+- 日付や時間が明示されていない場合は、「今日の日付」と文脈から推測するか、nullにしてください。
+- 予定の内容 (summary) は必須です。"""
 
 # Geminiモデルの設定
 generation_config = {
@@ -19,6 +67,7 @@ generation_config = {
     "top_k": 1,
     "max_output_tokens": 2048,
     "response_mime_type": "application/json",
+    "response_schema": EVENTS_SCHEMA,
 }
 
 safety_settings = [
@@ -32,107 +81,416 @@ safety_settings = [
 # もしこれでもダメなら "gemini-pro" (1.0) を試してみてください
 MODEL_NAME = "gemini-flash-latest" 
 
-model = genai.GenerativeModel(
-    model_name=MODEL_NAME,
-    generation_config=generation_config,
-    safety_settings=safety_settings
-)
-
-def _create_prompt(text: str) -> str:
-    """Gemini APIに送信するためのプロンプトを作成する"""
-    today = datetime.now().strftime('%Y-%m-%d')
-    return f"""
-    あなたはユーザーのチャット発言からスケジュールを抽出する有能な秘書です。
-    
-    # 入力テキスト
-    {text}
-
-    # 今日の日付
-    {today}
-
-    # 指示
-    - ユーザーの発言を解析し、JSONフォーマットで出力してください。
-    - 複数の予定が含まれる場合は、JSONの配列にしてください。
-    - 日付や時間が明示されていない場合は、文脈から推測するか、nullにしてください。
-    - 予定の内容 (summary) は必須です。
-    - JSON以外の余計な説明は一切不要です。
-
-    # 出力形式 (単一の予定)
-    ```json
-    {{
-      "summary": "イベント名",
-      "location": "場所 (任意)",
-      "description": "詳細 (任意)",
-      "start_date": "YYYY-MM-DD",
-      "start_time": "HH:MM:SS",
-      "end_date": "YYYY-MM-DD",
-      "end_time": "HH:MM:SS"
-    }}
-    ```
-
-    # 出力形式 (複数の予定)
-    ```json
-    [
-      {{
-        "summary": "イベント名1",
-        "start_date": "YYYY-MM-DD",
-        "start_time": "HH:MM:SS",
-        "end_date": "YYYY-MM-DD",
-        "end_time": "HH:MM:SS"
-      }},
-      {{
-        "summary": "イベント名2",
-        "start_date": "YYYY-MM-DD",
-        "start_time": "HH:MM:SS",
-        "end_date": "YYYY-MM-DD",
-        "end_time": "HH:MM:SS"
-      }}
-    ]
-    ```
+_model_lock = threading.Lock()
+
+
+def _get_model():
     """
+    Geminiモデルを返す。SDKの読み込みは重いため、最初に必要になったときに行う。
+    モジュール属性 model を差し替えた場合はそれを使う。
+    """
+    with _model_lock:
+        current = globals().get("model")
+        if current is None:
+            import google.generativeai as genai
+
+            genai.configure(api_key=GEMINI_API_KEY)
+            current = genai.GenerativeModel(
+                model_name=MODEL_NAME,
+                generation_config=generation_config,
+                safety_settings=safety_settings,
+                system_instruction=SYSTEM_INSTRUCTION,
+            )
+            globals()["model"] = current
+        return current
+
+
+def __getattr__(name: str):
+    # gemini_handler.model を参照したときにモデルを作る
+    if name == "model":
+        return _get_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def warm_up():
+    """SDKの読み込みとモデルの生成を事前に済ませておく (スレッドから呼ぶ)"""
+    _get_model()
+
+
+# 解析結果キャッシュの設定 (メモリ上のLRU + SQLite)
+PARSE_CACHE_SIZE = int(os.getenv("PARSE_CACHE_SIZE", "1000"))
+PARSE_CACHE_TTL = float(os.getenv("PARSE_CACHE_TTL", "86400"))
+PARSE_CACHE_MAX_ROWS = int(os.getenv("PARSE_CACHE_MAX_ROWS", "50000"))
+# SQLite側はこの回数保存するごとに期限切れ・上限超過分を掃除する
+PARSE_CACHE_PRUNE_INTERVAL = 100
+
+_parse_cache = LRUCache(maxsize=PARSE_CACHE_SIZE, ttl=PARSE_CACHE_TTL)
+_parse_cache_counts = {"local_hits": 0, "memory_hits": 0, "db_hits": 0, "misses": 0}
+_saves_since_prune = 0
+
+
+def _normalize_text(text: str) -> str:
+    """全角・半角や空白の揺れを吸収したテキストを返す"""
+    text = unicodedata.normalize("NFKC", text)
+    lines = (" ".join(line.split()) for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def _cache_key(text: str, today: str) -> str:
+    """正規化したテキストと基準日からキャッシュキーを作る (相対日付は基準日で変わるため)"""
+    return hashlib.sha256(f"{today}\n{_normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+async def _get_cached_events(cache_key: str) -> list[dict] | None:
+    events_json = _parse_cache.get(cache_key, None)
+    if events_json is not None:
+        _parse_cache_counts["memory_hits"] += 1
+        return json.loads(events_json)
 
+    try:
+        events_json = await db.aget_parse_cache(cache_key, PARSE_CACHE_TTL)
+    except Exception as e:
+        logging.error(f"Failed to read parse cache: {e}")
+        events_json = None
+
+    if events_json is None:
+        _parse_cache_counts["misses"] += 1
+        return None
+
+    _parse_cache_counts["db_hits"] += 1
+    _parse_cache.set(cache_key, events_json)
+    return json.loads(events_json)
+
+
+async def _store_cached_events(cache_key: str, events: list[dict]):
+    global _saves_since_prune
+    events_json = json.dumps(events, ensure_ascii=False)
+    _parse_cache.set(cache_key, events_json)
+
+    try:
+        await db.asave_parse_cache(cache_key, events_json)
+        _saves_since_prune += 1
+        if _saves_since_prune >= PARSE_CACHE_PRUNE_INTERVAL:
+            _saves_since_prune = 0
+            await db.aprune_parse_cache(PARSE_CACHE_TTL, PARSE_CACHE_MAX_ROWS)
+    except Exception as e:
+        logging.error(f"Failed to write parse cache: {e}")
+
+
+def parse_cache_stats() -> dict:
+    """解析結果キャッシュのヒット率などを返す"""
+    hits = _parse_cache_counts["local_hits"] + _parse_cache_counts["memory_hits"] + _parse_cache_counts["db_hits"]
+    total = hits + _parse_cache_counts["misses"]
+    return {
+        **_parse_cache_counts,
+        "hits": hits,
+        "memory_size": len(_parse_cache),
+        "hit_rate": hits / total if total else 0.0,
+    }
+
+
+def _create_prompt(text: str, today: str | None = None) -> str:
+    """Gemini APIに送信するプロンプトを作成する (指示はシステム指示側に持たせる)"""
+    today = today or datetime.now().strftime('%Y-%m-%d')
+    return f"# 今日の日付\n{today}\n\n# 入力テキスト\n{text}"
+
+
+def _parse_locally(text: str, now: datetime) -> list[dict] | None:
+    """ローカルの簡易パーサーで十分な確度が得られた場合だけ結果を返す"""
+    if not local_parser.LOCAL_PARSER_ENABLED:
+        return None
+    events, confidence = local_parser.parse(text, now.date())
+    if events and confidence >= local_parser.LOCAL_PARSER_MIN_CONFIDENCE:
+        _parse_cache_counts["local_hits"] += 1
+        return events
+    return None
+
+
+@metrics.timed("parse")
 async def parse_event_details(text: str) -> tuple[list[dict] | None, str | None]:
     """
     テキストからカレンダーのイベント詳細を抽出する。
+    単純な入力はローカルで解析し、同じ内容・同じ基準日の入力はキャッシュから返す。
     戻り値: (イベント情報の辞書のリスト, エラーメッセージ)
     """
-    prompt = _create_prompt(text)
+    now = datetime.now()
+    today = now.strftime('%Y-%m-%d')
+
+    events = _parse_locally(text, now)
+    if events:
+        return events, None
+
+    cache_key = _cache_key(text, today)
+
+    cached = await _get_cached_events(cache_key)
+    if cached is not None:
+        return cached, None
+
+    if GEMINI_BATCH_WINDOW_MS > 0:
+        events, error = await _batcher.submit(text, today)
+    else:
+        events, error = await _parse_with_gemini(text, today)
+    if events is not None:
+        await _store_cached_events(cache_key, events)
+    return events, error
+
+
+def _validate_events(events) -> list[dict] | None:
+    """解析結果をイベントのリストに正規化する。不正な形式ならNoneを返す"""
+    # 常にリストを返すように正規化
+    if isinstance(events, dict):
+        events = [events]
+
+    # summaryの存在チェック
+    if not isinstance(events, list) or not all(isinstance(e, dict) and e.get("summary") for e in events):
+        return None
+    return events
+
+
+@metrics.timed("gemini_api")
+async def _parse_with_gemini(text: str, today: str) -> tuple[list[dict] | None, str | None]:
+    """Gemini APIでテキストを解析する"""
+    prompt = _create_prompt(text, today)
     
     try:
-        response = await model.generate_content_async(prompt)
+        response = await _generate(prompt)
         response_text = response.text
-        
-        json_str = ""
-        # マークダウンブロックからJSONを抽出
-        match = re.search(r"```(?:json)?\s*([\s\S]+?)\s*```", response_text)
-        if match:
-            json_str = match.group(1).strip()
-        else:
-            # マークダウンがない場合、レスポンス全体をJSONとして扱う
-            json_str = response_text.strip()
-
-        events = json.loads(json_str)
-        
-        # 常にリストを返すように正規化
-        if isinstance(events, dict):
-            events = [events]
-        
-        # summaryの存在チェック
-        if not isinstance(events, list) or not all(isinstance(e, dict) and e.get("summary") for e in events):
-            return None, f"summary(予定のタイトル)が取得できない、または不正な形式のデータです。\nRaw: {json_str}"
-            
+
+        # 応答はスキーマで形式が決まっているため、そのままデコードする
+        events = _validate_events(json.loads(response_text))
+        if events is None:
+            return None, f"summary(予定のタイトル)が取得できない、または不正な形式のデータです。\nRaw: {response_text}"
+
         return events, None
 
     except json.JSONDecodeError as e:
         return None, f"JSON解析エラー: {e}\nRaw: {response_text[:500] if 'response_text' in locals() else 'None'}"
+    except resilience.CircuitOpenError:
+        # 呼び出し側で時間を置いてやり直す
+        raise
     except Exception as e:
-        # ▼▼▼ 修正2: エラー時に利用可能なモデル一覧を表示してデバッグしやすくする ▼▼▼
-        error_msg = f"予期せぬエラー: {e}"
-        if "404" in str(e) or "not found" in str(e):
+        return None, _format_gemini_error(e)
+
+
+def _format_gemini_error(e: Exception) -> str:
+    """予期せぬエラーのメッセージを作る"""
+    # ▼▼▼ 修正2: エラー時に利用可能なモデル一覧を表示してデバッグしやすくする ▼▼▼
+    error_msg = f"予期せぬエラー: {e}"
+    if "404" in str(e) or "not found" in str(e):
+        try:
+            import google.generativeai as genai
+
+            available_models = [m.name for m in genai.list_models()]
+            error_msg += f"\n\n【デバッグ情報】利用可能なモデル一覧:\n{', '.join(available_models)}"
+        except Exception as list_error:
+            error_msg += f"\n(モデル一覧の取得にも失敗: {list_error})"
+    return error_msg
+
+
+# --- ストリーミング ---
+# 応答全体を待たず、予定が1件完成するたびに呼び出し側へ渡す。
+# 複数の予定を含むメッセージで最初の登録までの時間を短くする。GEMINI_STREAMING=1 で有効。
+
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "0") == "1"
+
+
+async def iter_event_details(text: str) -> AsyncIterator[tuple[dict | None, str | None]]:
+    """
+    parse_event_details のストリーミング版。
+    予定を1件解析できるたびに (予定, None) を返し、失敗した場合は (None, エラーメッセージ) を返して終わる。
+    ローカル解析・キャッシュ・マイクロバッチの結果はまとめて返す。
+    """
+    now = datetime.now()
+    today = now.strftime('%Y-%m-%d')
+
+    events = _parse_locally(text, now)
+    if events:
+        for event in events:
+            yield event, None
+        return
+
+    cache_key = _cache_key(text, today)
+    events = await _get_cached_events(cache_key)
+    if events is None and GEMINI_BATCH_WINDOW_MS > 0:
+        # マイクロバッチでは応答全体を待ってから返す
+        events, error = await _batcher.submit(text, today)
+        if error:
+            yield None, error
+            return
+        await _store_cached_events(cache_key, events)
+    if events is not None:
+        for event in events:
+            yield event, None
+        return
+
+    events = []
+    async with aclosing(_stream_with_gemini(text, today)) as stream:
+        async for event, error in stream:
+            if error:
+                yield None, error
+                return
+            events.append(event)
+            yield event, None
+    await _store_cached_events(cache_key, events)
+
+
+async def _stream_with_gemini(text: str, today: str) -> AsyncIterator[tuple[dict | None, str | None]]:
+    """Gemini APIのストリーミング応答から予定を1件ずつ取り出す"""
+    prompt = _create_prompt(text, today)
+    parser = JsonArrayStream()
+    start = time.perf_counter()
+    count = 0
+
+    # 応答を読み終わるまで同時リクエスト数の枠を使う
+    async with _gemini_slots:
+        try:
+            # ストリームの開始までは再試行する (途中で失敗した場合は予定の重複を避けるため再試行しない)
+            response = await resilience.call_async(
+                resilience.gemini_breaker,
+                lambda: _get_model().generate_content_async(prompt, stream=True),
+                GEMINI_DEADLINE,
+            )
+            async for chunk in response:
+                for element in parser.feed(chunk.text):
+                    events = _validate_events(element)
+                    if events is None:
+                        yield None, f"summary(予定のタイトル)が取得できない、または不正な形式のデータです。\nRaw: {json.dumps(element, ensure_ascii=False)}"
+                        return
+                    for event in events:
+                        if count == 0:
+                            metrics.stage_seconds.observe(time.perf_counter() - start, stage="gemini_first_event")
+                        count += 1
+                        yield event, None
+        except json.JSONDecodeError as e:
+            yield None, f"JSON解析エラー: {e}\nRaw: {parser.text[:500]}"
+            return
+        except resilience.CircuitOpenError:
+            raise
+        except Exception as e:
+            yield None, _format_gemini_error(e)
+            return
+
+        metrics.stage_seconds.observe(time.perf_counter() - start, stage="gemini_stream")
+
+    if not parser.done:
+        yield None, f"JSON解析エラー: 応答が途中で終わっています\nRaw: {parser.text[:500]}"
+
+
+# --- マイクロバッチ ---
+# 短い時間窓に届いた複数の解析依頼を1回のプロンプトにまとめ、
+# リクエスト数のクォータを節約する。GEMINI_BATCH_WINDOW_MS=0 で無効。
+
+GEMINI_BATCH_WINDOW_MS = int(os.getenv("GEMINI_BATCH_WINDOW_MS", "0"))
+GEMINI_BATCH_MAX_SIZE = int(os.getenv("GEMINI_BATCH_MAX_SIZE", "8"))
+
+
+# マイクロバッチの応答は入力IDと予定の配列の組のリストにする
+BATCH_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {"id": {"type": "string"}, "events": EVENTS_SCHEMA},
+        "required": ["id", "events"],
+    },
+}
+
+
+def _create_batch_prompt(items: list[tuple[str, str]]) -> str:
+    """複数の入力をまとめて解析するプロンプトを作成する"""
+    inputs = "\n\n".join(
+        f"## ID: {i} (今日の日付: {today})\n{text}" for i, (text, today) in enumerate(items)
+    )
+    return (
+        "以下の複数の入力をそれぞれ独立に解析し、すべての入力IDについて"
+        "IDとその入力から抽出した予定の配列の組を出力してください。\n\n"
+        f"{inputs}"
+    )
+
+
+class _GeminiBatcher:
+    """時間窓内に届いた解析依頼をまとめてGeminiに送る"""
+
+    def __init__(self, window_ms: int, max_size: int):
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self.batches_sent = 0
+        self.fallbacks = 0
+        self._pending: list[tuple[str, str, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, text: str, today: str) -> tuple[list[dict] | None, str | None]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, today, future))
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[str, str, asyncio.Future]]):
+        if len(batch) == 1:
+            text, today, future = batch[0]
             try:
-                available_models = [m.name for m in genai.list_models()]
-                error_msg += f"\n\n【デバッグ情報】利用可能なモデル一覧:\n{', '.join(available_models)}"
-            except Exception as list_error:
-                error_msg += f"\n(モデル一覧の取得にも失敗: {list_error})"
-        
-        return None, error_msg
\ No newline at end of file
+                self._resolve(future, await _parse_with_gemini(text, today))
+            except resilience.CircuitOpenError as e:
+                self._resolve(future, e)
+            return
+
+        self.batches_sent += 1
+        results: dict = {}
+        try:
+            prompt = _create_batch_prompt([(text, today) for text, today, _ in batch])
+            response = await _generate(prompt, generation_config={"response_schema": BATCH_SCHEMA})
+            results = {
+                str(item.get("id")): item.get("events")
+                for item in json.loads(response.text)
+                if isinstance(item, dict)
+            }
+        except resilience.CircuitOpenError as e:
+            for _, _, future in batch:
+                self._resolve(future, e)
+            return
+        except Exception as e:
+            logging.warning(f"Batched Gemini request failed, falling back to individual calls: {e}")
+
+        # 結果が取れなかった入力は個別に解析し直す (予定が0件という結果は、取れた結果として扱う)
+        retries = []
+        for i, (text, today, future) in enumerate(batch):
+            events = _validate_events(results.get(str(i)))
+            if events is not None:
+                self._resolve(future, (events, None))
+            else:
+                retries.append((text, today, future))
+
+        if retries:
+            self.fallbacks += len(retries)
+            outcomes = await asyncio.gather(
+                *(_parse_with_gemini(text, today) for text, today, _ in retries), return_exceptions=True
+            )
+            for (_, _, future), outcome in zip(retries, outcomes):
+                self._resolve(future, outcome)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result):
+        if future.done():
+            return
+        if isinstance(result, BaseException):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+
+_batcher = _GeminiBatcher(GEMINI_BATCH_WINDOW_MS, GEMINI_BATCH_MAX_SIZE)
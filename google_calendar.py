@@ -1,27 +1,109 @@
 # google_calendar.py
+from __future__ import annotations
+
 import os
 import json
 import datetime
+import hashlib
 import logging
-from typing import Dict, Any
+import threading
+import time
+import asyncio
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Dict, Any
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build, Resource
 from googleapiclient.errors import HttpError
 
+# 認証・HTTPまわりのライブラリは読み込みが重いため、最初に使うときに読み込む
+if TYPE_CHECKING:
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import Resource
+
+import database as db
+import metrics
+import resilience
+
 # スコープの定義
 SCOPES = ['https://www.googleapis.com/auth/calendar.events']
 
 
 SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_SERVICE_ACCOUNT_FILE", "/usr/src/app/service_account.json")
 
+# Calendar API のディスカバリードキュメントの保存先。
+# ライブラリ同梱のものがない場合は初回だけ取得してここに保存する
+CALENDAR_DISCOVERY_FILE = os.getenv("CALENDAR_DISCOVERY_FILE", "/data/calendar_v3_discovery.json")
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/calendar/v3/rest"
+
+# アクセストークンの期限がこの秒数以内に迫ったら、リクエスト前に更新しておく
+TOKEN_REFRESH_MARGIN = int(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN", "300"))
+
+# 認証情報はプロセス全体で共有する
+_credentials_lock = threading.Lock()
+_service_account_info: dict | None = None
+_credentials: service_account.Credentials | None = None
+
+# ディスカバリードキュメント (JSON文字列)。生成されたサービスが中身を書き換えるため、
+# 解析済みの辞書ではなく文字列で持ち、スレッドごとに解析させる
+_discovery_lock = threading.Lock()
+_discovery_document: str | None = None
+
+# Resource (httplib2) はスレッドセーフではないため、スレッドごとに1つ保持する
+_thread_local = threading.local()
+
+# 同期APIはイベントループを止めないよう専用のスレッドプールで実行する
+CALENDAR_MAX_WORKERS = int(os.getenv("CALENDAR_MAX_WORKERS", "8"))
+CALENDAR_TIMEOUT = float(os.getenv("CALENDAR_TIMEOUT", "30"))
+# 一時的なエラーを再試行してよい時間 (秒)。この時間内に始めた最後の試行は CALENDAR_TIMEOUT まで続きうる
+CALENDAR_RETRY_DEADLINE = float(os.getenv("CALENDAR_RETRY_DEADLINE", "20"))
+# スレッドプールでの呼び出し全体の制限時間。再試行の途中で打ち切り、登録できた予定を失敗と報告しないよう、
+# 再試行の時間に最後の試行1回分を足しておく
+CALENDAR_CALL_TIMEOUT = CALENDAR_RETRY_DEADLINE + CALENDAR_TIMEOUT
+
+_executor = ThreadPoolExecutor(max_workers=CALENDAR_MAX_WORKERS, thread_name_prefix="gcal")
+# 同時に実行するCalendar API呼び出しの上限。待ち時間はタイムアウトに含めない
+CALENDAR_MAX_CONCURRENCY = int(os.getenv("CALENDAR_MAX_CONCURRENCY", str(CALENDAR_MAX_WORKERS)))
+_calendar_slots = asyncio.Semaphore(CALENDAR_MAX_CONCURRENCY)
+# スレッドプールに投入済みで終わっていない呼び出しの数
+_pending_calls = 0
+
 
 def _load_service_account_info() -> dict:
-    """サービスアカウントのJSONファイルを読み込む"""
+    """サービスアカウントのJSONファイルを読み込む (初回のみファイルを読む)"""
+    global _service_account_info
+    if _service_account_info is not None:
+        return _service_account_info
     if not os.path.exists(SERVICE_ACCOUNT_FILE):
         raise FileNotFoundError(f"Service account file not found: {SERVICE_ACCOUNT_FILE}")
     with open(SERVICE_ACCOUNT_FILE, 'r') as f:
-        return json.load(f)
+        _service_account_info = json.load(f)
+    return _service_account_info
+
+
+def _token_expires_soon(creds: service_account.Credentials) -> bool:
+    """トークン未取得、または期限切れが近いか"""
+    if not creds.token or creds.expiry is None:
+        return True
+    # google-auth の expiry はタイムゾーンなしのUTC
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now < datetime.timedelta(seconds=TOKEN_REFRESH_MARGIN)
+
+
+def _get_credentials() -> service_account.Credentials:
+    """共有の認証情報を返す。期限が近ければ先回りして更新する"""
+    global _credentials
+    from google.auth.transport.requests import Request
+    from google.oauth2 import service_account
+
+    with _credentials_lock:
+        if _credentials is None:
+            creds_data = _load_service_account_info()
+            _credentials = service_account.Credentials.from_service_account_info(creds_data, scopes=SCOPES)
+        if _token_expires_soon(_credentials):
+            _credentials.refresh(Request())
+            logging.info(f"Refreshed Google access token (expires at {_credentials.expiry} UTC)")
+        return _credentials
 
 
 def get_service_account_email() -> str | None:
@@ -33,15 +115,68 @@ def get_service_account_email() -> str | None:
         return None
 
 
+def _load_discovery_document() -> str:
+    """
+    ディスカバリードキュメントを読み込む (プロセスで1回だけ)。
+    保存済みのファイル、ライブラリ同梱のもの、ネットワークの順に探す。
+    """
+    global _discovery_document
+    with _discovery_lock:
+        if _discovery_document is not None:
+            return _discovery_document
+
+        document = None
+        if os.path.exists(CALENDAR_DISCOVERY_FILE):
+            try:
+                with open(CALENDAR_DISCOVERY_FILE, 'r', encoding='utf-8') as f:
+                    document = f.read()
+            except OSError as e:
+                logging.warning(f"Failed to read discovery document cache: {e}")
+
+        if document is None:
+            from googleapiclient import discovery_cache
+            document = discovery_cache.get_static_doc('calendar', 'v3')
+
+        if document is None:
+            import httplib2
+
+            resp, content = httplib2.Http(timeout=CALENDAR_TIMEOUT).request(DISCOVERY_URL)
+            if resp.status >= 400:
+                raise HttpError(resp, content, uri=DISCOVERY_URL)
+            document = content.decode('utf-8')
+            try:
+                os.makedirs(os.path.dirname(CALENDAR_DISCOVERY_FILE), exist_ok=True)
+                with open(CALENDAR_DISCOVERY_FILE, 'w', encoding='utf-8') as f:
+                    f.write(document)
+            except OSError as e:
+                logging.warning(f"Failed to save discovery document cache: {e}")
+
+        _discovery_document = document
+        return _discovery_document
+
+
 def get_calendar_service() -> Resource:
-    """サービスアカウントを使用してGoogle Calendar APIサービスを返す"""
-    creds_data = _load_service_account_info()
-    creds = service_account.Credentials.from_service_account_info(creds_data, scopes=SCOPES)
-    service = build('calendar', 'v3', credentials=creds)
+    """サービスアカウントを使用してGoogle Calendar APIサービスを返す (スレッドごとに再利用)"""
+    creds = _get_credentials()
+    service = getattr(_thread_local, "service", None)
+    if service is None:
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build_from_document
+
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=CALENDAR_TIMEOUT))
+        service = build_from_document(_load_discovery_document(), http=http)
+        _thread_local.service = service
     return service
 
 
-def create_calendar_event(service: Resource, event_details: Dict[str, Any], calendar_id: str) -> tuple[Dict[str, Any] | None, str | None]:
+def warm_up():
+    """認証情報の読み込み・トークン取得・サービス生成を事前に済ませておく"""
+    get_calendar_service()
+
+
+def _build_event_body(event_details: Dict[str, Any]) -> tuple[Dict[str, Any] | None, str | None]:
+    """解析結果の辞書からCalendar APIのイベント本体を組み立てる"""
     event_body = {
         'summary': event_details.get('summary'),
         'location': event_details.get('location'),
@@ -91,9 +226,536 @@ def create_calendar_event(service: Resource, event_details: Dict[str, Any], cale
 
         event_body['end'] = {'date': end_date}
 
+    return event_body, None
+
+
+# --- 重複登録の防止 ---
+# イベントIDを予定の内容から決めることで、同じ予定の再送はAPI側でも 409 になる。
+# Botが登録した予定は台帳 (database の event_ledger) に記録し、API を呼ばずに重複を判定する。
+
+def _canonical_body(event_body: Dict[str, Any]) -> Dict[str, Any]:
+    """表記揺れを吸収したイベント本体 (空の項目は除く)"""
+    canonical = {}
+    for key, value in event_body.items():
+        if isinstance(value, dict):
+            value = _canonical_body(value)
+            # 秒を省略した時刻 (HH:MM) を HH:MM:SS にそろえる
+            if len(value.get('dateTime', '')) == 16:
+                value['dateTime'] += ':00'
+        elif isinstance(value, str):
+            value = " ".join(unicodedata.normalize("NFKC", value).split())
+        if value not in (None, "", {}):
+            canonical[key] = value
+    return canonical
+
+
+def event_id_for(event_body: Dict[str, Any], calendar_id: str) -> str:
+    """
+    予定の内容とカレンダーIDから決まるイベントIDを返す。
+    Calendar API のIDに使える文字 (base32hex: 0-9, a-v) に収まるよう16進数で表す。
+    """
+    canonical = json.dumps([calendar_id, _canonical_body(event_body)], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_bot_event_id(event_id: str) -> bool:
+    """event_id_for で決めたID (Botが登録した予定) か"""
+    return len(event_id) == 64 and all(c in "0123456789abcdef" for c in event_id)
+
+
+def event_ids_for(events: list[Dict[str, Any]], calendar_id: str) -> list[str | None]:
+    """予定ごとのイベントID (組み立てられない予定は None)"""
+    event_ids = []
+    for event_details in events:
+        event_body, _ = _build_event_body(event_details)
+        event_ids.append(event_id_for(event_body, calendar_id) if event_body is not None else None)
+    return event_ids
+
+
+def _build_event_with_id(event_details: Dict[str, Any], calendar_id: str) -> tuple[Dict[str, Any] | None, str | None]:
+    """イベント本体を組み立て、内容から決めたIDを付ける"""
+    event_body, error = _build_event_body(event_details)
+    if event_body is not None:
+        event_body['id'] = event_id_for(event_body, calendar_id)
+    return event_body, error
+
+
+def _is_conflict(error: Exception | None) -> bool:
+    return isinstance(error, HttpError) and error.resp.status == 409
+
+
+def _resolve_conflict(service: Resource, calendar_id: str, event_body: Dict[str, Any], resent: bool) -> Dict[str, Any]:
+    """
+    同じIDの予定が既にある (409) 場合に、その予定を返す。削除済みなら同じ内容で元に戻す。
+    再送して 409 になったものは最初の送信で登録できていたとみなし、重複扱いにしない。
+    """
+    events = service.events()
+    existing = events.get(calendarId=calendar_id, eventId=event_body['id']).execute()
+    if existing.get('status') == 'cancelled':
+        return events.update(calendarId=calendar_id, eventId=event_body['id'], body={**event_body, 'status': 'confirmed'}).execute()
+    if resent:
+        return existing
+    return {**existing, 'duplicate': True}
+
+
+def _format_api_error(error: Exception) -> str:
+    if isinstance(error, HttpError):
+        error_content = error.content.decode('utf-8') if error.content else str(error)
+        return f"Google API Error: {error_content}"
+    return str(error)
+
+
+@metrics.timed("calendar_insert")
+def create_calendar_event(service: Resource, event_details: Dict[str, Any], calendar_id: str) -> tuple[Dict[str, Any] | None, str | None]:
+    """イベントを1件登録する。既に登録済みの場合は duplicate=True を付けた既存のイベントを返す"""
+    event_body, error = _build_event_with_id(event_details, calendar_id)
+    if error:
+        return None, error
+
     try:
-        event = service.events().insert(calendarId=calendar_id, body=event_body).execute()
+        request = service.events().insert(calendarId=calendar_id, body=event_body)
+        event = resilience.call_sync(resilience.calendar_breaker, request.execute, CALENDAR_RETRY_DEADLINE)
         return event, None
     except HttpError as error:
-        error_content = error.content.decode('utf-8') if error.content else str(error)
-        return None, f"Google API Error: {error_content}"
+        if _is_conflict(error):
+            try:
+                return _resolve_conflict(service, calendar_id, event_body, resent=False), None
+            except HttpError as conflict_error:
+                return None, _format_api_error(conflict_error)
+        return None, _format_api_error(error)
+
+
+# Calendar API のバッチリクエスト1回あたりの上限件数
+BATCH_LIMIT = 50
+
+
+@metrics.timed("calendar_batch_insert")
+def create_calendar_events_batch(service: Resource, events: list[Dict[str, Any]], calendar_id: str) -> list[tuple[Dict[str, Any] | None, str | None]]:
+    """
+    複数のイベントをバッチリクエストでまとめて登録する。
+    一時的なエラーになったものは待ち時間を空けて再送し、ブレーカーが開いている場合は CircuitOpenError を送出する。
+    戻り値: 入力と同じ順序の (作成されたイベント, エラーメッセージ) のリスト。
+    既に登録済みだった予定は duplicate=True を付けた既存のイベントを返す。
+    """
+    results: list[tuple[Dict[str, Any] | None, str | None] | None] = [None] * len(events)
+
+    pending = []
+    for i, event_details in enumerate(events):
+        event_body, error = _build_event_with_id(event_details, calendar_id)
+        if error:
+            results[i] = (None, error)
+        else:
+            pending.append((i, event_body))
+
+    if pending:
+        # 止めている間は呼び出し側で時間を置いてやり直す
+        resilience.calendar_breaker.before_call()
+
+    attempt = 0
+    deadline = time.monotonic() + CALENDAR_RETRY_DEADLINE
+    conflicts = []
+    while pending:
+        outcomes = _execute_batches(service, pending, calendar_id)
+
+        # 一時的なエラーになったものだけを、待ち時間を空けてまとめて再送する
+        retry = []
+        for i, event_body in pending:
+            response, exception = outcomes[i]
+            if exception is None:
+                results[i] = (response, None)
+            elif _is_conflict(exception):
+                conflicts.append((i, event_body, attempt > 0))
+            elif resilience.is_transient(exception):
+                retry.append((i, event_body, exception))
+            else:
+                results[i] = (None, _format_api_error(exception))
+
+        if not retry:
+            resilience.calendar_breaker.record_success()
+            break
+        resilience.calendar_breaker.record_failure()
+
+        attempt += 1
+        delay = max(resilience.backoff_delay(attempt, exception) for _, _, exception in retry)
+        if attempt >= resilience.RETRY_MAX_ATTEMPTS or time.monotonic() + delay >= deadline:
+            for i, _, exception in retry:
+                results[i] = (None, _format_api_error(exception))
+            break
+
+        logging.warning(f"Retrying {len(retry)} calendar inserts in {delay:.1f}s ({attempt}/{resilience.RETRY_MAX_ATTEMPTS})")
+        time.sleep(delay)
+        pending = [(i, event_body) for i, event_body, _ in retry]
+        try:
+            resilience.calendar_breaker.before_call()
+        except resilience.CircuitOpenError as e:
+            for i, _ in pending:
+                results[i] = (None, str(e))
+            break
+
+    for i, event_body, resent in conflicts:
+        try:
+            results[i] = (_resolve_conflict(service, calendar_id, event_body, resent), None)
+        except Exception as error:
+            results[i] = (None, _format_api_error(error))
+
+    return results
+
+
+def _execute_batches(service: Resource, pending: list[tuple[int, Dict[str, Any]]], calendar_id: str) -> dict[int, tuple[Dict[str, Any] | None, Exception | None]]:
+    """BATCH_LIMIT 件ずつバッチリクエストを送り、番号ごとの (レスポンス, 例外) を返す"""
+    outcomes: dict[int, tuple[Dict[str, Any] | None, Exception | None]] = {}
+
+    def callback(request_id, response, exception):
+        outcomes[int(request_id)] = (response, exception)
+
+    for offset in range(0, len(pending), BATCH_LIMIT):
+        chunk = pending[offset:offset + BATCH_LIMIT]
+        batch = service.new_batch_http_request(callback=callback)
+        for i, event_body in chunk:
+            batch.add(service.events().insert(calendarId=calendar_id, body=event_body), request_id=str(i))
+        try:
+            batch.execute()
+        except Exception as error:
+            # バッチ全体が失敗した場合は、結果が返っていないものをすべてエラーにする
+            for i, _ in chunk:
+                outcomes.setdefault(i, (None, error))
+
+    return outcomes
+
+
+# --- カレンダーのローカルコピー ---
+# events().list の nextSyncToken を使って変更分だけを取得し、SQLite の calendar_mirror に反映する。
+# 期間の問い合わせはローカルで答える。
+
+# 予定の時刻の解釈に使うタイムゾーン (登録時の timeZone と同じ)
+CALENDAR_TIMEZONE = datetime.timezone(datetime.timedelta(hours=9), "Asia/Tokyo")
+# 最後の同期からこの秒数以内なら同期せずにローカルのコピーを使う
+MIRROR_MAX_AGE = float(os.getenv("MIRROR_MAX_AGE", "300"))
+# 同期1回 (全ページ) の制限時間 (秒)
+MIRROR_SYNC_TIMEOUT = float(os.getenv("MIRROR_SYNC_TIMEOUT", "120"))
+# events().list 1ページあたりの件数 (APIの上限は2500)
+MIRROR_PAGE_SIZE = 2500
+
+
+def _parse_event_time(value: Dict[str, Any] | None) -> tuple[int, bool] | None:
+    """API の start / end から (UNIX秒, 終日か) を返す"""
+    if not value:
+        return None
+    if value.get('dateTime'):
+        dt = datetime.datetime.fromisoformat(value['dateTime'])
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=CALENDAR_TIMEZONE)
+        return int(dt.timestamp()), False
+    if value.get('date'):
+        dt = datetime.datetime.strptime(value['date'], "%Y-%m-%d").replace(tzinfo=CALENDAR_TIMEZONE)
+        return int(dt.timestamp()), True
+    return None
+
+
+def _mirror_row(event: Dict[str, Any]) -> tuple | None:
+    """API のイベントを calendar_mirror の行にする。時刻がない・読めないものは None"""
+    try:
+        start = _parse_event_time(event.get('start'))
+        end = _parse_event_time(event.get('end'))
+    except (TypeError, ValueError):
+        return None
+    if start is None or end is None:
+        return None
+    return (event['id'], event.get('summary'), event.get('location'), event.get('htmlLink'), start[0], end[0], int(start[1]))
+
+
+def sync_calendar_mirror(service: Resource, calendar_id: str) -> int:
+    """
+    前回の同期からの変更を取得してローカルのコピーに反映し、反映した件数を返す。
+    同期トークンがない、または期限切れ (410) の場合は全件を取得し直す。
+    """
+    sync_token, _ = db.get_mirror_sync_state(calendar_id)
+    try:
+        return _sync_pages(service, calendar_id, sync_token)
+    except HttpError as error:
+        if sync_token is None or error.resp.status != 410:
+            raise
+        logging.info(f"Sync token expired for {calendar_id}, running a full sync")
+        db.save_mirror_sync_token(calendar_id, None)
+        return _sync_pages(service, calendar_id, None)
+
+
+def _sync_pages(service: Resource, calendar_id: str, sync_token: str | None) -> int:
+    changes = 0
+    page_token = None
+    reset = sync_token is None
+    # 全件の取得は保持期間 (MIRROR_RETENTION_DAYS) より前に終わった予定を除く。
+    # 同期トークンは最初の取得の timeMin を引き継ぐため、保持期間を変えても反映されるのは次に全件を取得し直したときになる
+    time_min = None
+    if reset:
+        since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=db.MIRROR_RETENTION_DAYS)
+        time_min = since.isoformat()
+    while True:
+        params = {'calendarId': calendar_id, 'maxResults': MIRROR_PAGE_SIZE, 'singleEvents': True}
+        if sync_token:
+            params['syncToken'] = sync_token
+        else:
+            params['timeMin'] = time_min
+        if page_token:
+            params['pageToken'] = page_token
+        request = service.events().list(**params)
+        page = resilience.call_sync(resilience.calendar_breaker, request.execute, CALENDAR_RETRY_DEADLINE)
+
+        # 1ページずつ反映して、件数が多くてもメモリに溜めない
+        rows, deleted = [], []
+        for event in page.get('items', []):
+            row = None if event.get('status') == 'cancelled' else _mirror_row(event)
+            if row is None:
+                deleted.append(event['id'])
+            else:
+                rows.append(row)
+        db.apply_mirror_changes(calendar_id, rows, deleted, reset=reset)
+        reset = False
+        changes += len(rows) + len(deleted)
+
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            db.save_mirror_sync_token(calendar_id, page.get('nextSyncToken'))
+            return changes
+
+
+# /export で events().list 1ページあたりに取得する件数
+LIST_PAGE_SIZE = 500
+
+
+def _list_events_page(calendar_id: str, time_min: str, time_max: str, page_token: str | None) -> Dict[str, Any]:
+    """[time_min, time_max) と重なる予定を開始順に1ページ分取得する"""
+    params = {
+        'calendarId': calendar_id, 'timeMin': time_min, 'timeMax': time_max,
+        'singleEvents': True, 'orderBy': 'startTime', 'maxResults': LIST_PAGE_SIZE,
+    }
+    if page_token:
+        params['pageToken'] = page_token
+    request = get_calendar_service().events().list(**params)
+    return resilience.call_sync(resilience.calendar_breaker, request.execute, CALENDAR_RETRY_DEADLINE)
+
+
+def _event_range(event_details: Dict[str, Any]) -> tuple[int, int, bool] | None:
+    """解析結果の予定の (開始UNIX秒, 終了UNIX秒, 終日か)"""
+    event_body, error = _build_event_body(event_details)
+    if error:
+        return None
+    try:
+        start = _parse_event_time(event_body.get('start'))
+        end = _parse_event_time(event_body.get('end'))
+    except (TypeError, ValueError):
+        return None
+    if start is None or end is None:
+        return None
+    return start[0], end[0], start[1]
+
+
+def _mirror_event(row: tuple) -> Dict[str, Any]:
+    event_id, summary, location, html_link, start_at, end_at, all_day = row
+    return {
+        'id': event_id, 'summary': summary, 'location': location, 'htmlLink': html_link,
+        'start': datetime.datetime.fromtimestamp(start_at, CALENDAR_TIMEZONE),
+        'end': datetime.datetime.fromtimestamp(end_at, CALENDAR_TIMEZONE),
+        'all_day': bool(all_day),
+    }
+
+
+# --- 非同期API ---
+
+async def _run_in_pool(func, *args, timeout: float | None = None):
+    """同期関数を専用スレッドプールで実行し、timeout秒 (既定は CALENDAR_CALL_TIMEOUT) で打ち切る"""
+    global _pending_calls
+    await _calendar_slots.acquire()
+    try:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(_executor, partial(func, *args))
+    except BaseException:
+        _calendar_slots.release()
+        raise
+    _pending_calls += 1
+    future.add_done_callback(_on_call_done)
+    # 打ち切ってもスレッドでの呼び出しは止まらないため、呼び出しが終わるまで枠を返さない (shield で future を残す)
+    return await asyncio.wait_for(asyncio.shield(future), timeout or CALENDAR_CALL_TIMEOUT)
+
+
+def _on_call_done(future: asyncio.Future):
+    global _pending_calls
+    _pending_calls -= 1
+    _calendar_slots.release()
+    # 打ち切った呼び出しの例外は誰も受け取らないので、ここで取り出しておく
+    if not future.cancelled() and future.exception() is not None:
+        logging.debug(f"Calendar call finished with error: {future.exception()}")
+
+
+def pending_calls() -> int:
+    """スレッドプールで実行中・実行待ちの呼び出し数"""
+    return _pending_calls
+
+
+async def awarm_up():
+    """warm_up の非同期版"""
+    await _run_in_pool(warm_up)
+
+
+def _sync_mirror_in_thread(calendar_id: str):
+    return sync_calendar_mirror(get_calendar_service(), calendar_id)
+
+
+# カレンダーID -> 実行中の同期 (同じカレンダーの同期を重ねない)
+_mirror_syncs: dict[str, asyncio.Task] = {}
+
+
+async def _sync_mirror(calendar_id: str) -> bool:
+    start = time.perf_counter()
+    try:
+        changes = await _run_in_pool(_sync_mirror_in_thread, calendar_id, timeout=MIRROR_SYNC_TIMEOUT)
+    except Exception as e:
+        logging.warning(f"Failed to sync calendar mirror for {calendar_id}: {e}")
+        return False
+    finally:
+        metrics.stage_seconds.observe(time.perf_counter() - start, stage="mirror_sync")
+    logging.debug(f"Synced {changes} change(s) for {calendar_id}")
+    return True
+
+
+async def aensure_mirror(calendar_id: str, max_age: float = MIRROR_MAX_AGE, wait: float | None = None) -> bool:
+    """
+    ローカルのコピーが max_age 秒より古ければ差分を同期する。
+    wait 秒で待つのをやめる (同期は裏で続ける)。最新の状態になっていれば True を返す。
+    """
+    _, synced_at = await db.aget_mirror_sync_state(calendar_id)
+    if synced_at is not None and time.time() - synced_at < max_age:
+        return True
+
+    task = _mirror_syncs.get(calendar_id)
+    if task is None:
+        task = _mirror_syncs[calendar_id] = asyncio.create_task(_sync_mirror(calendar_id))
+        task.add_done_callback(lambda _: _mirror_syncs.pop(calendar_id, None))
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), wait)
+    except asyncio.TimeoutError:
+        return False
+
+
+async def aget_events_between(calendar_id: str, start: datetime.datetime, end: datetime.datetime, limit: int = 100) -> list[Dict[str, Any]]:
+    """[start, end) と重なる予定をローカルのコピーから開始順に返す (start / end は datetime)"""
+    rows = await db.aget_mirror_events(calendar_id, int(start.timestamp()), int(end.timestamp()), limit)
+    return [_mirror_event(row) for row in rows]
+
+
+async def afind_overlaps(events: list[Dict[str, Any]], calendar_id: str, event_ids: list[str | None] | None = None) -> list[list[Dict[str, Any]]]:
+    """
+    登録しようとしている予定ごとに、時間が重なる既存の予定をローカルのコピーから探す。
+    終日の予定は重なりとして扱わない。同じ内容の予定 (登録済み) は除く。
+    event_ids には event_ids_for の結果を渡せる (登録時にも使うIDを作り直さないため)。
+    """
+    if event_ids is None:
+        event_ids = event_ids_for(events, calendar_id)
+    overlaps = []
+    for event_details, own_id in zip(events, event_ids):
+        span = _event_range(event_details)
+        if span is None or span[2]:
+            overlaps.append([])
+            continue
+        # 終日の予定と登録済みの同じ予定は、件数を絞る前に除く
+        rows = await db.aget_mirror_events(calendar_id, span[0], span[1], 5, True, own_id)
+        overlaps.append([_mirror_event(row) for row in rows])
+    return overlaps
+
+
+async def aiter_events(calendar_id: str, start: datetime.datetime, end: datetime.datetime, bot_only: bool = True):
+    """
+    [start, end) と重なる予定を Calendar API から開始順に1件ずつ返す。
+    1ページずつ取得するので、件数が多くても手元には1ページ分しか持たない。
+    bot_only=True なら Botが登録した予定 (内容から決めたID) だけを返す。
+    """
+    page_token = None
+    while True:
+        page = await _run_in_pool(_list_events_page, calendar_id, start.isoformat(), end.isoformat(), page_token)
+        for event in page.get('items', []):
+            if not bot_only or is_bot_event_id(event.get('id', '')):
+                yield event
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def _create_event_in_thread(event_details: Dict[str, Any], calendar_id: str):
+    return create_calendar_event(get_calendar_service(), event_details, calendar_id)
+
+
+def _create_events_batch_in_thread(events: list[Dict[str, Any]], calendar_id: str):
+    return create_calendar_events_batch(get_calendar_service(), events, calendar_id)
+
+
+async def _with_ledger(events: list[Dict[str, Any]], calendar_id: str, insert,
+                       event_ids: list[str | None] | None = None) -> list[tuple[Dict[str, Any] | None, str | None]]:
+    """
+    台帳に記録済みの予定はAPIを呼ばずに登録済み (duplicate=True) として返し、残りだけを insert(予定のリスト) で登録する。
+    同じ依頼の中で重複した予定は最初の1件だけを登録する。登録できた予定は台帳に記録する。
+    """
+    if event_ids is None:
+        event_ids = event_ids_for(events, calendar_id)
+
+    try:
+        known = await db.aget_ledger_entries(calendar_id, list({i for i in event_ids if i}))
+    except Exception as e:
+        logging.error(f"Failed to read event ledger: {e}")
+        known = {}
+
+    results: list[tuple[Dict[str, Any] | None, str | None] | None] = [None] * len(events)
+    first: dict[str, int] = {}
+    to_insert = []
+    for i, event_id in enumerate(event_ids):
+        if event_id in known:
+            results[i] = ({'id': event_id, 'htmlLink': known[event_id], 'duplicate': True}, None)
+        elif event_id is None or event_id not in first:
+            if event_id is not None:
+                first[event_id] = i
+            to_insert.append(i)
+
+    if to_insert:
+        for i, result in zip(to_insert, await insert([events[i] for i in to_insert])):
+            results[i] = result
+        created = [results[i][0] for i in to_insert if results[i][0] and results[i][0].get('id')]
+        try:
+            await db.arecord_ledger_entries(calendar_id, [(event['id'], event.get('htmlLink')) for event in created])
+            # 次の同期を待たずに、登録した予定をローカルのコピーにも反映する
+            rows = [row for row in (_mirror_row(event) for event in created) if row is not None]
+            await db.aapply_mirror_changes(calendar_id, rows, [])
+        except Exception as e:
+            logging.error(f"Failed to record created events: {e}")
+
+    # 同じ依頼の中の重複は、最初の1件の結果を登録済みとして返す
+    for i, event_id in enumerate(event_ids):
+        if results[i] is None:
+            event, error = results[first[event_id]]
+            results[i] = ({**event, 'duplicate': True}, None) if event else (None, error)
+    return results
+
+
+async def acreate_calendar_event(event_details: Dict[str, Any], calendar_id: str, timeout: float | None = None) -> tuple[Dict[str, Any] | None, str | None]:
+    """create_calendar_event の非同期版。サービスは実行スレッドのものを使い、台帳で重複を判定する"""
+    async def insert(events):
+        try:
+            return [await _run_in_pool(_create_event_in_thread, events[0], calendar_id, timeout=timeout)]
+        except asyncio.TimeoutError:
+            return [(None, f"Google API Error: タイムアウトしました ({timeout or CALENDAR_CALL_TIMEOUT:.0f}秒)")]
+
+    return (await _with_ledger([event_details], calendar_id, insert))[0]
+
+
+async def acreate_calendar_events_batch(events: list[Dict[str, Any]], calendar_id: str, timeout: float | None = None,
+                                       event_ids: list[str | None] | None = None) -> list[tuple[Dict[str, Any] | None, str | None]]:
+    """
+    create_calendar_events_batch の非同期版。サービスは実行スレッドのものを使い、台帳で重複を判定する。
+    event_ids には event_ids_for の結果を渡せる。
+    """
+    async def insert(pending):
+        try:
+            return await _run_in_pool(_create_events_batch_in_thread, pending, calendar_id, timeout=timeout)
+        except asyncio.TimeoutError:
+            error = f"Google API Error: タイムアウトしました ({timeout or CALENDAR_CALL_TIMEOUT:.0f}秒)"
+            return [(None, error)] * len(pending)
+
+    return await _with_ledger(events, calendar_id, insert, event_ids)
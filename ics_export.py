@@ -0,0 +1,125 @@
+# ics_export.py
+import datetime
+import tempfile
+from typing import IO, Any, AsyncIterator, Iterator
+
+# Calendar API のイベントを iCalendar (.ics) 形式で書き出す。
+# 予定は1件ずつ文字列にして一時ファイルへ書くので、件数が多くてもメモリの使用量は変わらない。
+# ファイルが max_bytes を超えそうになったら閉じて次のファイルに分ける (どのファイルも単独で読み込める)。
+
+PRODID = "-//discord-gemini-assist-calendar//Export//JA"
+CRLF = "\r\n"
+# RFC 5545: 1行は75オクテットまで (改行を除く)。超える分は改行 + 空白で折り返す
+LINE_LIMIT = 75
+
+
+def _escape(text: str) -> str:
+    return (
+        text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("\r\n", "\\n").replace("\n", "\\n").replace("\r", "\\n")
+    )
+
+
+def _fold(line: str) -> str:
+    """UTF-8 で75オクテットごとに折り返す (マルチバイト文字の途中では切らない)"""
+    if len(line.encode("utf-8")) <= LINE_LIMIT:
+        return line + CRLF
+    parts, current, size = [], [], 0
+    for char in line:
+        width = len(char.encode("utf-8"))
+        # 2行目以降は先頭の空白1文字の分だけ短くする
+        if size + width > (LINE_LIMIT if not parts else LINE_LIMIT - 1):
+            parts.append("".join(current))
+            current, size = [], 0
+        current.append(char)
+        size += width
+    parts.append("".join(current))
+    return (CRLF + " ").join(parts) + CRLF
+
+
+def _format_time(value: dict[str, Any]) -> str | None:
+    """API の start / end を「;VALUE=DATE:20250301」「:20250301T010000Z」の形にする"""
+    if value.get("dateTime"):
+        dt = datetime.datetime.fromisoformat(value["dateTime"])
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        return ":" + dt.astimezone(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    if value.get("date"):
+        return ";VALUE=DATE:" + value["date"].replace("-", "")
+    return None
+
+
+def calendar_header(name: str) -> str:
+    return "".join(_fold(line) for line in (
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escape(name)}",
+    ))
+
+
+CALENDAR_FOOTER = "END:VCALENDAR" + CRLF
+
+
+def iter_vevent(event: dict[str, Any], stamp: str) -> Iterator[str]:
+    """Calendar API のイベント1件を VEVENT の行 (折り返し済み) として返す。時刻のないものは何も返さない"""
+    start = _format_time(event.get("start") or {})
+    end = _format_time(event.get("end") or {})
+    if start is None:
+        return
+
+    yield _fold("BEGIN:VEVENT")
+    yield _fold(f"UID:{event.get('iCalUID') or event['id'] + '@google.com'}")
+    yield _fold(f"DTSTAMP:{stamp}")
+    yield _fold(f"DTSTART{start}")
+    if end is not None:
+        yield _fold(f"DTEND{end}")
+    for prop, key in (("SUMMARY", "summary"), ("LOCATION", "location"), ("DESCRIPTION", "description")):
+        if event.get(key):
+            yield _fold(f"{prop}:{_escape(event[key])}")
+    if event.get("htmlLink"):
+        yield _fold(f"URL:{event['htmlLink']}")
+    yield _fold("END:VEVENT")
+
+
+async def aiter_ics_files(events: AsyncIterator[dict[str, Any]], name: str, max_bytes: int) -> AsyncIterator[tuple[IO[bytes], int]]:
+    """
+    予定を .ics に書き出し、max_bytes を超えないファイルごとに (先頭に戻した一時ファイル, 予定の件数) を返す。
+    受け取ったファイルは呼び出し側で閉じること (書きかけのファイルはここで閉じる)。予定が1件もなければ何も返さない。
+    """
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    header = calendar_header(name).encode("utf-8")
+    footer = CALENDAR_FOOTER.encode("utf-8")
+    file: IO[bytes] | None = None
+    size = count = 0
+
+    try:
+        async for event in events:
+            data = "".join(iter_vevent(event, stamp)).encode("utf-8")
+            if not data:
+                continue
+            if file is not None and count and size + len(data) + len(footer) > max_bytes:
+                file.write(footer)
+                file.seek(0)
+                # 返したファイルは呼び出し側のもの
+                finished, file = file, None
+                yield finished, count
+            if file is None:
+                file = tempfile.TemporaryFile()
+                file.write(header)
+                size, count = len(header), 0
+            file.write(data)
+            size += len(data)
+            count += 1
+
+        if file is not None:
+            file.write(footer)
+            file.seek(0)
+            finished, file = file, None
+            yield finished, count
+    finally:
+        # 予定の取得に失敗した・途中でやめた場合は、書きかけのファイルを閉じる
+        if file is not None:
+            file.close()
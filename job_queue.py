@@ -0,0 +1,115 @@
+# job_queue.py
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+import database as db
+
+
+class RetryLater(Exception):
+    """
+    ジョブを delay 秒後に処理待ちへ戻す (ハンドラーから送出する)。
+    count=False なら jobs.defers に数えない (障害ではなく回数制限の空きを待つ場合など)。
+    """
+
+    def __init__(self, delay: float, count: bool = True):
+        super().__init__(f"retry in {delay:.1f}s")
+        self.delay = delay
+        self.count = count
+
+
+class JobWorkerPool:
+    """
+    SQLite の jobs テーブルからリース付きでジョブを取り出し、決まった数のワーカーで処理する。
+    ハンドラーが正常に戻ればジョブを削除し、RetryLater なら後で再開、その他の例外なら失敗として残す。
+    処理中はリースを延長し続けるため、プロセスが停止したジョブだけが期限切れ後に再開される。
+    """
+
+    def __init__(self, handler: Callable[[dict], Awaitable[None]], workers: int, lease_seconds: float, max_idle: float = 30.0):
+        self.handler = handler
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_idle = max_idle
+        # 最後に確認した処理待ちのジョブ数 (メトリクス用の目安)
+        self.pending = 0
+        self._active = 0
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """ワーカーを起動する (2回目以降は何もしない)"""
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    def notify(self):
+        """ジョブを追加したことを待機中のワーカーに知らせる"""
+        self.pending += 1
+        self._wakeup.set()
+
+    def active_count(self) -> int:
+        """処理中のジョブ数"""
+        return self._active
+
+    def idle_count(self) -> int:
+        """すぐにジョブを取り出せるワーカー数"""
+        return max(0, self.workers - self._active) if self._tasks else 0
+
+    async def _worker(self, number: int):
+        while True:
+            # 取り出しの前に消しておけば、その後に追加されたジョブの通知は取りこぼさない
+            self._wakeup.clear()
+            try:
+                job, self.pending, next_at = await db.aclaim_job(self.lease_seconds)
+            except Exception as e:
+                logging.error(f"Job worker {number} failed to claim a job: {e}")
+                job, next_at = None, None
+
+            if job is None:
+                timeout = self.max_idle
+                if next_at is not None:
+                    timeout = min(timeout, max(0.0, next_at - time.time()) + 0.05)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._active += 1
+            try:
+                await self._run(job)
+            finally:
+                self._active -= 1
+
+    async def _run(self, job: dict):
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+        try:
+            await self.handler(job)
+        except RetryLater as e:
+            await self._finish(db.adefer_job, job["id"], e.delay, e.count)
+        except Exception as e:
+            logging.error(f"Job {job['id']} failed: {e}")
+            await self._finish(db.afail_job, job["id"], str(e))
+        else:
+            await self._finish(db.afinish_job, job["id"])
+        finally:
+            heartbeat.cancel()
+
+    async def _finish(self, func, *args):
+        try:
+            await func(*args)
+        except Exception as e:
+            # 記録できなかったジョブはリースが切れた後にもう一度処理される
+            logging.error(f"Failed to record job result ({func.__name__}{args[:1]}): {e}")
+
+    async def _heartbeat(self, job_id: int):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await db.aextend_job_lease(job_id, self.lease_seconds)
+            except Exception as e:
+                logging.error(f"Failed to extend lease of job {job_id}: {e}")
@@ -0,0 +1,81 @@
+# json_stream.py
+import json
+
+
+class JsonArrayStream:
+    """
+    ストリーミングで届くJSONを少しずつ受け取り、配列の要素が閉じた時点で取り出す。
+    先頭の ```json や説明文は読み飛ばす。最上位がオブジェクトの場合はそれを1件として扱う。
+    """
+
+    def __init__(self):
+        self.done = False
+        self._chunks: list[str] = []
+        # 最上位の深さ (配列なら1、オブジェクトなら0)。開始前は None
+        self._base: int | None = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element: list[str] = []
+
+    @property
+    def text(self) -> str:
+        """これまでに受け取ったテキスト全体"""
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> list:
+        """
+        テキストの断片を追加し、この断片で完成した要素のリストを返す。
+        要素が不正なJSONの場合は json.JSONDecodeError を送出する。
+        """
+        self._chunks.append(chunk)
+        completed = []
+        for ch in chunk:
+            if self.done:
+                break
+
+            if self._base is None:
+                if ch == "[":
+                    self._base = self._depth = 1
+                    continue
+                if ch != "{":
+                    continue
+                self._base = 0
+
+            capturing = self._depth > self._base
+
+            if self._in_string:
+                if capturing:
+                    self._element.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if capturing:
+                    self._element.append(ch)
+            elif ch in "{[":
+                if not capturing:
+                    self._element = []
+                self._depth += 1
+                self._element.append(ch)
+            elif ch in "}]":
+                self._depth -= 1
+                if not capturing:
+                    # 最上位の配列が閉じた
+                    self.done = True
+                    continue
+                self._element.append(ch)
+                if self._depth == self._base:
+                    completed.append(json.loads("".join(self._element)))
+                    self._element = []
+                    if self._base == 0:
+                        self.done = True
+            elif capturing:
+                self._element.append(ch)
+        return completed
@@ -0,0 +1,219 @@
+# local_parser.py
+import os
+import re
+import unicodedata
+from datetime import date, datetime, timedelta
+
+# Gemini を呼ばずにローカルで解析する簡易パーサー。
+# 「明日14時から会議」「3/1 終日 出張」「来週月曜 10:00-11:00 定例」のような
+# 単純な入力だけを対象にし、少しでも曖昧なら信頼度を下げて Gemini に任せる。
+
+LOCAL_PARSER_ENABLED = os.getenv("LOCAL_PARSER_ENABLED", "1") == "1"
+LOCAL_PARSER_MIN_CONFIDENCE = float(os.getenv("LOCAL_PARSER_MIN_CONFIDENCE", "0.9"))
+
+_WEEKDAYS = "月火水木金土日"
+
+_RELATIVE_DAYS = {
+    "今日": 0, "本日": 0, "きょう": 0,
+    "明日": 1, "あした": 1, "あす": 1,
+    "明後日": 2, "あさって": 2,
+}
+
+_DATE_PATTERNS = [
+    # 2025/3/1, 2025-03-01, 2025年3月1日
+    ("ymd", re.compile(r"(?P<y>\d{4})\s*[/\-年]\s*(?P<m>\d{1,2})\s*[/\-月]\s*(?P<d>\d{1,2})日?")),
+    # 3/1, 3月1日
+    ("md", re.compile(r"(?<![\d/])(?P<m>\d{1,2})\s*(?:/|月)\s*(?P<d>\d{1,2})日?(?![\d/])(?:\s*\([月火水木金土日]\))?")),
+    # 来週月曜, 今週金曜日, 再来週の水曜
+    ("week", re.compile(r"(?P<w>再来週|来週|今週)の?(?P<wd>[月火水木金土日])曜(?:日)?")),
+    # 月曜, 金曜日 (どの週か曖昧)
+    ("weekday", re.compile(r"(?P<wd>[月火水木金土日])曜(?:日)?")),
+    # 今日, 明日, 明後日
+    ("relative", re.compile("|".join(sorted(_RELATIVE_DAYS, key=len, reverse=True)))),
+]
+
+_TIME = r"(?:(?P<{p}ampm>午前|午後|朝|夕方|夜|AM|PM|am|pm)\s*)?(?P<{p}h>\d{{1,2}})(?::(?P<{p}m>\d{{2}})|時(?!間)(?:(?P<{p}mm>\d{{1,2}})分|(?P<{p}half>半))?)"
+
+_TIME_RANGE = re.compile(
+    _TIME.format(p="s") + r"\s*(?:-|~|〜|から)\s*" + _TIME.format(p="e") + r"(?:\s*まで)?"
+)
+_TIME_SINGLE = re.compile(_TIME.format(p="s") + r"(?:\s*(?:から|~|〜|-))?")
+_DURATION = re.compile(r"(?P<h>\d{1,2})時間(?P<half>半)?|(?P<min>\d{1,3})分間?")
+_ALL_DAY = re.compile(r"終日|一日中|1日中")
+
+# 日時表現を取り除いた跡に残る助詞・記号
+_LEADING_PARTICLES = re.compile(r"^(?:[のにはでをと、,。・!！\s]|から|まで)+")
+_TRAILING_PARTICLES = re.compile(r"(?:[のにはでをと、,。・\s]|から|まで)+$")
+_PUNCTUATION = re.compile(r"^[、,。・!！\s]+|[、,。・!！\s]+$")
+# 場所・詳細が含まれていそうな表現 (Gemini なら summary と location に分けるもの)
+_LOCATION_HINTS = re.compile(r"[@＠]|場所|にて|会場")
+# 繰り返し予定や「午後に」のような数字を伴わない時間帯など、このパーサーでは扱わない表現
+_UNSUPPORTED = re.compile(
+    r"毎週|毎日|毎月|隔週|以降|ごろ|頃|くらい|ぐらい|未定|"
+    r"(?:午前|午後|朝|昼|夕方|夜|晩)(?!\s*\d)"
+)
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text)
+    return text.replace("～", "〜").strip()
+
+
+def _to_24h(ampm: str | None, hour: int) -> int:
+    if ampm in ("午後", "夕方", "夜", "PM", "pm") and hour < 12:
+        return hour + 12
+    if ampm in ("午前", "朝", "AM", "am") and hour == 12:
+        return 0
+    return hour
+
+
+def _match_time(match: re.Match, prefix: str) -> tuple[int, int] | None:
+    hour = int(match.group(f"{prefix}h"))
+    minute = match.group(f"{prefix}m") or match.group(f"{prefix}mm")
+    minute = int(minute) if minute else (30 if match.group(f"{prefix}half") else 0)
+    hour = _to_24h(match.group(f"{prefix}ampm"), hour)
+    if not (0 <= hour <= 24 and 0 <= minute < 60):
+        return None
+    return hour, minute
+
+
+def _resolve_date(kind: str, match: re.Match, today: date) -> tuple[date | None, float]:
+    """日付表現を具体的な日付に変換する。戻り値: (日付, 信頼度)"""
+    try:
+        if kind == "ymd":
+            return date(int(match["y"]), int(match["m"]), int(match["d"])), 1.0
+        if kind == "md":
+            resolved = date(today.year, int(match["m"]), int(match["d"]))
+            # 過ぎた日付は来年とみなすが、過去の予定の可能性もあるので信頼度を下げる
+            if resolved < today:
+                return date(today.year + 1, resolved.month, resolved.day), 0.8
+            return resolved, 1.0
+    except ValueError:
+        return None, 0.0
+
+    if kind == "week":
+        monday = today - timedelta(days=today.weekday())
+        offset = {"今週": 0, "来週": 1, "再来週": 2}[match["w"]]
+        return monday + timedelta(weeks=offset, days=_WEEKDAYS.index(match["wd"])), 1.0
+    if kind == "weekday":
+        # 当日を含むか・今週か来週かが曖昧なので Gemini に任せる
+        days_ahead = (_WEEKDAYS.index(match["wd"]) - today.weekday()) % 7 or 7
+        return today + timedelta(days=days_ahead), 0.5
+    return today + timedelta(days=_RELATIVE_DAYS[match.group(0)]), 1.0
+
+
+def _find_date(text: str, today: date) -> tuple[date | None, tuple[int, int] | None, float]:
+    """テキスト中の日付表現を1つだけ探す。複数ある・見つからない場合は信頼度0"""
+    found = []
+    taken: list[tuple[int, int]] = []
+    for kind, pattern in _DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            span = match.span()
+            if any(span[0] < end and start < span[1] for start, end in taken):
+                continue
+            taken.append(span)
+            found.append((kind, match))
+
+    if len(found) != 1:
+        return None, None, 0.0
+    kind, match = found[0]
+    resolved, confidence = _resolve_date(kind, match, today)
+    return resolved, match.span(), confidence
+
+
+def parse(text: str, today: date | None = None) -> tuple[list[dict] | None, float]:
+    """
+    単純な予定テキストをローカルで解析する。
+    戻り値: (create_calendar_event が受け取る形式の辞書のリスト, 信頼度 0.0〜1.0)
+    """
+    today = today or datetime.now().date()
+    text = _normalize(text)
+
+    # 複数行・複数予定・長文は対象外
+    if not text or "\n" in text or len(text) > 60 or _UNSUPPORTED.search(text):
+        return None, 0.0
+
+    event_date, date_span, confidence = _find_date(text, today)
+    if event_date is None:
+        return None, 0.0
+
+    spans = [date_span]
+    start = end = None
+    all_day = False
+
+    range_match = _TIME_RANGE.search(text)
+    if range_match:
+        start, end = _match_time(range_match, "s"), _match_time(range_match, "e")
+        if start is None or end is None:
+            return None, 0.0
+        # 「午後3時〜5時」のように終了側の午前/午後が省略された場合は開始側に合わせる
+        if not range_match["eampm"] and end < start and end[0] < 12 and (end[0] + 12, end[1]) > start:
+            end = (end[0] + 12, end[1])
+        spans.append(range_match.span())
+    else:
+        single_match = _TIME_SINGLE.search(text)
+        if single_match:
+            start = _match_time(single_match, "s")
+            if start is None:
+                return None, 0.0
+            spans.append(single_match.span())
+
+            duration_match = _DURATION.search(text, single_match.end())
+            if duration_match:
+                minutes = int(duration_match["h"] or 0) * 60 + int(duration_match["min"] or 0)
+                minutes += 30 if duration_match["half"] else 0
+                end_total = start[0] * 60 + start[1] + minutes
+                end = (end_total // 60, end_total % 60)
+                spans.append(duration_match.span())
+
+    all_day_match = _ALL_DAY.search(text)
+    if all_day_match:
+        if start is not None:
+            return None, 0.0
+        all_day = True
+        spans.append(all_day_match.span())
+
+    # 日時表現を取り除いた残りを予定名とする
+    remainder = []
+    position = 0
+    for span_start, span_end in sorted(spans):
+        if span_start < position:
+            return None, 0.0  # 表現が重なっている
+        remainder.append(text[position:span_start])
+        position = span_end
+    remainder.append(text[position:])
+    parts = []
+    for i, part in enumerate(remainder):
+        if i > 0:
+            part = _LEADING_PARTICLES.sub("", part)
+        if i < len(remainder) - 1:
+            part = _TRAILING_PARTICLES.sub("", part)
+        parts.append(_PUNCTUATION.sub("", part))
+    summary = " ".join(part for part in parts if part)
+
+    if not summary:
+        return None, 0.0
+    # 解釈できなかった数字 (時刻・日付の取りこぼし) が残っている
+    if re.search(r"\d", summary):
+        confidence = min(confidence, 0.5)
+    if _LOCATION_HINTS.search(summary):
+        confidence = min(confidence, 0.6)
+    if len(summary) > 30:
+        confidence = min(confidence, 0.7)
+
+    event = {"summary": summary, "start_date": event_date.isoformat()}
+    if start is not None and not all_day:
+        start_dt = datetime.combine(event_date, datetime.min.time()) + timedelta(hours=start[0], minutes=start[1])
+        event["start_date"] = start_dt.date().isoformat()
+        event["start_time"] = start_dt.strftime("%H:%M:%S")
+        if end is not None:
+            end_dt = datetime.combine(event_date, datetime.min.time()) + timedelta(hours=end[0], minutes=end[1])
+            # 23:00-01:00 のような日跨ぎ
+            if end_dt <= start_dt:
+                end_dt += timedelta(days=1)
+            event["end_date"] = end_dt.date().isoformat()
+            event["end_time"] = end_dt.strftime("%H:%M:%S")
+    else:
+        event["end_date"] = event_date.isoformat()
+
+    return [event], confidence
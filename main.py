@@ -1,17 +1,41 @@
 # main.py
+import time
+
+# 起動時間の計測の起点 (重いライブラリの読み込みより前)
+_process_started = time.perf_counter()
+
 import os
+import asyncio
+import hashlib
+import random
 import discord
 from discord import app_commands
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
 import logging
 import json
-import aiohttp
+from contextlib import aclosing
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import islice
 
 # ローカルモジュールのインポート
 import database as db
+import event_import
 import google_calendar as gcal
 import gemini_handler
+import ics_export
+import rate_limiter
+import metrics
+import resilience
+from cache import LRUCache, MISSING
+from job_queue import JobWorkerPool, RetryLater
+from progress import ImportProgress, RegistrationProgress, pack_lines
+from timeout_scheduler import TimeoutScheduler
+from webhook_dispatcher import WebhookDispatcher
+
+# モジュールの読み込みにかかった時間
+IMPORT_SECONDS = time.perf_counter() - _process_started
 
 # ロギング設定
 logging.basicConfig(level=logging.INFO)
@@ -30,7 +54,15 @@ intents.messages = True
 intents.message_content = True
 intents.guilds = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+
+
+class CalendarBot(commands.Bot):
+    async def setup_hook(self):
+        # ゲートウェイへの接続前に1回だけ呼ばれる (再接続のたびに呼ばれる on_ready とは異なる)
+        await _initialize()
+
+
+bot = CalendarBot(command_prefix="!", intents=intents)
 
 
 def _is_dm(interaction: discord.Interaction) -> bool:
@@ -54,51 +86,156 @@ def _is_admin(interaction: discord.Interaction) -> bool:
     return BOT_ADMIN_ID and str(interaction.user.id) == BOT_ADMIN_ID
 
 
-async def _send_error_webhook(error_type: str):
-    """エラー発生時にWebhookで通知を送信する（詳細は非表示）"""
-    webhook_url = db.get_setting("error_webhook_url")
-    if not webhook_url:
+async def _get_webhook_url() -> str | None:
+    return await db.aget_setting("error_webhook_url")
+
+
+# エラー通知は共有セッションを持つバックグラウンドの送信役に任せる
+webhook_dispatcher = WebhookDispatcher(
+    _get_webhook_url,
+    window=float(os.getenv("WEBHOOK_COALESCE_SECONDS", "60")),
+)
+
+
+def _send_error_webhook(error_type: str):
+    """エラー発生時にWebhookで通知を送信する（詳細は非表示、待たずに戻る）"""
+    metrics.errors_total.inc(error_type=error_type)
+    webhook_dispatcher.notify(error_type)
+
+
+@metrics.timed("discord_send")
+async def _reply(message: discord.Message, *args, **kwargs):
+    """返信する (送信時間を計測)"""
+    return await message.reply(*args, **kwargs)
+
+
+# -------------------------------------
+# 2. タイムアウト管理
+# -------------------------------------
+TIMEOUT_MINUTES = 5
+TIMEOUT_NOTIFY_CONCURRENCY = int(os.getenv("TIMEOUT_NOTIFY_CONCURRENCY", "10"))
+
+# discord_id -> DMチャンネル (タイムアウト通知のたびに fetch_user / create_dm しないため)
+_dm_channels = LRUCache(maxsize=10000)
+
+
+async def _get_dm_channel(user_id: str) -> discord.DMChannel:
+    channel = _dm_channels.get(user_id)
+    if channel is MISSING:
+        user = bot.get_user(int(user_id)) or await bot.fetch_user(int(user_id))
+        channel = user.dm_channel or await user.create_dm()
+        _dm_channels.set(user_id, channel)
+    return channel
+
+
+async def _notify_timeout(user_id: str):
+    """期限切れのユーザーの状態を消して通知する"""
+    # 期限が来る前に /calendar で新しく設定された状態は消さず、通知もしない
+    if not await db.aclear_expired_user_state(user_id, time.time() - TIMEOUT_MINUTES * 60):
         return
+    try:
+        dm_channel = await _get_dm_channel(user_id)
+        await dm_channel.send("⏰ 時間切れのため、カレンダー登録を中断しました。もう一度 `/calendar` からやり直してください。")
+    except Exception as e:
+        logging.error(f"Failed to send timeout message to {user_id}: {e}")
 
-    payload = {
-        "content": f"⚠️ カレンダーBotでエラーが発生しました: **{error_type}**"
-    }
 
+@tasks.loop(seconds=int(os.getenv("RATE_LIMIT_SNAPSHOT_SECONDS", "60")))
+async def snapshot_rate_limits():
+    """レート制限の状態を定期的にSQLiteへ保存する"""
+    for limiter in rate_limiter.LIMITERS:
+        try:
+            await db.asave_rate_limit_snapshot(limiter.name, limiter.snapshot())
+        except Exception as e:
+            logging.error(f"Failed to snapshot rate limiter {limiter.name}: {e}")
+
+
+DB_MAINTENANCE_HOURS = float(os.getenv("DB_MAINTENANCE_HOURS", "6"))
+# 保持期間を過ぎた行を1回に削除する件数 (DBスレッドを長く占有しないように分ける)
+DB_PRUNE_BATCH = 500
+
+
+@tasks.loop(hours=DB_MAINTENANCE_HOURS)
+async def maintain_database():
+    """保持期間を過ぎた行を削除し、統計の更新と空き領域の回収を行う"""
+    started = time.perf_counter()
+    deleted = {}
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(webhook_url, json=payload) as resp:
-                if resp.status >= 400:
-                    logging.error(f"Webhook送信失敗: HTTP {resp.status}")
+        for table, cutoff in db.retention_cutoffs().items():
+            deleted[table] = 0
+            while True:
+                count = await db.aprune_rows(table, cutoff, DB_PRUNE_BATCH)
+                deleted[table] += count
+                if count < DB_PRUNE_BATCH:
+                    break
+        deleted["parse_cache"] = await db.aprune_parse_cache(gemini_handler.PARSE_CACHE_TTL, gemini_handler.PARSE_CACHE_MAX_ROWS)
+        size = await db.aoptimize_db()
     except Exception as e:
-        logging.error(f"Webhook送信エラー: {e}")
+        logging.error(f"Database maintenance failed: {e}")
+        return
+
+    elapsed = time.perf_counter() - started
+    metrics.stage_seconds.observe(elapsed, stage="db_maintenance")
+    logging.info(
+        f"Database maintenance done in {elapsed:.2f}s: deleted {deleted}, "
+        f"{size['page_count'] * size['page_size'] // 1024} KiB ({size['freelist_count']} free pages)"
+    )
+
+
+@maintain_database.before_loop
+async def _delay_maintenance():
+    # 起動直後の処理と重ならないように少し待ってから始める
+    await asyncio.sleep(60)
+
+
+timeout_scheduler = TimeoutScheduler(TIMEOUT_MINUTES * 60, _notify_timeout, max_concurrency=TIMEOUT_NOTIFY_CONCURRENCY)
+db.add_state_listener(timeout_scheduler.on_state_change)
 
 
 # -------------------------------------
-# 2. 定期実行タスク
+# 3. メトリクス
 # -------------------------------------
-@tasks.loop(seconds=60)
-async def check_timeouts():
-    timeout_minutes = 5
-    stale_user_ids = db.get_stale_users(timeout_minutes)
+def _cache_stats() -> dict[str, dict]:
+    return {**db.cache_stats(), "parse": gemini_handler.parse_cache_stats()}
+
+
+def _queue_depths() -> dict[str, int]:
+    return {
+        "webhook": webhook_dispatcher.queue_depth(),
+        "timeouts": timeout_scheduler.pending_count(),
+        "calendar_pool": gcal.pending_calls(),
+        "jobs": job_pool.pending,
+    }
+
+
+metrics.register_gauge(
+    "calendar_bot_cache_hits", "Cache hits by cache",
+    lambda: {(("cache", name),): s["hits"] for name, s in _cache_stats().items()},
+)
+metrics.register_gauge(
+    "calendar_bot_cache_misses", "Cache misses by cache",
+    lambda: {(("cache", name),): s["misses"] for name, s in _cache_stats().items()},
+)
+metrics.register_gauge(
+    "calendar_bot_queue_depth", "Items waiting in internal queues",
+    lambda: {(("queue", name),): depth for name, depth in _queue_depths().items()},
+)
+metrics.register_gauge(
+    "calendar_bot_circuit_open", "1 while a circuit breaker is rejecting calls",
+    lambda: {(("breaker", b.name),): int(b.snapshot()["state"] != "closed") for b in resilience.BREAKERS},
+)
 
-    for user_id in stale_user_ids:
-        db.clear_user_state(user_id)
-        try:
-            user = await bot.fetch_user(int(user_id))
-            dm_channel = await user.create_dm()
-            await dm_channel.send("⏰ 時間切れのため、カレンダー登録を中断しました。もう一度 `/calendar` からやり直してください。")
-        except Exception as e:
-            logging.error(f"Failed to send timeout message to {user_id}: {e}")
 
 # -------------------------------------
-# 3. Botイベントハンドラ
+# 4. Botイベントハンドラ
 # -------------------------------------
-@bot.event
-async def on_ready():
-    logging.info(f'Logged in as {bot.user.name}')
+async def _initialize():
+    """起動時に1回だけ行う初期化"""
+    started = time.perf_counter()
 
     try:
-        db.init_db()
+        await db.ainit_db()
+        await db.awarm_cache()
     except Exception as e:
         logging.error(f"Database initialization failed: {e}")
 
@@ -109,18 +246,107 @@ async def on_ready():
     else:
         logging.warning("GOOGLE_CREDENTIALS_JSON is not set or invalid.")
 
-    # コマンドの同期
+    # 最初のユーザーが認証・サービス生成やSDKの読み込みのコストを払わないように、
+    # 接続と並行してバックグラウンドで準備する
+    for name, warm_up in (("calendar service", gcal.awarm_up), ("Gemini model", _warm_up_gemini)):
+        task = asyncio.create_task(_run_warm_up(name, warm_up))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    await _sync_commands()
+
+    webhook_dispatcher.start()
+
+    try:
+        await metrics.start_server()
+    except Exception as e:
+        logging.error(f"Failed to start metrics endpoint: {e}")
+
+    # レート制限の状態を前回のスナップショットから復元
+    for limiter in rate_limiter.LIMITERS:
+        try:
+            limiter.restore(await db.aload_rate_limit_snapshot(limiter.name))
+        except Exception as e:
+            logging.error(f"Failed to restore rate limiter {limiter.name}: {e}")
+    snapshot_rate_limits.start()
+
+    # SQLite上の状態から期限を再構築してタイムアウト監視を開始
+    try:
+        timeout_scheduler.start(await db.aget_state_timestamps())
+    except Exception as e:
+        logging.error(f"Failed to start timeout scheduler: {e}")
+
+    # 前回停止したときに処理中だったジョブを再開してワーカーを起動する
+    try:
+        resumed = await db.areset_job_leases()
+        if resumed:
+            logging.info(f"Resuming {resumed} unfinished job(s)")
+    except Exception as e:
+        logging.error(f"Failed to reset job leases: {e}")
+    job_pool.start()
+
+    # 古い行の削除と空き領域の回収を定期的に行う
+    maintain_database.start()
+
+    elapsed = time.perf_counter() - started
+    metrics.stage_seconds.observe(elapsed, stage="startup_init")
+    logging.info(f"Initialized in {elapsed:.2f}s (imports took {IMPORT_SECONDS:.2f}s)")
+
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def _run_warm_up(name: str, warm_up):
+    try:
+        await warm_up()
+    except Exception as e:
+        logging.error(f"Failed to warm up {name}: {e}")
+
+
+async def _warm_up_gemini():
+    await asyncio.to_thread(gemini_handler.warm_up)
+
+
+def _command_tree_hash() -> str:
+    """登録するコマンド定義のハッシュ (変わっていなければ同期を省く)"""
+    commands_json = json.dumps(
+        [bot.application_id, [command.to_dict(bot.tree) for command in bot.tree.get_commands()]],
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha256(commands_json.encode("utf-8")).hexdigest()
+
+
+async def _sync_commands():
+    """前回同期したときからコマンド定義が変わった場合だけ同期する (同期はDiscord側の回数制限が厳しい)"""
     try:
+        tree_hash = _command_tree_hash()
+        if tree_hash == await db.aget_setting("command_tree_hash"):
+            logging.info("Command tree unchanged, skipping sync")
+            return
         synced = await bot.tree.sync()
+        await db.asave_setting("command_tree_hash", tree_hash)
         logging.info(f"Synced {len(synced)} command(s)")
     except Exception as e:
         logging.error(f"Failed to sync commands: {e}")
 
-    if not check_timeouts.is_running():
-        check_timeouts.start()
+
+_ready_seconds: float | None = None
+
+
+@bot.event
+async def on_ready():
+    global _ready_seconds
+    logging.info(f'Logged in as {bot.user.name}')
+
+    # 初回だけ起動にかかった時間を記録する (再接続時にも呼ばれるため)
+    if _ready_seconds is None:
+        _ready_seconds = time.perf_counter() - _process_started
+        metrics.stage_seconds.observe(IMPORT_SECONDS, stage="startup_import")
+        metrics.stage_seconds.observe(_ready_seconds, stage="startup_ready")
+        logging.info(f"Ready in {_ready_seconds:.2f}s after process start (imports {IMPORT_SECONDS:.2f}s)")
 
 # -------------------------------------
-# 4. スラッシュコマンド
+# 5. スラッシュコマンド
 # -------------------------------------
 @bot.tree.command(name="help", description="Botの使い方を表示します。")
 async def help_command(interaction: discord.Interaction):
@@ -154,7 +380,8 @@ async def help_command(interaction: discord.Interaction):
         value=(
             "**1.** `/calendar` と送信\n"
             "**2.** 予定の内容を自然文で送信\n"
-            "（例: 「明日14時から会議」「3/1 終日 出張」）"
+            "（例: 「明日14時から会議」「3/1 終日 出張」）\n"
+            "`.ics` / CSV ファイルを添付して送信すると、ファイル内の予定をまとめて登録します"
         ),
         inline=False
     )
@@ -165,7 +392,10 @@ async def help_command(interaction: discord.Interaction):
             "`/register <カレンダーID>` — カレンダーを登録\n"
             "`/unregister` — カレンダー登録を解除\n"
             "`/calendar` — 予定の登録を開始\n"
-            "`/cancel` — 進行中の登録作業を中断"
+            "`/upcoming [日数]` — これからの予定を表示\n"
+            "`/export [開始日] [終了日]` — Botが登録した予定を .ics ファイルに書き出し\n"
+            "`/cancel` — 進行中の登録作業を中断\n"
+            "`/debug <True/False>` — 解析結果のJSONを表示するか切り替え"
         ),
         inline=False
     )
@@ -180,7 +410,7 @@ async def register_command(interaction: discord.Interaction, calendar_id: str):
         return
 
     discord_id = str(interaction.user.id)
-    db.save_calendar_id(discord_id, calendar_id.strip())
+    await db.asave_calendar_id(discord_id, calendar_id.strip())
     await interaction.response.send_message(
         f"✅ カレンダーIDを登録しました:\n`{calendar_id.strip()}`\n\n"
         "`/calendar` で予定の登録を開始できます。"
@@ -193,7 +423,7 @@ async def unregister_command(interaction: discord.Interaction):
         return
 
     discord_id = str(interaction.user.id)
-    deleted = db.delete_calendar_id(discord_id)
+    deleted = await db.adelete_calendar_id(discord_id)
 
     if deleted:
         await interaction.response.send_message("✅ カレンダー登録を解除しました。")
@@ -209,7 +439,7 @@ async def calendar_command(interaction: discord.Interaction):
     discord_id = str(interaction.user.id)
 
     # カレンダーID未登録チェック
-    calendar_id = db.get_calendar_id(discord_id)
+    calendar_id = await db.aget_calendar_id(discord_id)
     if not calendar_id:
         await interaction.response.send_message(
             "⚠️ カレンダーIDが登録されていません。\n"
@@ -218,8 +448,146 @@ async def calendar_command(interaction: discord.Interaction):
         )
         return
 
-    db.set_user_state(discord_id, "waiting_for_details")
-    await interaction.response.send_message("カレンダーに登録したい予定の内容を送信してください。")
+    await db.aset_user_state(discord_id, "waiting_for_details")
+    await interaction.response.send_message(
+        "カレンダーに登録したい予定の内容を送信してください。\n"
+        "（`.ics` / CSV ファイルを添付すると、ファイル内の予定をまとめて登録します）"
+    )
+
+
+# /upcoming で表示する最大件数と、同期を待つ最長時間 (秒)
+UPCOMING_LIMIT = 50
+UPCOMING_SYNC_WAIT = float(os.getenv("UPCOMING_SYNC_WAIT", "10"))
+WEEKDAYS = "月火水木金土日"
+
+
+@bot.tree.command(name="upcoming", description="これからの予定を表示します。")
+@app_commands.describe(days="何日先まで表示するか（既定は7日）")
+async def upcoming_command(interaction: discord.Interaction, days: app_commands.Range[int, 1, 31] = 7):
+    if not await _require_dm(interaction):
+        return
+
+    discord_id = str(interaction.user.id)
+    calendar_id = await db.aget_calendar_id(discord_id)
+    if not calendar_id:
+        await interaction.response.send_message("⚠️ カレンダーIDが登録されていません。先に `/register <カレンダーID>` で登録してください。")
+        return
+
+    # 初回は全件の同期に時間がかかるため、先に応答を保留する
+    await interaction.response.defer()
+    synced = await gcal.aensure_mirror(calendar_id, wait=UPCOMING_SYNC_WAIT)
+
+    now = datetime.now(gcal.CALENDAR_TIMEZONE)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    events = await gcal.aget_events_between(calendar_id, now, today + timedelta(days=days + 1), UPCOMING_LIMIT)
+
+    lines = []
+    current_day = None
+    for event in events:
+        # 進行中の予定は今日の欄に表示する
+        day = max(event["start"], today).date()
+        if day != current_day:
+            current_day = day
+            lines.append(f"**{day.month}/{day.day}（{WEEKDAYS[day.weekday()]}）**")
+        when = "終日" if event["all_day"] else f"{event['start']:%H:%M}-{event['end']:%H:%M}"
+        summary = event["summary"] or "(タイトルなし)"
+        title = f"[{summary}]({event['htmlLink']})" if event["htmlLink"] else summary
+        location = f" 📍{event['location']}" if event["location"] else ""
+        lines.append(f"`{when}` {title}{location}")
+    if not lines:
+        lines.append("予定はありません。")
+    if len(events) >= UPCOMING_LIMIT:
+        lines.append(f"…ほか（最初の{UPCOMING_LIMIT}件を表示しています）")
+    if not synced:
+        lines.append("⚠️ 最新の予定を取得できなかったため、前回取得した時点の内容を表示しています。")
+
+    embeds = pack_lines(f"📅 これからの予定（{days}日先まで）", lines, discord.Color.blue())[0]
+    await interaction.followup.send(embeds=embeds)
+
+
+# /export で1ファイルに収める最大サイズ (MB)。Discordの添付ファイルの上限 (無料は10MB) より小さくする
+EXPORT_FILE_MAX_BYTES = int(float(os.getenv("EXPORT_FILE_MAX_MB", "8")) * 1024 * 1024)
+# 開始日・終了日を省略したときの範囲 (今日から前後の日数)
+EXPORT_DEFAULT_DAYS = 365
+# 応答を保留したインタラクションに追加で返信できる時間 (Discordの上限は15分)
+INTERACTION_FOLLOWUP_SECONDS = 14 * 60
+
+# 書き出し中のユーザー (同じユーザーが重ねて実行しないため)
+_exporting: set[str] = set()
+
+
+def _parse_export_date(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=gcal.CALENDAR_TIMEZONE)
+
+
+@bot.tree.command(name="export", description="Botが登録した予定を .ics ファイルに書き出します。")
+@app_commands.describe(
+    start="開始日 (YYYY-MM-DD、省略時は1年前)",
+    end="終了日 (YYYY-MM-DD、この日を含む。省略時は1年後)",
+    include_all="Bot以外で登録した予定も含める",
+)
+async def export_command(interaction: discord.Interaction, start: str | None = None, end: str | None = None, include_all: bool = False):
+    if not await _require_dm(interaction):
+        return
+
+    discord_id = str(interaction.user.id)
+    calendar_id = await db.aget_calendar_id(discord_id)
+    if not calendar_id:
+        await interaction.response.send_message("⚠️ カレンダーIDが登録されていません。先に `/register <カレンダーID>` で登録してください。")
+        return
+
+    today = datetime.now(gcal.CALENDAR_TIMEZONE).replace(hour=0, minute=0, second=0, microsecond=0)
+    try:
+        start_dt = _parse_export_date(start) if start else today - timedelta(days=EXPORT_DEFAULT_DAYS)
+        end_dt = (_parse_export_date(end) if end else today + timedelta(days=EXPORT_DEFAULT_DAYS)) + timedelta(days=1)
+    except ValueError:
+        await interaction.response.send_message("⚠️ 日付は `2025-03-01` の形式で指定してください。", ephemeral=True)
+        return
+    if start_dt >= end_dt:
+        await interaction.response.send_message("⚠️ 終了日は開始日以降の日付を指定してください。", ephemeral=True)
+        return
+    if discord_id in _exporting:
+        await interaction.response.send_message("⏳ 書き出しを実行中です。完了してからもう一度お試しください。", ephemeral=True)
+        return
+
+    _exporting.add(discord_id)
+    started = time.monotonic()
+    # 予定が多いと時間がかかるため、先に応答を保留する
+    await interaction.response.defer(thinking=True)
+
+    async def send(**kwargs):
+        # 保留した応答への返信期限を過ぎたらチャンネルへ直接送る
+        if time.monotonic() - started < INTERACTION_FOLLOWUP_SECONDS:
+            return await interaction.followup.send(**kwargs)
+        return await interaction.channel.send(**kwargs)
+
+    period = f"{start_dt:%Y-%m-%d}〜{end_dt - timedelta(days=1):%Y-%m-%d}"
+    total = files = 0
+    try:
+        events = gcal.aiter_events(calendar_id, start_dt, end_dt, bot_only=not include_all)
+        async with aclosing(ics_export.aiter_ics_files(events, f"予定 {period}", EXPORT_FILE_MAX_BYTES)) as ics_files:
+            async for fp, count in ics_files:
+                files += 1
+                total += count
+                with fp:
+                    await send(file=discord.File(fp, filename=f"calendar_{start_dt:%Y%m%d}_{end_dt - timedelta(days=1):%Y%m%d}_{files}.ics"))
+    except resilience.CircuitOpenError as e:
+        await send(content=f"❌ {e.name} が一時的に利用できないため書き出しを中断しました（{total}件まで送信済み）。時間を置いてもう一度お試しください。")
+        return
+    except Exception as e:
+        logging.error(f"Failed to export events: {e}")
+        await send(content=f"❌ 書き出し中にエラーが発生しました（{total}件まで送信済み）。")
+        _send_error_webhook("予定の書き出し失敗")
+        return
+    finally:
+        _exporting.discard(discord_id)
+        metrics.stage_seconds.observe(time.monotonic() - started, stage="export")
+
+    if total == 0:
+        await send(content=f"📭 {period} に該当する予定はありません。")
+    else:
+        split = f"（{files}ファイルに分割）" if files > 1 else ""
+        await send(content=f"📤 {period} の予定 {total}件を書き出しました{split}。")
 
 
 @bot.tree.command(name="cancel", description="カレンダー登録作業を中断します。")
@@ -228,15 +596,28 @@ async def cancel_command(interaction: discord.Interaction):
         return
 
     discord_id = str(interaction.user.id)
-    current_state = db.get_user_state(discord_id)
+    current_state = await db.aget_user_state(discord_id)
 
     if current_state:
-        db.clear_user_state(discord_id)
+        await db.aclear_user_state(discord_id)
         await interaction.response.send_message("✅ カレンダー登録を中断しました。")
     else:
         await interaction.response.send_message("現在、進行中の作業はありません。")
 
 
+@bot.tree.command(name="debug", description="解析結果のJSONを表示するかを切り替えます。")
+@app_commands.describe(enabled="表示する場合は True")
+async def debug_command(interaction: discord.Interaction, enabled: bool):
+    if not await _require_dm(interaction):
+        return
+
+    await db.aset_show_debug(str(interaction.user.id), enabled)
+    if enabled:
+        await interaction.response.send_message("✅ 解析結果のJSONを表示します。")
+    else:
+        await interaction.response.send_message("✅ 解析結果のJSONを表示しないようにしました。")
+
+
 @bot.tree.command(name="webhook", description="エラー通知用のWebhook URLを登録します。（管理者のみ）")
 @app_commands.describe(url="Discord Webhook URL")
 async def webhook_command(interaction: discord.Interaction, url: str):
@@ -247,7 +628,7 @@ async def webhook_command(interaction: discord.Interaction, url: str):
         await interaction.response.send_message("⚠️ このコマンドはBot管理者のみ実行できます。")
         return
 
-    db.save_setting("error_webhook_url", url.strip())
+    await db.asave_setting("error_webhook_url", url.strip())
     await interaction.response.send_message("✅ エラー通知用Webhook URLを登録しました。")
 
 
@@ -260,7 +641,7 @@ async def webhook_remove_command(interaction: discord.Interaction):
         await interaction.response.send_message("⚠️ このコマンドはBot管理者のみ実行できます。")
         return
 
-    deleted = db.delete_setting("error_webhook_url")
+    deleted = await db.adelete_setting("error_webhook_url")
     if deleted:
         await interaction.response.send_message("✅ Webhook URLを解除しました。")
     else:
@@ -276,7 +657,7 @@ async def webhook_test_command(interaction: discord.Interaction):
         await interaction.response.send_message("⚠️ このコマンドはBot管理者のみ実行できます。")
         return
 
-    webhook_url = db.get_setting("error_webhook_url")
+    webhook_url = await db.aget_setting("error_webhook_url")
     if not webhook_url:
         await interaction.response.send_message("⚠️ Webhook URLが登録されていません。先に `/webhook <URL>` で登録してください。")
         return
@@ -285,19 +666,89 @@ async def webhook_test_command(interaction: discord.Interaction):
 
     payload = {"content": "✅ カレンダーBotのWebhook通知テストです。正常に動作しています。"}
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(webhook_url, json=payload) as resp:
-                if resp.status < 400:
-                    await interaction.followup.send("✅ テスト通知を送信しました。Webhook先を確認してください。")
-                else:
-                    await interaction.followup.send(f"❌ 送信失敗: HTTP {resp.status}。URLが正しいか確認してください。")
+        status = await webhook_dispatcher.post(webhook_url, payload)
+        if status < 400:
+            await interaction.followup.send("✅ テスト通知を送信しました。Webhook先を確認してください。")
+        else:
+            await interaction.followup.send(f"❌ 送信失敗: HTTP {status}。URLが正しいか確認してください。")
     except Exception:
         await interaction.followup.send("❌ 送信に失敗しました。URLが正しいか確認してください。")
 
 
+@bot.tree.command(name="stats", description="処理時間・エラー数などの統計を表示します。（管理者のみ）")
+async def stats_command(interaction: discord.Interaction):
+    if not await _require_dm(interaction):
+        return
+
+    if not _is_admin(interaction):
+        await interaction.response.send_message("⚠️ このコマンドはBot管理者のみ実行できます。")
+        return
+
+    embed = discord.Embed(title="📊 Bot統計", color=discord.Color.blue())
+
+    requests = sum(metrics.requests_total.values().values())
+    embed.add_field(name="処理件数", value=f"{int(requests)} 件（処理中 {metrics.in_flight_count()} 件）", inline=False)
+
+    stage_lines = [
+        f"`{dict(key)['stage']}` {s['count']}回 平均{s['mean'] * 1000:.0f}ms p50≦{s['p50'] * 1000:.0f}ms p99≦{s['p99'] * 1000:.0f}ms"
+        for key, s in sorted(metrics.stage_seconds.summary().items())
+    ]
+    embed.add_field(name="段階ごとの処理時間", value="\n".join(stage_lines) or "データなし", inline=False)
+
+    db_summary = metrics.db_seconds.summary().values()
+    db_count = sum(s["count"] for s in db_summary)
+    db_mean = sum(s["mean"] * s["count"] for s in db_summary) / db_count if db_count else 0
+    embed.add_field(name="DB", value=f"{db_count}回 平均{db_mean * 1000:.2f}ms", inline=False)
+
+    error_lines = [f"`{dict(key)['error_type']}` {int(v)}件" for key, v in sorted(metrics.errors_total.values().items())]
+    embed.add_field(name="エラー", value="\n".join(error_lines) or "なし", inline=False)
+
+    cache_lines = [f"`{name}` ヒット率 {s['hit_rate']:.0%}（{s['hits']}/{s['hits'] + s['misses']}）" for name, s in _cache_stats().items()]
+    embed.add_field(name="キャッシュ", value="\n".join(cache_lines), inline=False)
+
+    queue_lines = [f"`{name}` {depth}" for name, depth in _queue_depths().items()]
+    embed.add_field(name="キュー", value="\n".join(queue_lines), inline=False)
+
+    breaker_lines = []
+    for breaker in resilience.BREAKERS:
+        b = breaker.snapshot()
+        line = f"`{breaker.name}` {b['state']}（連続失敗 {b['failures']}回、停止 {b['opened_count']}回）"
+        if b["retry_in"]:
+            line += f" 再開まで{int(b['retry_in']) + 1}秒"
+        breaker_lines.append(line)
+    embed.add_field(name="サーキットブレーカー", value="\n".join(breaker_lines), inline=False)
+
+    await interaction.response.send_message(embed=embed)
+
+
 # -------------------------------------
-# 5. メッセージ処理 (DM限定)
+# 6. メッセージ処理 (DM限定)
 # -------------------------------------
+# on_message はジョブとしてSQLiteに保存するだけにし、解析・登録はワーカーが行う。
+# 処理中に再起動しても、リースが切れたジョブは次の起動時に再開される。
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "20"))
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "200"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Gemini / Calendar のサーキットブレーカーが開いていたときに、時間を置いて再試行する最大回数
+DEFER_MAX_ATTEMPTS = int(os.getenv("DEFER_MAX_ATTEMPTS", "5"))
+# 登録前に既存の予定との重なりを確認するか。確認のために同期を待つ最長時間 (秒)
+OVERLAP_WARNING = os.getenv("OVERLAP_WARNING", "1") == "1"
+OVERLAP_SYNC_WAIT = float(os.getenv("OVERLAP_SYNC_WAIT", "2"))
+# 添付ファイルの取り込み: ファイルサイズと1ファイルあたりの予定数の上限、回数制限で待つ最長時間 (秒)
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_MB", "25")) * 1024 * 1024
+IMPORT_MAX_EVENTS = int(os.getenv("IMPORT_MAX_EVENTS", "20000"))
+IMPORT_MAX_WAIT = float(os.getenv("IMPORT_MAX_WAIT", "60"))
+# 1回のバッチリクエストで登録する件数 (回数制限の容量を超えない範囲で)
+IMPORT_BATCH_SIZE = max(1, int(min(
+    gcal.BATCH_LIMIT, rate_limiter.import_limiter.user_capacity, rate_limiter.import_limiter.global_bucket.capacity,
+)))
+
+
+# 受け付け中のユーザー (待機状態の確認からジョブの保存までの間に、同時に届いたDMを二重に受け付けないため)
+_accepting: set[str] = set()
+
+
 @bot.event
 async def on_message(message: discord.Message):
     # Bot自身のメッセージは無視
@@ -309,102 +760,457 @@ async def on_message(message: discord.Message):
         return
 
     discord_id = str(message.author.id)
-    user_state = db.get_user_state(discord_id)
+    _dm_channels.set(discord_id, message.channel)
+    user_state = await db.aget_user_state(discord_id)
+
+    # 待機状態でない場合・同じユーザーのDMを受け付け中の場合は無視
+    # (確認と確保の間に await を挟まないので、同時に届いたDMのうち1通だけが通る)
+    if user_state != "waiting_for_details" or discord_id in _accepting:
+        return
+
+    _accepting.add(discord_id)
+    try:
+        await _accept_message(message, discord_id)
+    finally:
+        _accepting.discard(discord_id)
+
 
-    # 待機状態でない場合は無視
-    if user_state != "waiting_for_details":
+async def _accept_message(message: discord.Message, discord_id: str):
+    """待機中のユーザーのDMを確認し、ジョブとして保存する"""
+    metrics.requests_total.inc()
+
+    # .ics / CSV の添付ファイルは Gemini を使わずに取り込む
+    attachment = next((a for a in message.attachments if event_import.is_supported(a.filename)), None)
+    if attachment is not None and attachment.size > IMPORT_MAX_BYTES:
+        await _reply(message, f"⚠️ ファイルが大きすぎます（上限 {IMPORT_MAX_BYTES // (1024 * 1024)}MB）。分割して送信してください。")
         return
 
-    # --- 待機状態の場合の処理 ---
+    # レート制限チェック (Gemini呼び出し枠)
+    if attachment is None:
+        allowed, retry_after = rate_limiter.gemini_limiter.acquire(discord_id)
+        if not allowed:
+            await _reply(message, f"⏳ 利用回数の上限に達しました。約{int(retry_after) + 1}秒後に再度お試しください。")
+            return
 
-    # レート制限チェック
-    if not db.check_rate_limit(discord_id):
-        await message.reply("⏳ 1分間に1回のみ利用できます。しばらくお待ちください。")
+    queued = None
+    try:
+        queued = await _enqueue_message(message, discord_id, attachment)
+    finally:
+        # ジョブを保存しなかった場合は、消費した利用回数を返す
+        if queued is None and attachment is None:
+            rate_limiter.gemini_limiter.refund(discord_id)
+    if queued is None:
         return
+    _, position = queued
+    job_pool.notify()
 
-    # 状態をクリアして多重処理を防ぐ
-    db.clear_user_state(discord_id)
+    if position > job_pool.idle_count():
+        await _reply(message, f"⏳ 混み合っています。順番が来たら処理します（{position}番目）。")
 
+
+async def _enqueue_message(message: discord.Message, discord_id: str, attachment: discord.Attachment | None) -> tuple[int, int] | None:
+    """メッセージをジョブとして保存し、(ジョブID, 順番) を返す。保存しなかった場合は None を返す"""
     # ユーザーのカレンダーIDを取得
-    calendar_id = db.get_calendar_id(discord_id)
+    calendar_id = await db.aget_calendar_id(discord_id)
     if not calendar_id:
-        await message.reply(
+        await db.aclear_user_state(discord_id)
+        await _reply(message,
             "⚠️ カレンダーIDが登録されていません。\n"
             "`/register <カレンダーID>` でカレンダーを登録してください。"
         )
+        return None
+
+    # 待機状態の削除とジョブの保存を同じトランザクションで行い、待機状態でなくなっていれば保存しない
+    attachment_url, attachment_name = (attachment.url, attachment.filename) if attachment else (None, None)
+    try:
+        return await db.aenqueue_job(
+            discord_id, str(message.id), calendar_id, message.content, JOB_MAX_QUEUE, attachment_url, attachment_name
+        )
+    except db.QueueFullError:
+        await _reply(message, "⏳ 現在混み合っています。しばらくしてからもう一度送信してください。")
+        return None
+
+
+async def _job_message(job: dict) -> discord.PartialMessage:
+    """ジョブの元になったメッセージ (再起動後でも取得し直さずに返信できる)"""
+    channel = await _get_dm_channel(job["discord_id"])
+    return channel.get_partial_message(int(job["message_id"]))
+
+
+@metrics.timed("process")
+async def _run_job(job: dict):
+    """ワーカーが取り出したジョブを処理する"""
+    # 後回しにしたジョブ・続きから再開する取り込みは、待ち時間を二重に数えない
+    if job["attempts"] == 1 and not job["defers"] and not job["progress"]:
+        metrics.stage_seconds.observe(time.time() - job["created_at"], stage="queue_wait")
+
+    message = await _job_message(job)
+
+    # 処理中の停止を繰り返すジョブは諦める
+    if job["attempts"] > JOB_MAX_ATTEMPTS:
+        await _reply(message, "❌ 処理を完了できませんでした。もう一度 `/calendar` からやり直してください。")
+        _send_error_webhook("ジョブの再試行回数超過")
         return
 
+    # 重なりの確認に使うカレンダーのコピーを、解析と並行して最新にしておく
+    mirror_sync = None
+    if OVERLAP_WARNING and not job["attachment_url"]:
+        mirror_sync = asyncio.create_task(gcal.aensure_mirror(job["calendar_id"]))
+
+    with metrics.in_flight():
+        try:
+            if job["attachment_url"]:
+                await _import_attachment(message, job)
+            elif job["events"] is None:
+                await _parse_and_register(message, job, mirror_sync)
+            else:
+                # 解析済みの予定は登録からやり直す
+                await _register_events(message, job["calendar_id"], json.loads(job["events"]), mirror_sync)
+        except resilience.CircuitOpenError as e:
+            if job["defers"] + 1 >= DEFER_MAX_ATTEMPTS:
+                await _reply(message, f"❌ **{e.name} の障害が続いているため処理を中断しました**\n時間を置いてもう一度 `/calendar` からやり直してください。")
+                _send_error_webhook(f"{e.name} 障害による処理中断")
+                return
+
+            # 再開直後に一斉にやり直さないよう、待ち時間をばらつかせる
+            delay = e.retry_after + random.uniform(1, 1 + resilience.CIRCUIT_RESET_SECONDS)
+            await _reply(message, f"⏳ {e.name} が一時的に利用できないため、約{int(delay) + 1}秒後に自動で再試行します。")
+            _send_error_webhook(f"{e.name} 一時停止中")
+            raise RetryLater(delay)
+        except RetryLater:
+            raise
+        except Exception:
+            await _reply(message, "❌ 処理中にエラーが発生しました。もう一度 `/calendar` からやり直してください。")
+            _send_error_webhook("メッセージ処理失敗")
+            raise
+        finally:
+            if mirror_sync is not None:
+                _discard_mirror_sync(mirror_sync)
+
+
+def _discard_mirror_sync(task: asyncio.Task):
+    """
+    ジョブの中で待たなかった同期の待機をやめ、結果を受け取っておく。
+    同期そのものは gcal 側で続き、次のジョブでコピーが使われる。
+    """
+    task.add_done_callback(_retrieve_mirror_sync)
+    task.cancel()
+
+
+def _retrieve_mirror_sync(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.debug(f"Calendar mirror sync failed: {task.exception()}")
+
+
+job_pool = JobWorkerPool(_run_job, JOB_WORKERS, JOB_LEASE_SECONDS)
+
+
+async def _parse_and_register(message: discord.PartialMessage, job: dict, mirror_sync: asyncio.Task | None):
+    """予定を解析して登録する"""
+    discord_id = job["discord_id"]
     async with message.channel.typing():
+        if gemini_handler.GEMINI_STREAMING:
+            await _process_message_streaming(message, job, mirror_sync)
+            return
+
         # 1. Gemini APIで予定を解析
-        event_details, gemini_error = await gemini_handler.parse_event_details(message.content)
+        event_details, gemini_error = await gemini_handler.parse_event_details(job["content"])
 
         if gemini_error:
-            await message.reply(f"⚠️ **解析失敗 (Gemini)**\nAIからの応答:\n```text\n{gemini_error}\n```")
-            await _send_error_webhook("Gemini API解析失敗")
+            await _reply(message, f"⚠️ **解析失敗 (Gemini)**\nAIからの応答:\n```text\n{gemini_error}\n```")
+            _send_error_webhook("Gemini API解析失敗")
             return
 
         if not event_details:
-            await message.reply("エラー: 解析結果が空でした。")
+            await _reply(message, "エラー: 解析結果が空でした。")
+            return
+
+        # 再開時に解析をやり直さないよう保存しておく
+        await db.asave_job_events(job["id"], json.dumps(event_details, ensure_ascii=False))
+
+        # デバッグ表示 (/debug で有効にしたユーザーのみ)
+        if await db.aget_show_debug(discord_id):
+            await _reply_debug(message, "🤖 **解析成功！この内容で登録を試みます:**", event_details)
+
+        # 2. 全イベントをバッチリクエストでまとめて登録 (専用スレッドプールで実行)
+        total_events = len(event_details)
+
+        # レート制限チェック (カレンダー登録枠、1件につき1回分)
+        allowed, retry_after = rate_limiter.calendar_limiter.acquire(discord_id, total_events)
+        if not allowed:
+            if retry_after == float("inf"):
+                await _reply(message, f"⏳ 一度に登録できる予定の数を超えています ({total_events}件)。分けて送信してください。")
+            else:
+                await _reply(message, f"⏳ カレンダー登録の上限に達しました。約{int(retry_after) + 1}秒後に再度お試しください。")
             return
 
-        # デバッグ表示
-        json_debug = json.dumps(event_details, indent=2, ensure_ascii=False)
-        await message.reply(f"🤖 **解析成功！この内容で登録を試みます:**\n```json\n{json_debug}\n```")
+        await _register_events(message, job["calendar_id"], event_details, mirror_sync)
+
+
+async def _register_events(message: discord.PartialMessage, calendar_id: str, event_details: list[dict], mirror_sync: asyncio.Task | None = None):
+    """解析済みの予定を登録し、結果を1通のメッセージにまとめて返信する"""
+    progress = RegistrationProgress(partial(_reply, message))
+    for event_data in event_details:
+        progress.add(event_data)
+    # イベントIDは重なりの確認と登録の両方で使うので、1回だけ計算する
+    event_ids = gcal.event_ids_for(event_details, calendar_id)
+    await _warn_overlaps(progress, calendar_id, list(enumerate(event_details)), event_ids, mirror_sync)
+
+    # バッチリクエストが複数回に分かれる場合だけ、途中経過を表示する
+    if len(event_details) > gcal.BATCH_LIMIT:
+        await progress.start()
 
-        # 2. Google Calendar APIの準備
+    for offset in range(0, len(event_details), gcal.BATCH_LIMIT):
+        chunk = event_details[offset:offset + gcal.BATCH_LIMIT]
         try:
-            service = gcal.get_calendar_service()
+            results = await gcal.acreate_calendar_events_batch(
+                chunk, calendar_id, event_ids=event_ids[offset:offset + gcal.BATCH_LIMIT]
+            )
+        except resilience.CircuitOpenError:
+            if offset == 0:
+                raise
+            results = [(None, "Googleカレンダーが一時的に利用できません")] * len(chunk)
         except Exception as e:
-            logging.error(f"Failed to get calendar service: {e}")
-            await message.reply(f"❌ **Googleカレンダーへの接続に失敗しました**\n```text\n{e}\n```")
-            await _send_error_webhook("Googleカレンダー接続失敗")
-            return
+            logging.error(f"Failed to create calendar events: {e}")
+            _send_error_webhook("Googleカレンダー接続失敗")
+            results = [(None, f"Googleカレンダーへの接続に失敗しました: {e}")] * len(chunk)
 
-        # 3. 各イベントをループで登録
-        success_count = 0
-        error_count = 0
-        total_events = len(event_details)
+        for i, (created_event, calendar_error) in enumerate(results, offset):
+            if not progress.set_result(i, created_event, calendar_error):
+                _send_error_webhook("カレンダーイベント登録失敗")
+        progress.refresh()
 
-        for i, event_data in enumerate(event_details, 1):
+    await progress.finish()
+
+
+async def _warn_overlaps(progress: RegistrationProgress, calendar_id: str, indexed_events: list[tuple[int, dict]],
+                         event_ids: list[str | None], mirror_sync: asyncio.Task | None):
+    """
+    登録しようとしている予定と時間が重なる既存の予定があれば、進捗メッセージに注意書きを付ける。
+    event_ids は indexed_events と同じ順序のイベントID (gcal.event_ids_for の結果)。
+    """
+    if mirror_sync is None:
+        return
+    try:
+        # 同期が終わらなくても、手元のコピーだけで確認する
+        await asyncio.wait_for(asyncio.shield(mirror_sync), OVERLAP_SYNC_WAIT)
+    except asyncio.TimeoutError:
+        pass
+    except Exception as e:
+        logging.error(f"Failed to sync calendar mirror: {e}")
+
+    try:
+        overlaps = await gcal.afind_overlaps([event_data for _, event_data in indexed_events], calendar_id, event_ids)
+    except Exception as e:
+        logging.error(f"Failed to check overlapping events: {e}")
+        return
+
+    for (index, _), found in zip(indexed_events, overlaps):
+        if found:
+            names = "、".join(
+                f"{event['summary'] or '(タイトルなし)'} ({event['start']:%m/%d %H:%M}-{event['end']:%H:%M})"
+                for event in found[:3]
+            )
+            progress.set_warning(index, f"重なる予定があります: {names}")
+
+
+async def _import_attachment(message: discord.PartialMessage, job: dict):
+    """
+    添付された .ics / CSV ファイルの予定を Gemini を使わずに登録する。
+    ファイルは一時ファイルに保存して1件ずつ読み、IMPORT_BATCH_SIZE 件ごとにバッチリクエストで登録する。
+    処理し終えた件数をジョブに保存し、中断・再起動の後はその続きから登録する。
+    """
+    try:
+        file = await event_import.download(job["attachment_url"], IMPORT_MAX_BYTES)
+    except event_import.ImportFileError as e:
+        await _reply(message, f"⚠️ **ファイルを読み込めませんでした**\n{e}")
+        return
+
+    progress = ImportProgress(partial(_reply, message), job["attachment_name"], job["progress"])
+    with event_import.open_text(file) as text:
+        records = event_import.iter_file_events(job["attachment_name"], text, gcal.CALENDAR_TIMEZONE)
+        # 前回までに処理した分は読み飛ばす (登録済みの予定は台帳でも重複と判定される)
+        records = islice(records, job["progress"], None)
+        await progress.start()
+        try:
+            await _import_records(job, records, progress)
+        except Exception:
+            progress.status_note = progress.status_note or "エラーが発生したため中断しました。"
+            raise
+        finally:
+            await progress.finish()
+
+
+def _take(records, count: int) -> list:
+    return list(islice(records, count))
+
+
+async def _import_records(job: dict, records, progress: ImportProgress):
+    done = job["progress"]
+    while True:
+        # 読み込みは (一時ファイルの読み出しを含めて) イベントループの外で行う
+        try:
+            batch = await asyncio.to_thread(_take, records, IMPORT_BATCH_SIZE)
+        except Exception as e:
+            progress.status_note = f"⚠️ {done + 1}件目以降を読み込めませんでした: {e}"
+            break
+        if not batch:
+            break
+
+        truncated = done + len(batch) > IMPORT_MAX_EVENTS
+        if truncated:
+            batch = batch[:IMPORT_MAX_EVENTS - done]
+
+        events = [(line, event_data, note) for line, event_data, note in batch if event_data is not None]
+        for line, event_data, error in batch:
+            if event_data is None:
+                progress.add_error(line, None, error)
+
+        if events:
+            await _acquire_import_tokens(job["discord_id"], len(events), progress)
             try:
-                created_event, calendar_error = gcal.create_calendar_event(service, event_data, calendar_id)
+                results = await gcal.acreate_calendar_events_batch([event_data for _, event_data, _ in events], job["calendar_id"])
+            except resilience.CircuitOpenError:
+                progress.status_note = "続きは自動で再開します。"
+                raise
             except Exception as e:
-                logging.error(f"Unexpected error creating event: {e}")
-                created_event = None
-                calendar_error = str(e)
-
-            if created_event and created_event.get('htmlLink'):
-                success_count += 1
-                db.update_last_used(discord_id)
-                embed = discord.Embed(
-                    title=f"✅ カレンダー登録成功 ({i}/{total_events})",
-                    description=f"**{created_event.get('summary', 'N/A')}**",
-                    color=discord.Color.green()
-                )
-                start_display = f"{event_data.get('start_date', '')} {event_data.get('start_time', '終日')}".strip()
-                embed.add_field(name="日時", value=start_display if start_display else "日時不明", inline=False)
-                embed.add_field(name="場所", value=event_data.get('location', '指定なし'), inline=False)
-                embed.add_field(name="リンク", value=f"[カレンダーで表示]({created_event['htmlLink']})", inline=False)
-                await message.reply(embed=embed)
-            else:
-                error_count += 1
-                await _send_error_webhook("カレンダーイベント登録失敗")
-                error_embed = discord.Embed(
-                    title=f"❌ カレンダー登録エラー ({i}/{total_events})",
-                    description=f"予定: `{event_data.get('summary', 'N/A')}`",
-                    color=discord.Color.red()
-                )
-                error_embed.add_field(name="エラー詳細", value=f"```text\n{calendar_error}\n```", inline=False)
-                await message.reply(embed=error_embed)
-
-        # 4. 最終結果のサマリー (複数の場合のみ)
-        if total_events > 1:
-            summary_embed = discord.Embed(
-                title="全件処理完了",
-                description=f"**{success_count}** 件成功、**{error_count}** 件失敗しました。",
-                color=discord.Color.blue()
-            )
-            await message.reply(embed=summary_embed)
+                logging.error(f"Failed to create calendar events: {e}")
+                _send_error_webhook("Googleカレンダー接続失敗")
+                results = [(None, f"Googleカレンダーへの接続に失敗しました: {e}")] * len(events)
+
+            failed = False
+            for (line, event_data, note), (created_event, calendar_error) in zip(events, results):
+                failed |= not progress.set_result(line, event_data, created_event, calendar_error, note)
+            if failed:
+                _send_error_webhook("カレンダーイベント登録失敗")
+
+        done += len(batch)
+        progress.processed = done
+        await db.asave_job_progress(job["id"], done)
+        progress.refresh()
+
+        if truncated:
+            progress.status_note = f"⚠️ 1つのファイルから取り込めるのは{IMPORT_MAX_EVENTS}件までです。残りは登録していません。"
+            break
+
+    progress.done = True
+
+
+async def _acquire_import_tokens(discord_id: str, count: int, progress: ImportProgress):
+    """取り込みの回数制限の枠を確保する。すぐに空かない場合はジョブを後回しにして、続きから再開させる"""
+    while True:
+        allowed, retry_after = rate_limiter.import_limiter.acquire(discord_id, count)
+        if allowed:
+            return
+        if retry_after > IMPORT_MAX_WAIT:
+            progress.status_note = f"⏳ 取り込みの上限に達したため、約{int(retry_after // 60) + 1}分後に続きを自動で再開します。"
+            # 回数制限の待ちは障害による後回し (DEFER_MAX_ATTEMPTS) に数えない
+            raise RetryLater(retry_after, count=False)
+        await asyncio.sleep(retry_after)
+
+
+async def _reply_debug(message: discord.PartialMessage, heading: str, event_details: list[dict]):
+    """解析結果のJSONを返信する"""
+    json_debug = json.dumps(event_details, indent=2, ensure_ascii=False)
+    # メッセージの上限 (2000文字) を超える場合は省略する
+    if len(json_debug) > 1800:
+        json_debug = json_debug[:1800] + "\n…"
+    await _reply(message, f"{heading}\n```json\n{json_debug}\n```")
+
+
+async def _process_message_streaming(message: discord.PartialMessage, job: dict, mirror_sync: asyncio.Task | None = None):
+    """
+    Geminiのストリーミング応答から予定が1件完成するたびに登録を始め、進捗メッセージを更新する。
+    登録中に解析が進んだ予定は次のバッチリクエストにまとめ、API呼び出しの回数を抑える。
+    """
+    discord_id, calendar_id = job["discord_id"], job["calendar_id"]
+    queue: asyncio.Queue[int | None] = asyncio.Queue()
+    progress = RegistrationProgress(partial(_reply, message))
+    event_details: list[dict] = []
+
+    async def register():
+        finished = False
+        first_batch = True
+        while not finished:
+            batch = [await queue.get()]
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            if batch[-1] is None:
+                finished = True
+                batch.pop()
+            if not batch:
+                continue
+
+            events = [event_details[i] for i in batch]
+            event_ids = gcal.event_ids_for(events, calendar_id)
+            await _warn_overlaps(progress, calendar_id, list(zip(batch, events)), event_ids, mirror_sync)
+            try:
+                results = await gcal.acreate_calendar_events_batch(events, calendar_id, event_ids=event_ids)
+            except resilience.CircuitOpenError:
+                # まだ1件も登録していなければ、ジョブごと後回しにして登録からやり直す
+                if first_batch:
+                    raise
+                results = [(None, "Googleカレンダーが一時的に利用できません")] * len(batch)
+            except Exception as e:
+                logging.error(f"Failed to create calendar events: {e}")
+                _send_error_webhook("Googleカレンダー接続失敗")
+                results = [(None, f"Googleカレンダーへの接続に失敗しました: {e}")] * len(batch)
+            first_batch = False
+
+            for i, (created_event, calendar_error) in zip(batch, results):
+                if not progress.set_result(i, created_event, calendar_error):
+                    _send_error_webhook("カレンダーイベント登録失敗")
+            progress.refresh()
+
+    inserter = asyncio.create_task(register())
+    gemini_error = None
+    stopped = False
+
+    try:
+        async with aclosing(gemini_handler.iter_event_details(job["content"])) as stream:
+            async for event_data, error in stream:
+                if error:
+                    gemini_error = error
+                    break
+
+                # 登録が止まった (カレンダーが一時停止中) 場合は解析もやめる。例外は下で inserter を待つときに送出される
+                if inserter.done():
+                    stopped = True
+                    break
+
+                # レート制限チェック (カレンダー登録枠、1件につき1回分)
+                allowed, retry_after = rate_limiter.calendar_limiter.acquire(discord_id)
+                if not allowed:
+                    await _reply(message, f"⏳ カレンダー登録の上限に達しました。{len(event_details) + 1}件目以降は登録していません。約{int(retry_after) + 1}秒後に再度お試しください。")
+                    break
+
+                event_details.append(event_data)
+                queue.put_nowait(progress.add(event_data))
+                if len(event_details) == 1:
+                    await progress.start()
+                else:
+                    progress.refresh()
+
+        # 再開時に解析をやり直さないよう、残りの登録を待つ前に保存しておく (途中でやめた解析結果は保存しない)
+        if event_details and not gemini_error and not stopped:
+            await db.asave_job_events(job["id"], json.dumps(event_details, ensure_ascii=False))
+    finally:
+        queue.put_nowait(None)
+        await inserter
+
+    if event_details:
+        await progress.finish()
+
+    if gemini_error:
+        await _reply(message, f"⚠️ **解析失敗 (Gemini)**\nAIからの応答:\n```text\n{gemini_error}\n```")
+        _send_error_webhook("Gemini API解析失敗")
+    elif not event_details:
+        await _reply(message, "エラー: 解析結果が空でした。")
+        return
+
+    # デバッグ表示 (登録と並行して解析したため最後にまとめて表示する)
+    if event_details and await db.aget_show_debug(discord_id):
+        await _reply_debug(message, "🤖 **解析結果:**", event_details)
 
 
 # -------------------------------------
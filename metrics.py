@@ -0,0 +1,237 @@
+# metrics.py
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+# 段階ごとの処理時間・件数を集計し、Prometheus のテキスト形式で公開する。
+# METRICS_PORT を指定した場合のみ HTTP で公開する (既定はローカルホストのみ)。
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Counter:
+    """単調増加するカウンター (ラベルごと)"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self) -> dict[tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge:
+    """現在値を返す関数から値を読むゲージ"""
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], dict[tuple, float] | float]):
+        self.name = name
+        self.help = help_text
+        self._read = read
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self._read()
+        except Exception as e:
+            logging.error(f"Failed to read gauge {self.name}: {e}")
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """処理時間のヒストグラム (ラベルごと)"""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        # ラベル -> [各バケットの件数..., +Inf の件数, 合計値]
+        self._values: dict[tuple, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def summary(self) -> dict[tuple, dict]:
+        """ラベルごとの件数・平均・p50/p99 (バケット上限での概算)"""
+        with self._lock:
+            snapshot = {key: list(counts) for key, counts in self._values.items()}
+
+        result = {}
+        for key, counts in snapshot.items():
+            total = sum(counts[:-1])
+            if not total:
+                continue
+            result[key] = {
+                "count": total,
+                "mean": counts[-1] / total,
+                "p50": self._quantile(counts, total, 0.5),
+                "p99": self._quantile(counts, total, 0.99),
+            }
+        return result
+
+    def _quantile(self, counts: list[float], total: float, q: float) -> float:
+        seen = 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= total * q:
+                return bound
+        return float("inf")
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}")
+            cumulative += counts[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {counts[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+# --- メトリクス定義 ---
+
+stage_seconds = Histogram("calendar_bot_stage_seconds", "Latency of each processing stage")
+db_seconds = Histogram("calendar_bot_db_seconds", "Latency of database.py functions")
+requests_total = Counter("calendar_bot_requests_total", "Messages processed by on_message")
+errors_total = Counter("calendar_bot_errors_total", "Errors by type")
+
+_in_flight = 0
+_gauges: list[Gauge] = [
+    Gauge("calendar_bot_in_flight", "Messages currently being processed", lambda: _in_flight),
+]
+
+
+def register_gauge(name: str, help_text: str, read: Callable[[], dict[tuple, float] | float]):
+    """値を読む関数を登録してゲージとして公開する"""
+    _gauges.append(Gauge(name, help_text, read))
+
+
+@contextmanager
+def in_flight():
+    """処理中の件数を数える"""
+    global _in_flight
+    _in_flight += 1
+    try:
+        yield
+    finally:
+        _in_flight -= 1
+
+
+def in_flight_count() -> int:
+    return _in_flight
+
+
+def timed(stage: str, histogram: Histogram = stage_seconds, label: str = "stage"):
+    """関数 (同期・非同期どちらでも) の処理時間を記録するデコレーター"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with histogram.time(**{label: stage}):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**{label: stage}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_db(func):
+    """database.py の関数の処理時間を関数名ごとに記録するデコレーター"""
+    return timed(func.__name__.lstrip("_"), db_seconds, "function")(func)
+
+
+def render() -> str:
+    """Prometheus のテキスト形式で出力する"""
+    lines = []
+    for metric in (stage_seconds, db_seconds, requests_total, errors_total, *_gauges):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- HTTP公開 ---
+
+_runner = None
+
+
+async def start_server():
+    """METRICS_PORT が指定されていれば /metrics を公開する (2回目以降は何もしない)"""
+    global _runner
+    if not METRICS_PORT or _runner is not None:
+        return
+
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    _runner = web.AppRunner(app)
+    await _runner.setup()
+    await web.TCPSite(_runner, METRICS_HOST, METRICS_PORT).start()
+    logging.info(f"Metrics endpoint listening on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
@@ -0,0 +1,293 @@
+# progress.py
+import asyncio
+import logging
+import os
+import time
+from contextlib import suppress
+from typing import Any, Awaitable, Callable
+
+import discord
+
+# 進捗メッセージを編集する最短間隔 (秒)。Discordのチャンネルごとのレート制限に収める
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "1.5"))
+
+# Discordの上限
+EMBED_DESCRIPTION_LIMIT = 4096
+EMBEDS_PER_MESSAGE = 10
+EMBED_TOTAL_LIMIT = 6000
+# 1件あたりのエラー詳細の最大文字数
+ERROR_DETAIL_LIMIT = 200
+# ファイルの取り込み結果に表示するエラー・注意書きの最大件数
+IMPORT_NOTE_LIMIT = 10
+
+
+def pack_lines(title: str, lines: list[str], color: discord.Color) -> list[list[discord.Embed]]:
+    """
+    行をできるだけ少ないEmbedの説明文に詰める。
+    戻り値はメッセージごとのEmbedのリスト (1通あたり10個・合計6000文字まで)。
+    """
+    pages: list[list[discord.Embed]] = []
+    page: list[discord.Embed] = []
+    page_size = 0
+    description = ""
+
+    def embed_title() -> str | None:
+        # タイトルは各メッセージの先頭のEmbedにだけ付ける
+        if page:
+            return None
+        return title if not pages else f"{title}（続き）"
+
+    def fits(text: str) -> bool:
+        return (
+            len(text) <= EMBED_DESCRIPTION_LIMIT
+            and page_size + len(embed_title() or "") + len(text) <= EMBED_TOTAL_LIMIT
+        )
+
+    def flush_embed():
+        nonlocal page_size, description
+        heading = embed_title()
+        page.append(discord.Embed(title=heading, description=description or None, color=color))
+        page_size += len(heading or "") + len(description)
+        description = ""
+
+    for line in lines:
+        line = line[:EMBED_DESCRIPTION_LIMIT]
+        candidate = f"{description}\n{line}" if description else line
+        if fits(candidate):
+            description = candidate
+            continue
+
+        if description:
+            flush_embed()
+        if len(page) >= EMBEDS_PER_MESSAGE or not fits(line):
+            pages.append(page)
+            page, page_size = [], 0
+        description = line
+
+    flush_embed()
+    pages.append(page)
+    return pages
+
+
+class ProgressMessage:
+    """
+    進捗を1通のメッセージで表示し、状態が変わるたびに編集して更新する (_render を実装して使う)。
+    編集は PROGRESS_EDIT_INTERVAL 秒に1回までに間引き、最後の状態は finish() で必ず反映する。
+    """
+
+    def __init__(self, send: Callable[..., Awaitable[Any]], min_interval: float = PROGRESS_EDIT_INTERVAL):
+        self._send = send
+        self.min_interval = min_interval
+        self._message = None
+        self._last_edit = 0.0
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        """進捗メッセージを送信する"""
+        if self._message is None:
+            self._message = await self._send(embeds=self._render()[0])
+            self._last_edit = time.monotonic()
+
+    def refresh(self):
+        """進捗メッセージの更新を予約する (間隔を空けてまとめて編集する)"""
+        if self._message is None or self._task is not None:
+            return
+        delay = max(0.0, self._last_edit + self.min_interval - time.monotonic())
+        self._task = asyncio.create_task(self._edit_later(delay))
+
+    async def finish(self):
+        """最終結果を反映する。1通に収まらない分は続きのメッセージとして送る"""
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+        pages = self._render()
+        if self._message is None:
+            self._message = await self._send(embeds=pages[0])
+        else:
+            await self._edit(pages[0])
+        for page in pages[1:]:
+            await self._send(embeds=page)
+
+    async def _edit_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self._task = None
+        await self._edit(self._render()[0])
+
+    async def _edit(self, embeds: list[discord.Embed]):
+        self._last_edit = time.monotonic()
+        try:
+            await self._message.edit(embeds=embeds)
+        except Exception as e:
+            logging.error(f"Failed to edit progress message: {e}")
+
+    def _render(self) -> list[list[discord.Embed]]:
+        raise NotImplementedError
+
+
+class RegistrationProgress(ProgressMessage):
+    """複数の予定の登録状況を1通のメッセージにまとめ、結果が出るたびに更新する"""
+
+    PENDING, SUCCESS, DUPLICATE, ERROR = "pending", "success", "duplicate", "error"
+
+    def __init__(self, send: Callable[..., Awaitable[Any]], min_interval: float = PROGRESS_EDIT_INTERVAL):
+        super().__init__(send, min_interval)
+        # [予定, 状態, リンクまたはエラー内容, 注意書き]
+        self._entries: list[list] = []
+
+    @property
+    def success_count(self) -> int:
+        return self._count(self.SUCCESS)
+
+    @property
+    def duplicate_count(self) -> int:
+        return self._count(self.DUPLICATE)
+
+    @property
+    def error_count(self) -> int:
+        return self._count(self.ERROR)
+
+    def _count(self, status: str) -> int:
+        return sum(1 for entry in self._entries if entry[1] == status)
+
+    def add(self, event_data: dict) -> int:
+        """登録待ちの予定を追加し、その番号を返す"""
+        self._entries.append([event_data, self.PENDING, None, None])
+        return len(self._entries) - 1
+
+    def set_warning(self, index: int, warning: str | None):
+        """予定に注意書き (既存の予定との重なりなど) を付ける"""
+        self._entries[index][3] = warning
+
+    def set_result(self, index: int, created_event: dict | None, error: str | None) -> bool:
+        """登録結果を記録する。成功した場合 (登録済みだった場合を含む) は True を返す"""
+        entry = self._entries[index]
+        if created_event and created_event.get("duplicate"):
+            entry[1], entry[2] = self.DUPLICATE, created_event.get("htmlLink")
+            return True
+        if created_event and created_event.get("htmlLink"):
+            entry[1], entry[2] = self.SUCCESS, created_event["htmlLink"]
+            return True
+        entry[1], entry[2] = self.ERROR, error
+        return False
+
+    def _render(self) -> list[list[discord.Embed]]:
+        total = len(self._entries)
+        done = total - self._count(self.PENDING)
+        success, duplicates, errors = self.success_count, self.duplicate_count, self.error_count
+        skipped = f"、{duplicates}件は登録済み" if duplicates else ""
+
+        if done < total:
+            title, color = f"📅 カレンダー登録中… ({done}/{total})", discord.Color.blue()
+        elif errors == 0 and success == 0:
+            title, color = f"♻️ すべて登録済みの予定です ({duplicates}件)", discord.Color.light_grey()
+        elif errors == 0:
+            title, color = f"✅ カレンダー登録成功 ({success}件{skipped})", discord.Color.green()
+        elif success == 0 and duplicates == 0:
+            title, color = f"❌ カレンダー登録エラー ({errors}件)", discord.Color.red()
+        else:
+            title, color = f"⚠️ {success}件成功{skipped}、{errors}件失敗しました", discord.Color.orange()
+
+        return pack_lines(title, [self._format_line(*entry) for entry in self._entries], color)
+
+    def _format_line(self, event_data: dict, status: str, detail: str | None, warning: str | None) -> str:
+        line = self._format_result(event_data, status, detail)
+        if warning:
+            line += f"\n　└ ⚠️ {warning}"
+        return line
+
+    def _format_result(self, event_data: dict, status: str, detail: str | None) -> str:
+        summary = event_data.get("summary") or "N/A"
+        start_display = f"{event_data.get('start_date') or ''} {event_data.get('start_time') or '終日'}".strip()
+        location = f" 📍{event_data['location']}" if event_data.get("location") else ""
+
+        if status == self.SUCCESS:
+            return f"✅ **[{summary}]({detail})** {start_display}{location}"
+        if status == self.DUPLICATE:
+            linked = f"[{summary}]({detail})" if detail else summary
+            return f"♻️ **{linked}** {start_display}{location}（登録済み）"
+        if status == self.ERROR:
+            error = str(detail or "不明なエラー").replace("\n", " ")
+            if len(error) > ERROR_DETAIL_LIMIT:
+                error = error[:ERROR_DETAIL_LIMIT] + "…"
+            return f"❌ **{summary}** {start_display}{location}\n　└ `{error}`"
+        return f"⏳ **{summary}** {start_display}{location}"
+
+
+def _shorten(text: str) -> str:
+    text = str(text).replace("\n", " ")
+    return text[:ERROR_DETAIL_LIMIT] + "…" if len(text) > ERROR_DETAIL_LIMIT else text
+
+
+class ImportProgress(ProgressMessage):
+    """
+    ファイルからの取り込み状況を件数で表示する。
+    予定ごとの結果は持たず、エラーと注意書きは先頭の IMPORT_NOTE_LIMIT 件だけ残すので、何万件でもメモリを使わない。
+    """
+
+    def __init__(self, send: Callable[..., Awaitable[Any]], filename: str, resumed_from: int = 0, min_interval: float = PROGRESS_EDIT_INTERVAL):
+        super().__init__(send, min_interval)
+        self.filename = filename
+        self.resumed_from = resumed_from
+        # ファイル先頭から処理し終えた予定の件数 (前回までの分を含む)
+        self.processed = resumed_from
+        self.success_count = 0
+        self.duplicate_count = 0
+        self.error_count = 0
+        self.done = False
+        # 中断・打ち切りの理由
+        self.status_note: str | None = None
+        self._notes: list[str] = []
+        self._omitted_notes = 0
+
+    def _add_note(self, line: str):
+        if len(self._notes) < IMPORT_NOTE_LIMIT:
+            self._notes.append(line)
+        else:
+            self._omitted_notes += 1
+
+    def add_error(self, line_number: int, event_data: dict | None, error: str):
+        """登録できなかった行を記録する"""
+        self.error_count += 1
+        summary = f" **{event_data.get('summary') or 'N/A'}**" if event_data else ""
+        self._add_note(f"❌ {line_number}行目{summary}\n　└ `{_shorten(error)}`")
+
+    def set_result(self, line_number: int, event_data: dict, created_event: dict | None, error: str | None, note: str | None = None) -> bool:
+        """登録結果を記録する。成功した場合 (登録済みだった場合を含む) は True を返す"""
+        if created_event and created_event.get("duplicate"):
+            self.duplicate_count += 1
+        elif created_event and created_event.get("htmlLink"):
+            self.success_count += 1
+        else:
+            self.add_error(line_number, event_data, error or "不明なエラー")
+            return False
+        if note:
+            self._add_note(f"⚠️ {line_number}行目 **{event_data.get('summary') or 'N/A'}**\n　└ {_shorten(note)}")
+        return True
+
+    def _render(self) -> list[list[discord.Embed]]:
+        registered = self.success_count + self.duplicate_count
+        if not self.done:
+            if self.status_note:
+                title, color = f"⏸️ 取り込みを中断しました ({self.processed}件処理済み)", discord.Color.orange()
+            else:
+                title, color = f"📥 取り込み中… ({self.processed}件処理済み)", discord.Color.blue()
+        elif self.error_count == 0:
+            title, color = f"✅ 取り込み完了 ({registered}件)", discord.Color.green()
+        elif registered == 0:
+            title, color = f"❌ 取り込みエラー ({self.error_count}件)", discord.Color.red()
+        else:
+            title, color = f"⚠️ {registered}件取り込み、{self.error_count}件失敗しました", discord.Color.orange()
+
+        lines = [f"📄 `{self.filename}`"]
+        if self.resumed_from:
+            lines.append(f"（{self.resumed_from}件目の続きから再開しました。件数は再開後の分です）")
+        lines.append(f"✅ 登録 {self.success_count}件　♻️ 登録済み {self.duplicate_count}件　❌ 失敗 {self.error_count}件")
+        if self.status_note:
+            lines.append(self.status_note)
+        lines.extend(self._notes)
+        if self._omitted_notes:
+            lines.append(f"…ほか{self._omitted_notes}件")
+        return pack_lines(title, lines, color)
@@ -0,0 +1,130 @@
+# rate_limiter.py
+import os
+import threading
+import time
+
+
+def parse_rate(spec: str) -> tuple[float, float]:
+    """「容量/秒数」形式の設定を (容量, 1秒あたりの補充量) に変換する。例: "3/180" """
+    capacity, seconds = spec.split("/")
+    capacity, seconds = float(capacity), float(seconds)
+    return capacity, capacity / seconds
+
+
+class TokenBucket:
+    """トークンバケット。時刻はスナップショットから復元できるようUNIX秒で持つ"""
+
+    __slots__ = ("capacity", "refill_rate", "tokens", "updated_at")
+
+    def __init__(self, capacity: float, refill_rate: float, tokens: float | None = None, updated_at: float | None = None):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity if tokens is None else tokens
+        self.updated_at = updated_at or time.time()
+
+    def _refill(self, now: float):
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+            self.updated_at = now
+
+    def available(self, now: float) -> float:
+        self._refill(now)
+        return self.tokens
+
+    def retry_after(self, cost: float, now: float) -> float:
+        """cost 分のトークンが貯まるまでの秒数"""
+        self._refill(now)
+        if self.tokens >= cost:
+            return 0.0
+        if cost > self.capacity or self.refill_rate <= 0:
+            return float("inf")
+        return (cost - self.tokens) / self.refill_rate
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """ユーザーごと + 全体のトークンバケットで呼び出し回数を制限する"""
+
+    def __init__(self, name: str, per_user: str, global_: str):
+        self.name = name
+        self.user_capacity, self.user_rate = parse_rate(per_user)
+        self.global_bucket = TokenBucket(*parse_rate(global_))
+        self._buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _user_bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.user_capacity, self.user_rate)
+        return bucket
+
+    def acquire(self, key: str, cost: float = 1) -> tuple[bool, float]:
+        """
+        ユーザーと全体の両方に余裕があればトークンを消費する。
+        戻り値: (許可されたか, 許可されなかった場合の待ち秒数)
+        """
+        now = time.time()
+        with self._lock:
+            user_bucket = self._user_bucket(key)
+            wait = max(user_bucket.retry_after(cost, now), self.global_bucket.retry_after(cost, now))
+            if wait > 0:
+                return False, wait
+            user_bucket.tokens -= cost
+            self.global_bucket.tokens -= cost
+            return True, 0.0
+
+    def refund(self, key: str, cost: float = 1):
+        """acquire で消費したトークンを返す (処理を受け付けなかった場合など)"""
+        now = time.time()
+        with self._lock:
+            for bucket in (self._user_bucket(key), self.global_bucket):
+                bucket._refill(now)
+                bucket.tokens = min(bucket.capacity, bucket.tokens + cost)
+
+    def snapshot(self) -> list[tuple[str, float, float]]:
+        """満タンでないバケットの (キー, トークン数, 更新時刻) を返す。満タンのものはメモリからも捨てる"""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, b in self._buckets.items() if b.is_full(now)]:
+                del self._buckets[key]
+            rows = [(key, b.tokens, b.updated_at) for key, b in self._buckets.items()]
+            if not self.global_bucket.is_full(now):
+                rows.append(("*", self.global_bucket.tokens, self.global_bucket.updated_at))
+            return rows
+
+    def restore(self, rows: list[tuple[str, float, float]]):
+        """snapshot() の結果から状態を復元する"""
+        with self._lock:
+            for key, tokens, updated_at in rows:
+                if key == "*":
+                    self.global_bucket.tokens = tokens
+                    self.global_bucket.updated_at = updated_at
+                else:
+                    self._buckets[key] = TokenBucket(self.user_capacity, self.user_rate, tokens, updated_at)
+
+
+# Gemini呼び出し: 既定はユーザーごとに最大3回まで連続可、平均1分に1回
+gemini_limiter = RateLimiter(
+    "gemini",
+    per_user=os.getenv("RATE_LIMIT_GEMINI_PER_USER", "3/180"),
+    global_=os.getenv("RATE_LIMIT_GEMINI_GLOBAL", "60/60"),
+)
+
+# カレンダー登録: 1件ごとに1トークン
+calendar_limiter = RateLimiter(
+    "calendar",
+    per_user=os.getenv("RATE_LIMIT_CALENDAR_PER_USER", "100/600"),
+    global_=os.getenv("RATE_LIMIT_CALENDAR_GLOBAL", "500/60"),
+)
+
+# ファイルからの取り込み: 1件ごとに1トークン。足りない間は待ってから続きを登録する
+import_limiter = RateLimiter(
+    "import",
+    per_user=os.getenv("RATE_LIMIT_IMPORT_PER_USER", "5000/3600"),
+    global_=os.getenv("RATE_LIMIT_IMPORT_GLOBAL", "300/60"),
+)
+
+LIMITERS = (gemini_limiter, calendar_limiter, import_limiter)
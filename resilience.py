@@ -0,0 +1,218 @@
+# resilience.py
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+# 再試行の設定 (指数バックオフ + ジッター)
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "10"))
+
+# サーキットブレーカーの設定: 連続でこの回数失敗したら、一定時間呼び出しを止める
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# 一時的な障害とみなすHTTPステータス
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いていて呼び出しを止めている"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} は一時的に停止中です (約{int(retry_after) + 1}秒後に再開)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    連続した一時的な失敗を数え、しきい値を超えたら reset_timeout 秒のあいだ呼び出しを止める。
+    その後は1回だけ試し (half_open)、成功すれば再開、失敗すればまた止める。
+    Calendar API はスレッドプールから呼ばれるため、状態はロックで守る。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.opened_count = 0
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """呼び出してよいか確認する。止めている間は CircuitOpenError を送出する"""
+        with self._lock:
+            if self._state == self.OPEN:
+                wait = self._opened_at + self.reset_timeout - time.monotonic()
+                if wait > 0:
+                    raise CircuitOpenError(self.name, wait)
+                self._state = self.HALF_OPEN
+                self._probing = False
+            if self._state == self.HALF_OPEN:
+                if self._probing:
+                    # 試しの1回の結果が出るまでは止めておく
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logging.info(f"Circuit {self.name} closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED and self._failures >= self.failure_threshold):
+                logging.warning(f"Circuit {self.name} opened after {self._failures} consecutive failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self.opened_count += 1
+
+    def release(self):
+        """結果が出ないまま呼び出しが中断された場合に、試しの枠を返す"""
+        with self._lock:
+            self._probing = False
+
+    def snapshot(self) -> dict:
+        """状態・連続失敗回数・再開までの秒数"""
+        with self._lock:
+            retry_in = 0.0
+            if self._state == self.OPEN:
+                retry_in = max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+            return {
+                "state": self._state,
+                "failures": self._failures,
+                "retry_in": retry_in,
+                "opened_count": self.opened_count,
+            }
+
+
+# --- エラーの判定 ---
+
+def _status_of(error: Exception) -> int | None:
+    """google.api_core の例外 (code) と googleapiclient の HttpError (resp.status) からHTTPステータスを取り出す"""
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status is None:
+        status = getattr(error, "code", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient(error: BaseException) -> bool:
+    """再試行すれば成功する見込みのある一時的なエラーか"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    return _status_of(error) in TRANSIENT_STATUS
+
+
+def retry_after_hint(error: BaseException) -> float | None:
+    """エラーに含まれる再試行までの待ち時間 (Retry-After ヘッダーや RetryInfo) を返す"""
+    try:
+        resp = getattr(error, "resp", None)
+        if resp is not None and resp.get("retry-after"):
+            return float(resp["retry-after"])
+        for detail in getattr(error, "details", None) or []:
+            delay = getattr(detail, "retry_delay", None)
+            if delay is None:
+                continue
+            if hasattr(delay, "total_seconds"):
+                return delay.total_seconds()
+            return delay.seconds + delay.nanos / 1e9
+    except Exception:
+        pass
+    return None
+
+
+def backoff_delay(attempt: int, error: BaseException | None = None) -> float:
+    """attempt 回目の失敗後に待つ秒数。Retry-After があればそれに従う"""
+    hint = retry_after_hint(error) if error is not None else None
+    if hint is not None:
+        return hint + random.uniform(0, RETRY_BASE_DELAY)
+    # フルジッター: 同時に失敗した呼び出しが一斉に再試行しないようにする
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+# --- 呼び出し ---
+
+async def call_async(breaker: CircuitBreaker, func: Callable[[], Awaitable[T]], deadline: float, max_attempts: int = RETRY_MAX_ATTEMPTS) -> T:
+    """
+    func() を deadline 秒以内で呼び出す。一時的なエラーは待ち時間を空けて再試行する。
+    ブレーカーが開いている場合は呼び出さずに CircuitOpenError を送出する。
+    """
+    end = time.monotonic() + deadline
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = await asyncio.wait_for(func(), max(0.0, end - time.monotonic()))
+        except Exception as e:
+            if not is_transient(e):
+                # 応答は返っているので、相手側は正常とみなす
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            attempt += 1
+            delay = backoff_delay(attempt, e)
+            if attempt >= max_attempts or time.monotonic() + delay >= end:
+                raise
+            logging.warning(f"{breaker.name} call failed ({e}), retrying in {delay:.1f}s ({attempt}/{max_attempts})")
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record_success()
+        return result
+
+
+def call_sync(breaker: CircuitBreaker, func: Callable[[], T], deadline: float, max_attempts: int = RETRY_MAX_ATTEMPTS) -> T:
+    """call_async の同期版 (スレッドプール上で使う)。1回ごとのタイムアウトは呼び出し側の設定に任せる"""
+    end = time.monotonic() + deadline
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = func()
+        except Exception as e:
+            if not is_transient(e):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            attempt += 1
+            delay = backoff_delay(attempt, e)
+            if attempt >= max_attempts or time.monotonic() + delay >= end:
+                raise
+            logging.warning(f"{breaker.name} call failed ({e}), retrying in {delay:.1f}s ({attempt}/{max_attempts})")
+            time.sleep(delay)
+            continue
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record_success()
+        return result
+
+
+gemini_breaker = CircuitBreaker("gemini")
+calendar_breaker = CircuitBreaker("calendar")
+
+BREAKERS = (gemini_breaker, calendar_breaker)
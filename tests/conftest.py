@@ -0,0 +1,27 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# リポジトリ直下のモジュール (database.py など) を読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+
+@pytest.fixture
+def db_file(tmp_path, monkeypatch):
+    """テストごとに一時ディレクトリのDBを使う (常駐コネクションとキャッシュは後で捨てる)"""
+    db.close_db()
+    path = str(tmp_path / "data" / "bot.sqlite3")
+    monkeypatch.setattr(db, "DB_FILE", path)
+    yield path
+    db.close_db()
+
+
+@pytest.fixture
+def fresh_db(db_file):
+    """マイグレーションを適用済みの空のDB"""
+    db.init_db()
+    return db_file
@@ -0,0 +1,66 @@
+# tests/test_accept_message.py
+import asyncio
+import os
+
+import pytest
+
+import database as db
+import rate_limiter
+
+# main を読み込むのに必要な設定 (APIは呼ばない)
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ.setdefault("GOOGLE_SERVICE_ACCOUNT_FILE", "/nonexistent/service_account.json")
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, content: str = "明日10時 会議"):
+        self.id = message_id
+        self.content = content
+        self.attachments = []
+        self.replies = []
+
+    async def reply(self, text: str, **kwargs):
+        self.replies.append(text)
+
+
+@pytest.fixture
+def main(fresh_db, monkeypatch):
+    import main
+
+    monkeypatch.setattr(rate_limiter.gemini_limiter, "_buckets", {})
+    monkeypatch.setattr(main.job_pool, "notify", lambda: None)
+    monkeypatch.setattr(main.job_pool, "idle_count", lambda: 1)
+    return main
+
+
+def _tokens(discord_id: str) -> float:
+    return rate_limiter.gemini_limiter._user_bucket(discord_id).tokens
+
+
+def test_accepted_message_uses_quota(main):
+    db.save_calendar_id("u1", "calendar@example.com")
+    db.set_user_state("u1", "waiting_for_details")
+    before = _tokens("u1")
+
+    asyncio.run(main._accept_message(FakeMessage(1), "u1"))
+
+    assert _tokens("u1") == pytest.approx(before - 1, abs=0.01)
+    assert db._get_conn().execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 1
+
+
+def test_quota_is_refunded_when_no_job_is_saved(main, monkeypatch):
+    db.save_calendar_id("u1", "calendar@example.com")
+    before = _tokens("u1")
+
+    # 待機状態が別のメッセージに先に使われていた
+    asyncio.run(main._accept_message(FakeMessage(1), "u1"))
+    assert _tokens("u1") == pytest.approx(before, abs=0.01)
+
+    # 処理待ちが上限に達している
+    db.set_user_state("u1", "waiting_for_details")
+    monkeypatch.setattr(main, "JOB_MAX_QUEUE", 0)
+    message = FakeMessage(2)
+    asyncio.run(main._accept_message(message, "u1"))
+    assert _tokens("u1") == pytest.approx(before, abs=0.01)
+    assert "混み合っています" in message.replies[0]
+    assert db._get_conn().execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
@@ -0,0 +1,32 @@
+# tests/test_calendar_pool.py
+import asyncio
+import threading
+
+import pytest
+
+import google_calendar as gcal
+
+
+def test_timed_out_call_keeps_its_slot_until_the_thread_finishes(monkeypatch):
+    monkeypatch.setattr(gcal, "_calendar_slots", asyncio.Semaphore(1))
+    release = threading.Event()
+
+    def blocking_call():
+        release.wait(5)
+        raise RuntimeError("Google API Error")
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await gcal._run_in_pool(blocking_call, timeout=0.05)
+
+        # 打ち切った後もスレッドでは呼び出しが続いているので、枠は空かない
+        assert gcal._calendar_slots.locked()
+        assert gcal.pending_calls() == 1
+
+        release.set()
+        # 呼び出しが終われば、次の呼び出しが枠を使える
+        assert await asyncio.wait_for(gcal._run_in_pool(lambda: "ok"), 1) == "ok"
+        assert not gcal._calendar_slots.locked()
+        assert gcal.pending_calls() == 0
+
+    asyncio.run(scenario())
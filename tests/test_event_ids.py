@@ -0,0 +1,84 @@
+# tests/test_event_ids.py
+import asyncio
+
+import database as db
+import google_calendar as gcal
+
+CALENDAR = "calendar@example.com"
+EVENT = {"summary": "定例会議", "location": "会議室A", "start_date": "2025-03-01", "start_time": "10:00:00", "end_time": "11:00:00", "end_date": "2025-03-01"}
+
+
+def _event_id(details: dict, calendar_id: str = CALENDAR) -> str:
+    body, error = gcal._build_event_body(details)
+    assert error is None
+    return gcal.event_id_for(body, calendar_id)
+
+
+def test_event_id_is_stable_across_notation_differences():
+    event_id = _event_id(EVENT)
+    same = {**EVENT, "summary": "　定例会議 ", "location": "会議室Ａ", "start_time": "10:00", "end_time": "11:00", "description": ""}
+
+    assert _event_id(same) == event_id
+    assert gcal.is_bot_event_id(event_id)
+    # Calendar API のIDに使える文字 (0-9, a-v) だけで作られる
+    assert set(event_id) <= set("0123456789abcdefghijklmnopqrstuv")
+
+
+def test_event_id_depends_on_content_and_calendar():
+    event_id = _event_id(EVENT)
+    assert _event_id({**EVENT, "summary": "別の会議"}) != event_id
+    assert _event_id({**EVENT, "start_time": "10:30:00"}) != event_id
+    assert _event_id(EVENT, "other@example.com") != event_id
+
+
+def test_is_bot_event_id_rejects_other_ids():
+    assert not gcal.is_bot_event_id("")
+    assert not gcal.is_bot_event_id("7kvq0sb2l4n0c5kq1v6a8m4f5g")
+    assert not gcal.is_bot_event_id("F" * 64)
+    assert not gcal.is_bot_event_id("a" * 63)
+
+
+def test_ledger_skips_known_and_repeated_events(fresh_db):
+    inserted = []
+
+    async def insert(events):
+        inserted.append(events)
+        return [({"id": _event_id(event), "htmlLink": f"https://example.com/{event['summary']}"}, None) for event in events]
+
+    other = {**EVENT, "summary": "別の会議"}
+    first = asyncio.run(gcal._with_ledger([EVENT, EVENT, other], CALENDAR, insert))
+
+    # 同じ依頼の中の重複は1件だけ登録する
+    assert inserted == [[EVENT, other]]
+    assert [result[0].get("duplicate", False) for result in first] == [False, True, False]
+    assert first[1][0]["htmlLink"] == "https://example.com/定例会議"
+
+    # 台帳に記録済みの予定は API を呼ばない
+    second = asyncio.run(gcal._with_ledger([EVENT, {**EVENT, "summary": "新しい会議"}], CALENDAR, insert))
+    assert inserted[1] == [{**EVENT, "summary": "新しい会議"}]
+    assert second[0] == ({"id": _event_id(EVENT), "htmlLink": "https://example.com/定例会議", "duplicate": True}, None)
+
+
+def test_ledger_does_not_record_failures(fresh_db):
+    async def failing(events):
+        return [(None, "Google API Error")] * len(events)
+
+    assert asyncio.run(gcal._with_ledger([EVENT, EVENT], CALENDAR, failing)) == [(None, "Google API Error")] * 2
+    assert db.get_ledger_entries(CALENDAR, [_event_id(EVENT)]) == {}
+
+
+def test_overlaps_skip_all_day_events_and_own_copy_before_limit(fresh_db):
+    own_id = _event_id(EVENT)
+    start = int(gcal.datetime.datetime(2025, 3, 1, 10, tzinfo=gcal.CALENDAR_TIMEZONE).timestamp())
+    all_day = [(f"allday{i}", f"終日 {i}", None, None, start - 36000, start + 50400, 1) for i in range(4)]
+    rows = [
+        *all_day,
+        # 登録済みの同じ予定 (重なりとしては扱わない)
+        (own_id, "定例会議", "会議室A", None, start, start + 3600, 0),
+        ("other", "打ち合わせ", None, None, start + 1800, start + 5400, 0),
+    ]
+    db.apply_mirror_changes(CALENDAR, rows, [])
+
+    [found] = asyncio.run(gcal.afind_overlaps([EVENT], CALENDAR))
+    assert [event["id"] for event in found] == ["other"]
+    assert asyncio.run(gcal.afind_overlaps([EVENT], CALENDAR, [own_id])) == [found]
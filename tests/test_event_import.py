@@ -0,0 +1,215 @@
+# tests/test_event_import.py
+import io
+from datetime import timedelta, timezone
+
+import event_import
+
+JST = timezone(timedelta(hours=9))
+
+
+def _ics(*lines: str) -> io.StringIO:
+    return io.StringIO("\r\n".join(lines) + "\r\n")
+
+
+def _read_ics(*lines: str) -> list:
+    return list(event_import.iter_ics_events(_ics(*lines), JST))
+
+
+def _read_csv(text: str) -> list:
+    return list(event_import.iter_csv_events(io.StringIO(text, newline=""), JST))
+
+
+# --- iCalendar (.ics) ---
+
+def test_ics_timed_event_with_folding_and_escapes():
+    records = _read_ics(
+        "BEGIN:VCALENDAR",
+        "BEGIN:VEVENT",
+        "SUMMARY:定例会議\\, 第1回",
+        "DTSTART:20250301T010000Z",
+        "DTEND;TZID=Asia/Tokyo:20250301T113000",
+        "LOCATION:会議室A",
+        "DESCRIPTION:1行目\\n2行目が長いので途中で",
+        " 折り返されています",
+        "END:VEVENT",
+        "END:VCALENDAR",
+    )
+
+    assert records == [(2, {
+        "summary": "定例会議, 第1回",
+        "location": "会議室A",
+        "description": "1行目\n2行目が長いので途中で折り返されています",
+        "start_date": "2025-03-01", "start_time": "10:00:00",
+        "end_date": "2025-03-01", "end_time": "11:30:00",
+    }, None)]
+
+
+def test_ics_converts_other_timezones_and_duration():
+    (_, event, _), = _read_ics(
+        "BEGIN:VEVENT",
+        "SUMMARY:NY",
+        'DTSTART;TZID="America/New_York":20250301T090000',
+        "DURATION:PT1H30M",
+        "END:VEVENT",
+    )
+    assert (event["start_date"], event["start_time"]) == ("2025-03-01", "23:00:00")
+    assert (event["end_date"], event["end_time"]) == ("2025-03-02", "00:30:00")
+
+
+def test_ics_unknown_timezone_falls_back_to_default():
+    (_, event, _), = _read_ics(
+        "BEGIN:VEVENT",
+        "DTSTART;TZID=Tokyo Standard Time:20250301T090000",
+        "END:VEVENT",
+    )
+    assert (event["start_time"], event["end_time"]) == ("09:00:00", "09:00:00")
+
+
+def test_ics_all_day_event_defaults_to_one_day():
+    (_, event, _), = _read_ics(
+        "BEGIN:VEVENT",
+        "SUMMARY:出張",
+        "DTSTART;VALUE=DATE:20250301",
+        "END:VEVENT",
+    )
+    assert event["start_date"] == "2025-03-01"
+    assert event["end_date"] == "2025-03-02"
+    assert event["start_time"] is None and event["end_time"] is None
+
+
+def test_ics_skips_alarms_and_cancelled_events_and_notes_rrule():
+    records = _read_ics(
+        "BEGIN:VEVENT",
+        "SUMMARY:毎週の会議",
+        "DTSTART:20250301T010000Z",
+        "RRULE:FREQ=WEEKLY",
+        "BEGIN:VALARM",
+        "DESCRIPTION:リマインダー",
+        "TRIGGER:-PT10M",
+        "END:VALARM",
+        "END:VEVENT",
+        "BEGIN:VEVENT",
+        "SUMMARY:中止",
+        "STATUS:CANCELLED",
+        "DTSTART:20250302T010000Z",
+        "END:VEVENT",
+    )
+
+    assert len(records) == 1
+    line, event, note = records[0]
+    assert line == 1
+    assert event["summary"] == "毎週の会議"
+    assert event["description"] is None
+    assert note == "繰り返し予定は最初の1回だけ登録しました"
+
+
+def test_ics_reports_malformed_events_and_continues():
+    records = _read_ics(
+        "BEGIN:VCALENDAR",
+        "BEGIN:VEVENT",
+        "SUMMARY:開始なし",
+        "END:VEVENT",
+        "BEGIN:VEVENT",
+        "DTSTART:2025-03-01",
+        "END:VEVENT",
+        "BEGIN:VEVENT",
+        "DTSTART:20250301T100000",
+        "DURATION:1 hour",
+        "END:VEVENT",
+        "this line has no colon",
+        "BEGIN:VEVENT",
+        "SUMMARY:正常",
+        "DTSTART:20250301T100000",
+        "END:VEVENT",
+        "BEGIN:VEVENT",
+        "SUMMARY:閉じていない",
+        "DTSTART:20250301T100000",
+    )
+
+    assert [(line, event is None) for line, event, _ in records] == [(2, True), (5, True), (8, True), (13, False)]
+    assert records[0][2] == "DTSTART がありません"
+    assert records[2][2].startswith("DURATION の形式が不正です")
+    assert records[3][1]["summary"] == "正常"
+
+
+def test_ics_truncates_long_fields():
+    (_, event, _), = _read_ics(
+        "BEGIN:VEVENT",
+        "SUMMARY:" + "あ" * (event_import.SUMMARY_LIMIT + 10),
+        "DTSTART;VALUE=DATE:20250301",
+        "END:VEVENT",
+    )
+    assert len(event["summary"]) == event_import.SUMMARY_LIMIT
+
+
+# --- CSV ---
+
+def test_csv_google_format():
+    records = _read_csv(
+        "Subject,Start Date,Start Time,End Date,End Time,All Day Event,Description,Location\r\n"
+        "会議,03/01/2025,10:00 AM,03/01/2025,11:30 AM,False,\"議題\r\n2行目\",会議室\r\n"
+        "出張,2025/03/02,,2025/03/04,,True,,\r\n"
+    )
+
+    assert records[0] == (2, {
+        "summary": "会議", "location": "会議室", "description": "議題\r\n2行目",
+        "start_date": "2025-03-01", "start_time": "10:00:00",
+        "end_date": "2025-03-01", "end_time": "11:30:00",
+    }, None)
+    # 引用符内の改行があっても、次の行番号はファイル上の行に合わせる
+    line, event, _ = records[1]
+    assert line == 4
+    # 終日の終了日は最終日 (含む) なので、Calendar API の形式 (翌日) に直す
+    assert (event["start_date"], event["end_date"], event["start_time"]) == ("2025-03-02", "2025-03-05", None)
+
+
+def test_csv_japanese_headers_and_combined_datetime():
+    (_, event, _), = _read_csv(
+        "タイトル,開始日時,終了日時,場所\n"
+        "打ち合わせ,2025-03-01 14:00,2025-03-01T15:00,オンライン\n"
+    )
+    assert (event["summary"], event["location"]) == ("打ち合わせ", "オンライン")
+    assert (event["start_date"], event["start_time"], event["end_time"]) == ("2025-03-01", "14:00:00", "15:00:00")
+
+
+def test_csv_reports_malformed_rows_and_continues():
+    records = _read_csv(
+        "件名,開始日,開始時刻,終了時刻\n"
+        "日付なし,,10:00,\n"
+        "不正な日付,2025-13-01,10:00,\n"
+        "不正な時刻,2025-03-01,25時,\n"
+        ",,,\n"
+        "短い行,2025-03-01\n"
+        "正常,2025-03-01,10:00,11:00\n"
+    )
+
+    assert [(line, event is None) for line, event, _ in records] == [
+        (2, True), (3, True), (4, True), (6, False), (7, False),
+    ]
+    assert records[0][2] == "開始日がありません"
+    assert records[1][2].startswith("日付の形式が不正です")
+    assert records[2][2].startswith("時刻の形式が不正です")
+    # 時刻のない行は終日の予定になる
+    assert records[3][1]["start_time"] is None
+    assert records[4][1]["end_time"] == "11:00:00"
+
+
+def test_csv_without_start_column():
+    assert _read_csv("件名,場所\n会議,会議室\n") == [(1, None, "開始日の列が見つかりません (Start Date / 開始日 など)")]
+    assert _read_csv("") == []
+
+
+# --- 文字コード ---
+
+def test_open_text_detects_utf8_bom_and_cp932():
+    header = "件名,開始日\r\n会議,2025-03-01\r\n"
+    for raw in (b"\xef\xbb\xbf" + header.encode("utf-8"), header.encode("cp932")):
+        text = event_import.open_text(io.BytesIO(raw))
+        (_, event, _), = event_import.iter_file_events("予定.csv", text, JST)
+        assert event["summary"] == "会議"
+
+
+def test_supported_extensions():
+    assert event_import.is_supported("Calendar.ICS")
+    assert event_import.is_supported("予定.csv")
+    assert not event_import.is_supported("memo.txt")
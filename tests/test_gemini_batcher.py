@@ -0,0 +1,57 @@
+# tests/test_gemini_batcher.py
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+# gemini_handler を読み込むのに必要な設定 (APIは呼ばない)
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+import gemini_handler
+
+EVENT = {"summary": "会議", "start_date": "2025-03-01", "start_time": "10:00:00"}
+
+
+def _run_batch(monkeypatch, response: list) -> tuple[list, list[str]]:
+    individual = []
+
+    async def generate(prompt, **kwargs):
+        return SimpleNamespace(text=json.dumps(response, ensure_ascii=False))
+
+    async def parse_with_gemini(text, today):
+        individual.append(text)
+        return [EVENT], None
+
+    monkeypatch.setattr(gemini_handler, "_generate", generate)
+    monkeypatch.setattr(gemini_handler, "_parse_with_gemini", parse_with_gemini)
+
+    async def scenario():
+        batcher = gemini_handler._GeminiBatcher(10, 10)
+        results = await asyncio.gather(*(batcher.submit(text, "2025-03-01") for text in ("a", "b", "c")))
+        return results, batcher
+
+    results, batcher = asyncio.run(scenario())
+    assert batcher.fallbacks == len(individual)
+    return results, individual
+
+
+def test_batch_results_are_used_including_empty_ones(monkeypatch):
+    results, individual = _run_batch(monkeypatch, [
+        {"id": "0", "events": [EVENT]},
+        {"id": "1", "events": []},
+        {"id": "2", "events": [EVENT, EVENT]},
+    ])
+
+    # 予定が0件の入力も個別に解析し直さない
+    assert individual == []
+    assert results == [([EVENT], None), ([], None), ([EVENT, EVENT], None)]
+
+
+def test_missing_or_invalid_results_fall_back_to_individual_calls(monkeypatch):
+    results, individual = _run_batch(monkeypatch, [
+        {"id": "0", "events": [{"summary": ""}]},
+        {"id": "2", "events": []},
+    ])
+
+    assert individual == ["a", "b"]
+    assert results == [([EVENT], None), ([EVENT], None), ([], None)]
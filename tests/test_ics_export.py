@@ -0,0 +1,158 @@
+# tests/test_ics_export.py
+import asyncio
+import io
+from datetime import timedelta, timezone
+
+import pytest
+
+import event_import
+import ics_export
+
+JST = timezone(timedelta(hours=9))
+
+
+def _physical_lines(folded: str) -> list[bytes]:
+    assert folded.endswith(ics_export.CRLF)
+    return folded.encode("utf-8")[:-2].split(b"\r\n")
+
+
+def _unfold(folded: str) -> str:
+    return folded[:-2].replace(ics_export.CRLF + " ", "")
+
+
+def test_fold_keeps_short_lines():
+    line = "SUMMARY:" + "a" * (ics_export.LINE_LIMIT - len("SUMMARY:"))
+    assert ics_export._fold(line) == line + "\r\n"
+
+
+def test_fold_splits_ascii_at_75_octets():
+    line = "DESCRIPTION:" + "x" * 300
+    folded = ics_export._fold(line)
+    lines = _physical_lines(folded)
+
+    assert len(lines[0]) == 75
+    assert all(len(part) <= 75 for part in lines)
+    assert all(part.startswith(b" ") for part in lines[1:])
+    assert _unfold(folded) == line
+
+
+def test_fold_does_not_split_multibyte_characters():
+    # 3バイト文字と4バイト文字 (絵文字) が境界をまたぐようにする
+    line = "SUMMARY:" + "会議🗓️" * 40 + "a"
+    folded = ics_export._fold(line)
+    lines = _physical_lines(folded)
+
+    assert len(lines) > 1
+    for part in lines:
+        assert len(part) <= 75
+        part.decode("utf-8")  # 文字の途中で切れていれば失敗する
+    assert _unfold(folded) == line
+
+
+def test_escape_text_values():
+    assert ics_export._escape("a,b;c\\d\r\ne\nf") == "a\\,b\\;c\\\\d\\ne\\nf"
+
+
+def _event(number: int, **overrides) -> dict:
+    return {
+        "id": f"{number:064x}",
+        "summary": f"会議 {number}, 定例",
+        "description": "1行目\n2行目" + "あ" * 50,
+        "location": "会議室",
+        "start": {"dateTime": "2025-03-01T10:00:00+09:00"},
+        "end": {"dateTime": "2025-03-01T11:00:00+09:00"},
+        "htmlLink": f"https://calendar.google.com/event?eid={number}",
+        **overrides,
+    }
+
+
+def test_iter_vevent_formats_times_and_skips_events_without_start():
+    stamp = "20250101T000000Z"
+    lines = list(ics_export.iter_vevent(_event(1), stamp))
+    assert "DTSTART:20250301T010000Z\r\n" in lines
+    assert "DTEND:20250301T020000Z\r\n" in lines
+    assert _unfold(lines[1]) == f"UID:{1:064x}@google.com"
+
+    all_day = list(ics_export.iter_vevent(_event(2, start={"date": "2025-03-01"}, end={"date": "2025-03-02"}), stamp))
+    assert "DTSTART;VALUE=DATE:20250301\r\n" in all_day
+
+    assert list(ics_export.iter_vevent(_event(3, start={}), stamp)) == []
+
+
+async def _collect(events: list[dict], max_bytes: int) -> list[tuple[bytes, int]]:
+    async def source():
+        for event in events:
+            yield event
+
+    files = []
+    async for file, count in ics_export.aiter_ics_files(source(), "テスト", max_bytes):
+        with file:
+            files.append((file.read(), count))
+    return files
+
+
+def test_aiter_ics_files_splits_into_standalone_files():
+    events = [_event(i) for i in range(40)]
+    files = asyncio.run(_collect(events, 4000))
+
+    assert len(files) > 1
+    assert sum(count for _, count in files) == len(events)
+
+    imported = []
+    for data, count in files:
+        assert len(data) <= 4000
+        assert data.startswith(b"BEGIN:VCALENDAR\r\n") and data.endswith(b"END:VCALENDAR\r\n")
+        assert all(len(line) <= 75 for line in data.split(b"\r\n"))
+        records = list(event_import.iter_ics_events(io.StringIO(data.decode("utf-8"), newline=""), JST))
+        assert len(records) == count
+        imported.extend(event for _, event, _ in records)
+
+    # 書き出した予定は取り込みで同じ内容に戻る
+    assert imported[0] == {
+        "summary": "会議 0, 定例", "location": "会議室", "description": "1行目\n2行目" + "あ" * 50,
+        "start_date": "2025-03-01", "start_time": "10:00:00",
+        "end_date": "2025-03-01", "end_time": "11:00:00",
+    }
+    assert [event["summary"] for event in imported] == [f"会議 {i}, 定例" for i in range(40)]
+
+
+def test_aiter_ics_files_without_events():
+    assert asyncio.run(_collect([], 4000)) == []
+    assert asyncio.run(_collect([_event(1, start={})], 4000)) == []
+
+
+def test_aiter_ics_files_closes_unfinished_file(monkeypatch):
+    opened = []
+    temporary_file = ics_export.tempfile.TemporaryFile
+
+    def tracking_file():
+        opened.append(temporary_file())
+        return opened[-1]
+
+    monkeypatch.setattr(ics_export.tempfile, "TemporaryFile", tracking_file)
+
+    async def failing_source():
+        yield _event(1)
+        raise RuntimeError("Calendar API Error")
+
+    async def failing():
+        async for file, _ in ics_export.aiter_ics_files(failing_source(), "テスト", 4000):
+            file.close()
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(failing())
+    assert len(opened) == 1 and opened[0].closed
+
+    # 予定の取得を待っている間に打ち切られた場合 (/export のタイムアウトなど) も閉じる
+    async def slow_source():
+        yield _event(1)
+        await asyncio.sleep(10)
+
+    async def timed_out():
+        async for file, _ in ics_export.aiter_ics_files(slow_source(), "テスト", 4000):
+            file.close()
+
+    opened.clear()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(timed_out(), 0.05))
+    assert len(opened) == 1 and opened[0].closed
@@ -0,0 +1,123 @@
+# tests/test_job_queue.py
+import pytest
+
+import database as db
+
+
+def _enqueue(discord_id: str, content: str = "明日10時 会議", max_queue: int = 100):
+    db.set_user_state(discord_id, "waiting_for_details")
+    return db.enqueue_job(discord_id, "1", "calendar@example.com", content, max_queue)
+
+
+def _claim_all(lease_seconds: float = 60) -> list[str]:
+    order = []
+    while True:
+        job, _, _ = db.claim_job(lease_seconds)
+        if job is None:
+            return order
+        order.append(f"{job['discord_id']}:{job['content']}")
+
+
+def test_enqueue_clears_waiting_state(fresh_db):
+    job_id, position = _enqueue("u1")
+    assert job_id > 0
+    assert position == 1
+    assert db.get_user_state("u1") is None
+
+
+def test_enqueue_requires_waiting_state(fresh_db):
+    assert db.enqueue_job("u1", "1", "calendar@example.com", "予定", 100) is None
+
+    # 同時に届いた2通目は、1通目が状態を消した後なので保存されない
+    assert _enqueue("u1")
+    assert db.enqueue_job("u1", "2", "calendar@example.com", "予定", 100) is None
+    assert db._get_conn().execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 1
+
+
+def test_enqueue_rejects_when_queue_is_full(fresh_db):
+    assert _enqueue("u1", max_queue=1)
+    with pytest.raises(db.QueueFullError):
+        _enqueue("u2", max_queue=1)
+    # 受け付けなかったユーザーは待機状態のまま
+    assert db.get_user_state("u2") == "waiting_for_details"
+
+
+def test_claim_job_round_robin_between_users(fresh_db):
+    for content in ("a1", "a2", "a3"):
+        _enqueue("a", content)
+    _enqueue("b", "b1")
+    _enqueue("c", "c1")
+
+    # 先に3件送ったユーザーがいても、他のユーザーの1件目を先に処理する
+    assert _claim_all() == ["a:a1", "b:b1", "c:c1", "a:a2", "a:a3"]
+
+
+def test_claim_job_prefers_users_without_running_jobs(fresh_db):
+    _enqueue("a", "a1")
+    _enqueue("a", "a2")
+    job, _, _ = db.claim_job(60)
+    assert job["content"] == "a1"
+
+    _enqueue("b", "b1")
+    assert _claim_all() == ["b:b1", "a:a2"]
+
+
+def test_claim_job_skips_leased_and_deferred_jobs(fresh_db):
+    _enqueue("a", "a1")
+    job, pending, _ = db.claim_job(60)
+    assert job["attempts"] == 1
+    assert pending == 0
+
+    # リース中のジョブは他のワーカーが取り出さない
+    assert db.claim_job(60)[0] is None
+
+    db.defer_job(job["id"], 30)
+    job, _, next_at = db.claim_job(60)
+    assert job is None
+    assert next_at is not None
+
+
+def test_claim_job_reclaims_expired_lease(fresh_db):
+    _enqueue("a", "a1")
+    job, _, _ = db.claim_job(-1)
+
+    # 処理中に停止した (リースが切れた) ジョブはもう一度取り出される
+    reclaimed, _, _ = db.claim_job(60)
+    assert reclaimed["id"] == job["id"]
+    assert reclaimed["attempts"] == 2
+
+
+def test_reset_job_leases_on_startup(fresh_db):
+    _enqueue("a", "a1")
+    job, _, _ = db.claim_job(60)
+
+    assert db.reset_job_leases() == 1
+    reclaimed, _, _ = db.claim_job(60)
+    assert reclaimed["id"] == job["id"]
+
+
+def test_defer_job_counts_only_outage_deferrals(fresh_db):
+    _enqueue("a", "a1")
+    job, _, _ = db.claim_job(60)
+
+    db.defer_job(job["id"], -1, count=False)
+    job, _, _ = db.claim_job(60)
+    assert job["defers"] == 0
+    assert job["attempts"] == 1
+
+    db.defer_job(job["id"], -1)
+    job, _, _ = db.claim_job(60)
+    assert job["defers"] == 1
+
+
+def test_finish_and_fail_job(fresh_db):
+    _enqueue("a", "a1")
+    _enqueue("b", "b1")
+    first, _, _ = db.claim_job(60)
+    second, _, _ = db.claim_job(60)
+
+    db.finish_job(first["id"])
+    db.fail_job(second["id"], "boom")
+    rows = db._get_conn().execute("SELECT id, status, error FROM jobs").fetchall()
+    assert rows == [(second["id"], "failed", "boom")]
+    assert db.claim_job(60)[0] is None
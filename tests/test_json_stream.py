@@ -0,0 +1,70 @@
+# tests/test_json_stream.py
+import json
+
+import pytest
+
+from json_stream import JsonArrayStream
+
+EVENTS = [
+    {"summary": "会議 {定例}", "start_date": "2025-03-01", "start_time": "10:00"},
+    {"summary": 'エスケープ \\ と "引用符" と ] [', "location": None, "tags": [1, [2, 3]]},
+    {"summary": "出張", "start_date": "2025-03-02", "start_time": None},
+]
+
+
+def _feed_all(stream: JsonArrayStream, text: str, size: int) -> list:
+    items = []
+    for offset in range(0, len(text), size):
+        items.extend(stream.feed(text[offset:offset + size]))
+    return items
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_elements_are_returned_as_soon_as_they_close(size):
+    text = "```json\n" + json.dumps(EVENTS, ensure_ascii=False, indent=2) + "\n```"
+    stream = JsonArrayStream()
+
+    assert _feed_all(stream, text, size) == EVENTS
+    assert stream.done
+    assert stream.text == text
+
+
+def test_first_element_is_available_before_the_array_closes():
+    text = json.dumps(EVENTS, ensure_ascii=False)
+    first_end = text.index("}, {") + 1
+    stream = JsonArrayStream()
+
+    assert stream.feed(text[:first_end]) == [EVENTS[0]]
+    assert not stream.done
+    assert stream.feed(text[first_end:]) == EVENTS[1:]
+
+
+def test_leading_prose_and_trailing_text_are_ignored():
+    stream = JsonArrayStream()
+    items = stream.feed('予定は次のとおりです: [{"summary": "a"}] 以上です。[{"summary": "b"}]')
+    assert items == [{"summary": "a"}]
+    assert stream.done
+
+
+def test_top_level_object_is_one_element():
+    stream = JsonArrayStream()
+    assert _feed_all(stream, '{"summary": "会議", "nested": {"a": [1]}} extra', 4) == [{"summary": "会議", "nested": {"a": [1]}}]
+    assert stream.done
+
+
+def test_empty_array():
+    stream = JsonArrayStream()
+    assert stream.feed("[ ]") == []
+    assert stream.done
+
+
+def test_incomplete_input_is_not_done():
+    stream = JsonArrayStream()
+    assert stream.feed('[{"summary": "a"}, {"summary": "b') == [{"summary": "a"}]
+    assert not stream.done
+
+
+def test_malformed_element_raises():
+    stream = JsonArrayStream()
+    with pytest.raises(json.JSONDecodeError):
+        stream.feed('[{"summary": "a",}]')
@@ -0,0 +1,141 @@
+# tests/test_migrations.py
+import os
+import sqlite3
+
+import pytest
+
+import database as db
+
+# バージョン管理を始める前 (最初のリリース) のスキーマ
+BASELINE_SCHEMA = """
+CREATE TABLE user_calendars (
+    discord_id TEXT PRIMARY KEY,
+    calendar_id TEXT NOT NULL
+);
+CREATE TABLE user_states (
+    discord_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE user_rate_limits (
+    discord_id TEXT PRIMARY KEY,
+    last_used DATETIME NOT NULL
+);
+CREATE TABLE bot_settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _create_db(path: str, script: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(script)
+    conn.commit()
+    conn.close()
+
+
+def _user_version() -> int:
+    return db._get_conn().execute("PRAGMA user_version").fetchone()[0]
+
+
+def _columns(table: str) -> list[str]:
+    return [row[1] for row in db._get_conn().execute(f"PRAGMA table_info({table})")]
+
+
+def _schema_sql(name: str) -> str | None:
+    row = db._get_conn().execute("SELECT sql FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def test_fresh_database_gets_latest_schema(db_file):
+    db.init_db()
+
+    assert _user_version() == len(db._MIGRATIONS)
+    assert db._get_conn().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert "updated_at" in _columns("user_states")
+    assert {"attachment_url", "attachment_name", "progress"} <= set(_columns("jobs"))
+
+
+def test_baseline_database_is_migrated(db_file):
+    _create_db(db_file, BASELINE_SCHEMA + """
+    INSERT INTO user_calendars VALUES ('u1', 'calendar@example.com');
+    INSERT INTO user_states VALUES ('u1', 'waiting_for_details', '2025-01-01 00:00:00');
+    INSERT INTO user_rate_limits VALUES ('u1', '2025-01-01 00:00:00');
+    INSERT INTO bot_settings VALUES ('error_webhook_url', 'https://example.com/hook');
+    """)
+
+    db.init_db()
+
+    assert _user_version() == len(db._MIGRATIONS)
+    # 文字列の時刻 (UTC) はUNIX秒に変換される
+    assert db.get_state_timestamps() == [("u1", 1735689600)]
+    assert db.get_user_state("u1") == "waiting_for_details"
+    assert db.get_calendar_id("u1") == "calendar@example.com"
+    assert db.get_setting("error_webhook_url") == "https://example.com/hook"
+
+    assert "timestamp" not in _columns("user_states")
+    assert "WITHOUT ROWID" in _schema_sql("user_states")
+    assert "WITHOUT ROWID" in _schema_sql("user_calendars")
+    assert _schema_sql("user_rate_limits") is None
+    for index in ("idx_user_states_updated_at", "idx_event_ledger_created_at",
+                  "idx_calendar_mirror_end_at", "idx_jobs_status_created_at"):
+        assert _schema_sql(index) is not None, index
+
+
+def test_unversioned_database_keeps_queued_jobs(db_file):
+    # バージョン管理の前に作られた jobs テーブルには添付ファイルの列がない
+    os.makedirs(os.path.dirname(db_file), exist_ok=True)
+    conn = sqlite3.connect(db_file)
+    db._migrate_base_schema(conn.cursor())
+    conn.execute("""
+    INSERT INTO jobs (discord_id, message_id, calendar_id, content, status, run_after, created_at)
+    VALUES ('u1', '1', 'calendar@example.com', '明日10時 会議', 'queued', 0, 0)
+    """)
+    conn.commit()
+    conn.close()
+
+    db.init_db()
+
+    job, _, _ = db.claim_job(60)
+    assert job["content"] == "明日10時 会議"
+    assert job["attachment_url"] is None
+    assert job["progress"] == 0
+
+
+def test_init_db_is_idempotent(db_file):
+    db.init_db()
+    db.set_user_state("u1", "waiting_for_details")
+
+    db.close_db()
+    db.init_db()
+
+    assert _user_version() == len(db._MIGRATIONS)
+    assert db.get_user_state("u1") == "waiting_for_details"
+
+
+def test_failed_migration_is_rolled_back(db_file, monkeypatch):
+    db.init_db()
+    version = _user_version()
+
+    def broken(cursor: sqlite3.Cursor):
+        cursor.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(db, "_MIGRATIONS", [*db._MIGRATIONS, broken])
+    with pytest.raises(RuntimeError):
+        db.init_db()
+
+    assert _user_version() == version
+    assert _schema_sql("half_done") is None
+
+
+def test_prune_rows_deletes_in_batches(fresh_db):
+    db.record_ledger_entries("calendar@example.com", [(f"e{i}", None) for i in range(5)])
+    db._get_conn().execute("UPDATE event_ledger SET created_at = 0 WHERE event_id IN ('e0', 'e1', 'e2')")
+    db._get_conn().commit()
+
+    cutoff = db.retention_cutoffs()["event_ledger"]
+    assert [db.prune_rows("event_ledger", cutoff, 2) for _ in range(3)] == [2, 1, 0]
+    assert db.get_ledger_entries("calendar@example.com", ["e2", "e3", "e4"]).keys() == {"e3", "e4"}
@@ -0,0 +1,187 @@
+# tests/test_run_job.py
+import asyncio
+import gc
+import os
+
+import pytest
+
+import database as db
+import rate_limiter
+import resilience
+# main を読み込むのに必要な設定 (APIは呼ばない)
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ.setdefault("GOOGLE_SERVICE_ACCOUNT_FILE", "/nonexistent/service_account.json")
+
+from job_queue import RetryLater
+
+JOB = {
+    "id": 1, "discord_id": "u1", "message_id": "1", "calendar_id": "calendar@example.com", "content": "明日10時 会議",
+    "attachment_url": None, "attachment_name": None, "events": None,
+    "attempts": 1, "defers": 0, "progress": 0, "created_at": 0,
+}
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSent:
+    async def edit(self, **kwargs):
+        pass
+
+
+class FakeMessage:
+    def __init__(self):
+        self.channel = type("Channel", (), {"typing": lambda self: FakeTyping()})()
+        self.replies = []
+
+    async def reply(self, text: str = "", **kwargs):
+        self.replies.append(text)
+        return FakeSent()
+
+
+@pytest.fixture
+def main(monkeypatch):
+    import main
+
+    async def job_message(job):
+        return FakeMessage()
+
+    monkeypatch.setattr(main, "_job_message", job_message)
+    monkeypatch.setattr(main, "OVERLAP_WARNING", True)
+    return main
+
+
+def _run(main, job: dict, check=None) -> list[dict]:
+    """ジョブを処理し、イベントループが報告したエラーを返す。check はイベントループを止める前に呼ぶ"""
+    errors = []
+
+    async def scenario():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        with pytest.raises(RetryLater):
+            await main._run_job(job)
+        await asyncio.sleep(0.05)
+        gc.collect()
+        if check is not None:
+            check()
+
+    asyncio.run(scenario())
+    return errors
+
+
+def test_unawaited_mirror_sync_is_cancelled(main, monkeypatch):
+    state = {}
+
+    async def ensure_mirror(calendar_id):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    async def parse_and_register(message, job, mirror_sync):
+        await asyncio.sleep(0.01)
+        raise RetryLater(1)
+
+    monkeypatch.setattr(main.gcal, "aensure_mirror", ensure_mirror)
+    monkeypatch.setattr(main, "_parse_and_register", parse_and_register)
+
+    def check():
+        # ジョブが終わった時点で打ち切られている (イベントループの終了を待たない)
+        assert state == {"cancelled": True}
+
+    assert _run(main, JOB, check) == []
+
+
+def test_failed_mirror_sync_is_retrieved(main, monkeypatch):
+    async def ensure_mirror(calendar_id):
+        raise RuntimeError("database is locked")
+
+    async def parse_and_register(message, job, mirror_sync):
+        await asyncio.sleep(0.01)
+        raise RetryLater(1)
+
+    monkeypatch.setattr(main.gcal, "aensure_mirror", ensure_mirror)
+    monkeypatch.setattr(main, "_parse_and_register", parse_and_register)
+
+    # "Task exception was never retrieved" が報告されない
+    assert _run(main, JOB) == []
+
+
+EVENTS = [{"summary": f"会議 {i}", "start_date": "2025-03-01", "start_time": f"1{i}:00:00"} for i in range(3)]
+
+
+@pytest.fixture
+def streaming(main, fresh_db, monkeypatch):
+    """ストリーミング解析で EVENTS を1件ずつ返し、送ったエラー通知を記録する"""
+    webhooks = []
+
+    async def iter_event_details(text):
+        for event in EVENTS:
+            await asyncio.sleep(0.01)
+            yield event, None
+
+    monkeypatch.setattr(main.gemini_handler, "GEMINI_STREAMING", True)
+    monkeypatch.setattr(main.gemini_handler, "iter_event_details", iter_event_details)
+    monkeypatch.setattr(main, "_send_error_webhook", webhooks.append)
+    monkeypatch.setattr(main, "OVERLAP_WARNING", False)
+    monkeypatch.setattr(rate_limiter.calendar_limiter, "_buckets", {})
+
+    db.set_user_state("u1", "waiting_for_details")
+    job_id, _ = db.enqueue_job("u1", "1", "calendar@example.com", JOB["content"], 100)
+    return {**JOB, "id": job_id}, webhooks
+
+
+def _process(main, job: dict) -> FakeMessage:
+    message = FakeMessage()
+    asyncio.run(main._process_message_streaming(message, job))
+    return message
+
+
+def test_streaming_defers_when_calendar_circuit_is_open(main, streaming, monkeypatch):
+    job, webhooks = streaming
+
+    async def insert(events, calendar_id, **kwargs):
+        raise resilience.CircuitOpenError("Google Calendar", 30)
+
+    monkeypatch.setattr(main.gcal, "acreate_calendar_events_batch", insert)
+
+    # 1件も登録していなければジョブごと後回しにする
+    with pytest.raises(RetryLater):
+        asyncio.run(main._run_job(job))
+    assert webhooks == ["Google Calendar 一時停止中"]
+
+
+def test_streaming_marks_later_batches_unavailable_when_circuit_opens(main, streaming, monkeypatch):
+    job, webhooks = streaming
+    calls = []
+
+    async def insert(events, calendar_id, **kwargs):
+        calls.append(len(events))
+        if len(calls) > 1:
+            raise resilience.CircuitOpenError("Google Calendar", 30)
+        return [({"id": f"e{len(calls)}", "htmlLink": "https://example.com"}, None)] * len(events)
+
+    monkeypatch.setattr(main.gcal, "acreate_calendar_events_batch", insert)
+
+    _process(main, job)
+    assert len(calls) > 1
+    assert webhooks == ["カレンダーイベント登録失敗"] * (len(calls) - 1)
+    # 解析結果は保存済みなので、再開しても解析し直さない
+    assert db._get_conn().execute("SELECT events FROM jobs WHERE id = ?", (job["id"],)).fetchone()[0]
+
+
+def test_streaming_reports_connection_errors_like_non_streaming(main, streaming, monkeypatch):
+    job, webhooks = streaming
+
+    async def insert(events, calendar_id, **kwargs):
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(main.gcal, "acreate_calendar_events_batch", insert)
+
+    _process(main, job)
+    assert "Googleカレンダー接続失敗" in webhooks
@@ -0,0 +1,48 @@
+# tests/test_startup.py
+import asyncio
+import os
+import subprocess
+import sys
+
+import database as db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# main を読み込むのに必要な設定 (APIは呼ばない)
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ.setdefault("GOOGLE_SERVICE_ACCOUNT_FILE", "/nonexistent/service_account.json")
+
+# 起動時には読み込まず、最初に使うときに読み込むライブラリ
+LAZY_MODULES = ("google.generativeai", "googleapiclient.discovery", "google.oauth2.service_account", "httplib2")
+
+
+def test_importing_main_skips_heavy_libraries():
+    code = (
+        "import sys, main\n"
+        f"print('loaded:' + ','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "loaded:"
+
+
+def test_commands_are_synced_only_when_changed(fresh_db, monkeypatch):
+    import main
+
+    calls = []
+
+    async def sync():
+        calls.append(1)
+        return []
+
+    monkeypatch.setattr(main.bot.tree, "sync", sync)
+
+    asyncio.run(main._sync_commands())
+    asyncio.run(main._sync_commands())
+    assert len(calls) == 1
+    assert db.get_setting("command_tree_hash") == main._command_tree_hash()
+
+    # コマンド定義が変わったら同期し直す
+    db.save_setting("command_tree_hash", "outdated")
+    asyncio.run(main._sync_commands())
+    assert len(calls) == 2
@@ -0,0 +1,43 @@
+# tests/test_timeouts.py
+import asyncio
+import time
+
+import database as db
+from timeout_scheduler import TimeoutScheduler
+
+
+def test_clear_expired_user_state_keeps_newer_state(fresh_db):
+    db.set_user_state("u1", "waiting_for_details")
+
+    # 期限の判定より後に設定された状態は消さない
+    assert db.clear_expired_user_state("u1", time.time() - 300) is False
+    assert db.get_user_state("u1") == "waiting_for_details"
+
+    assert db.clear_expired_user_state("u1", time.time() + 1) is True
+    assert db.get_user_state("u1") is None
+    assert db.clear_expired_user_state("u1", time.time() + 1) is False
+
+
+def test_scheduler_expires_only_the_latest_deadline():
+    expired = []
+
+    async def on_expire(discord_id: str):
+        expired.append((discord_id, time.monotonic()))
+
+    async def scenario():
+        scheduler = TimeoutScheduler(0.2, on_expire)
+        scheduler.start([])
+        started = time.monotonic()
+        scheduler.on_state_change("u1", "waiting_for_details")
+        scheduler.on_state_change("u2", "waiting_for_details")
+        await asyncio.sleep(0.1)
+        # 期限の前に状態が更新されたユーザーは、新しい期限まで待つ
+        scheduler.on_state_change("u1", "waiting_for_details")
+        # 状態が消えたユーザーは期限切れにしない
+        scheduler.on_state_change("u2", None)
+        await asyncio.sleep(0.4)
+        return started
+
+    started = asyncio.run(scenario())
+    assert [discord_id for discord_id, _ in expired] == ["u1"]
+    assert expired[0][1] - started >= 0.25
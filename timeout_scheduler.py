@@ -0,0 +1,92 @@
+# timeout_scheduler.py
+import asyncio
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable
+
+
+class TimeoutScheduler:
+    """
+    対話状態の期限をヒープで管理し、期限が来たユーザーだけを処理する。
+    database の状態変更通知 (add_state_listener) から期限を更新する。
+    """
+
+    def __init__(self, timeout_seconds: float, on_expire: Callable[[str], Awaitable[None]], max_concurrency: int = 10):
+        self.timeout_seconds = timeout_seconds
+        self._on_expire = on_expire
+        self._max_concurrency = max_concurrency
+        # (期限のUNIX秒, discord_id)。期限の更新・取り消しは _deadlines を正として遅延削除する
+        self._heap: list[tuple[float, str]] = []
+        self._deadlines: dict[str, float] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._runner: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self, states: list[tuple[str, int]]):
+        """SQLite上の状態から期限を再構築して監視を始める (起動時に1回だけ呼ぶ)"""
+        if self._runner is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        for discord_id, started_at in states:
+            self._apply(discord_id, "restored", started_at)
+        self._runner = asyncio.create_task(self._run())
+
+    def on_state_change(self, discord_id: str, state: str | None):
+        """状態変更の通知を受け取る (DBスレッドから呼ばれる)"""
+        now = time.time()
+        if self._loop is None:
+            self._apply(discord_id, state, now)
+        else:
+            self._loop.call_soon_threadsafe(self._apply, discord_id, state, now)
+
+    def pending_count(self) -> int:
+        """期限待ちのユーザー数"""
+        return len(self._deadlines)
+
+    def _apply(self, discord_id: str, state: str | None, started_at: float):
+        if state is None:
+            self._deadlines.pop(discord_id, None)
+            return
+
+        deadline = started_at + self.timeout_seconds
+        self._deadlines[discord_id] = deadline
+        heapq.heappush(self._heap, (deadline, discord_id))
+
+        # 取り消し済みのエントリが溜まりすぎたら作り直す
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(d, uid) for uid, d in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                deadline, discord_id = heapq.heappop(self._heap)
+                if self._deadlines.get(discord_id) != deadline:
+                    continue  # 更新・取り消し済み
+                del self._deadlines[discord_id]
+                task = asyncio.create_task(self._expire(discord_id))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _expire(self, discord_id: str):
+        async with self._semaphore:
+            try:
+                await self._on_expire(discord_id)
+            except Exception as e:
+                logging.error(f"Timeout handler failed for {discord_id}: {e}")
@@ -0,0 +1,110 @@
+# webhook_dispatcher.py
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+import aiohttp
+
+
+class WebhookDispatcher:
+    """
+    エラー通知をバックグラウンドでDiscord Webhookへ送る。
+    同じ種類のエラーは window 秒ごとに1通にまとめ、429 の retry_after を守る。
+    """
+
+    def __init__(self, get_url: Callable[[], Awaitable[str | None]], window: float = 60, max_queue: int = 1000, max_retries: int = 3):
+        self._get_url = get_url
+        self.window = window
+        self.max_retries = max_retries
+        self.dropped = 0
+        self._queue: asyncio.Queue[str] = asyncio.Queue(maxsize=max_queue)
+        # エラー種別 -> [まとめ期間の開始時刻, 期間中に抑止した件数]
+        self._windows: dict[str, list] = {}
+        self._session: aiohttp.ClientSession | None = None
+        self._runner: asyncio.Task | None = None
+
+    def start(self):
+        """送信用のタスクを開始する (2回目以降は何もしない)"""
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+
+    def notify(self, error_type: str):
+        """エラーを通知キューに積む。待たずにすぐ戻る"""
+        try:
+            self._queue.put_nowait(error_type)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def post(self, url: str, payload: dict) -> int:
+        """共有セッションでWebhookに送信し、HTTPステータスを返す。429の場合は待って再送する"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+
+        for _ in range(self.max_retries):
+            async with self._session.post(url, json=payload) as resp:
+                if resp.status != 429:
+                    return resp.status
+                retry_after = await self._retry_after(resp)
+            logging.warning(f"Webhook rate limited, retrying after {retry_after:.1f}s")
+            await asyncio.sleep(retry_after)
+        return 429
+
+    @staticmethod
+    async def _retry_after(resp: aiohttp.ClientResponse) -> float:
+        try:
+            return float((await resp.json()).get("retry_after", 1))
+        except Exception:
+            return float(resp.headers.get("Retry-After", 1))
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            next_flush = min((start + self.window for start, _ in self._windows.values()), default=None)
+            timeout = max(0, next_flush - now) if next_flush is not None else None
+
+            try:
+                error_type = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                error_type = None
+
+            try:
+                if error_type is not None:
+                    await self._handle(error_type)
+                await self._flush_expired()
+            except Exception as e:
+                logging.error(f"Webhook送信エラー: {e}")
+
+    async def _handle(self, error_type: str):
+        window = self._windows.get(error_type)
+        if window is not None:
+            window[1] += 1
+            return
+        # 期間内の最初の1件はすぐに送る
+        self._windows[error_type] = [time.monotonic(), 0]
+        await self._send(f"⚠️ カレンダーBotでエラーが発生しました: **{error_type}**")
+
+    async def _flush_expired(self):
+        now = time.monotonic()
+        for error_type, (start, suppressed) in list(self._windows.items()):
+            if start + self.window > now:
+                continue
+            if suppressed:
+                # まとめて1通送り、新しい期間を始める
+                self._windows[error_type] = [now, 0]
+                await self._send(
+                    f"⚠️ カレンダーBotでエラーが発生しました: **{error_type}** ×{suppressed} (直近{int(self.window)}秒)"
+                )
+            else:
+                del self._windows[error_type]
+
+    async def _send(self, content: str):
+        webhook_url = await self._get_url()
+        if not webhook_url:
+            return
+        status = await self.post(webhook_url, {"content": content})
+        if status >= 400:
+            logging.error(f"Webhook送信失敗: HTTP {status}")